@@ -0,0 +1,87 @@
+import os, hashlib, json, threading, time
+from supabase import create_client
+from local_store import connect, store_path
+
+SUPABASE_URL = os.environ.get("SUPABASE_URL")
+SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
+supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+ANNOUNCEMENT_TTL     = float(os.environ.get("ANNOUNCEMENT_TTL", 300))
+ANNOUNCEMENT_MAX_AGE = int(os.environ.get("ANNOUNCEMENT_MAX_AGE", 30))
+ANNOUNCEMENT_DB      = os.environ.get("ANNOUNCEMENT_DB") or store_path("announcements.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache_versions (
+    name    TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+"""
+
+# ── Active announcement cache ────────────────────────────
+class AnnouncementCache:
+    """
+    The active announcement held in memory, with an ETag over its JSON.
+
+    invalidate() bumps a version number in a SQLite file shared by the
+    workers on the host, so every worker reloads on its next read. The TTL
+    is a backstop for changes made outside the admin routes or on other
+    hosts. Reloads are single-flight: one request queries the DB, and
+    concurrent requests keep serving the previous value (or wait for the
+    first load when there is none).
+    """
+
+    def __init__(self, ttl=ANNOUNCEMENT_TTL, path=ANNOUNCEMENT_DB):
+        self.ttl = ttl
+        self.path = path
+        self.value = None       # (announcement, etag)
+        self.loaded_at = 0.0
+        self.version = None
+        self.loads = 0
+        self._lock = threading.Lock()
+
+    def _shared_version(self):
+        row = connect(self.path, SCHEMA).execute(
+            "SELECT version FROM cache_versions WHERE name = 'announcement'").fetchone()
+        return row[0] if row else 0
+
+    def _fresh(self, version):
+        return self.value is not None and self.version == version and time.time() - self.loaded_at < self.ttl
+
+    def get(self):
+        """Returns (announcement or None, etag)"""
+        version = self._shared_version()
+        if self._fresh(version):
+            return self.value
+        # Another request is already reloading: serve the previous value meanwhile
+        if not self._lock.acquire(blocking=self.value is None):
+            return self.value
+        try:
+            if not self._fresh(version):
+                try:
+                    self._load(version)
+                except Exception as e:
+                    if self.value is None:
+                        raise
+                    print(f"Announcement reload failed, serving cached copy: {e}")
+            return self.value
+        finally:
+            self._lock.release()
+
+    def _load(self, version):
+        rows = supabase.table("announcements").select("*").eq("is_active", True) \
+            .order("created_at", desc=True).limit(1).execute()
+        announcement = rows.data[0] if rows.data else None
+        body = json.dumps(announcement, sort_keys=True, default=str)
+        self.value = (announcement, hashlib.sha1(body.encode()).hexdigest())
+        self.version = version
+        self.loaded_at = time.time()
+        self.loads += 1
+
+    def invalidate(self):
+        connect(self.path, SCHEMA).execute(
+            "INSERT INTO cache_versions VALUES ('announcement', 1) "
+            "ON CONFLICT (name) DO UPDATE SET version = version + 1"
+        )
+        self.loaded_at = 0.0
+
+announcement_cache = AnnouncementCache()
@@ -0,0 +1,35 @@
+import hashlib, math
+
+# ── Bloom filter ─────────────────────────────────────────
+class BloomFilter:
+    """
+    Fixed-size bloom filter over str keys. A negative answer is exact; a
+    positive answer may be a false positive at roughly fp_rate once
+    `capacity` keys have been added.
+    """
+
+    def __init__(self, capacity=100000, fp_rate=0.001):
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.size = max(8, int(-capacity * math.log(fp_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(str(key).encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    @property
+    def saturated(self):
+        return self.count >= self.capacity
@@ -1,9 +1,13 @@
 import os
+import json
 import requests
-from flask import Blueprint, request, jsonify
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone, timedelta
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from supabase import create_client, Client
 from config import SUPABASE_URL, SUPABASE_KEY
 from utils import decode_jwt
+from rate_limiter import rate_limit
 
 chat_bp = Blueprint("chat", __name__)
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
@@ -11,6 +15,9 @@ supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 GEMINI_API_KEY = os.environ.get("OPENROUTER_API_KEY")
 GEMINI_URL = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent"
 
+BATCH_MAX_QUESTIONS = int(os.environ.get("CHAT_BATCH_MAX_QUESTIONS", 10))
+BATCH_CONCURRENCY   = int(os.environ.get("CHAT_BATCH_CONCURRENCY", 4))
+
 SYSTEM_PROMPT = """You are Protege, an AI-powered voice calculator and academic assistant. 
 You specialise in:
 - Mathematics (basic arithmetic, algebra, calculus, statistics, further maths)
@@ -72,6 +79,15 @@ def save_message(user_id, role, content):
     except Exception as e:
         print(f"⚠️ Failed to save message: {e}")
 
+def save_messages(rows):
+    """Persist many conversation rows in a single insert"""
+    if not rows:
+        return
+    try:
+        supabase.table("conversations").insert(rows).execute()
+    except Exception as e:
+        print(f"⚠️ Failed to save {len(rows)} messages: {e}")
+
 # --- AI Call ---
 def call_ai(messages):
     contents = []
@@ -108,6 +124,7 @@ def call_ai(messages):
 
 # --- Routes ---
 @chat_bp.route("/api/chat", methods=["POST"])
+@rate_limit(max_calls=20, window=60)
 def chat():
     user, error = get_user_from_token()
     if error:
@@ -134,6 +151,67 @@ def chat():
     save_message(user_id, "assistant", reply)
     return jsonify({"success": True, "reply": reply})
 
+@chat_bp.route("/api/chat/batch", methods=["POST"])
+@rate_limit(max_calls=5, window=60)
+def chat_batch():
+    """Answer a worksheet of questions concurrently, streaming NDJSON results as each finishes"""
+    user, error = get_user_from_token()
+    if error:
+        return jsonify({"success": False, "message": error}), 401
+
+    data = request.json or {}
+    questions = data.get("questions")
+
+    if not isinstance(questions, list) or not questions:
+        return jsonify({"success": False, "message": "questions must be a non-empty list"}), 400
+    if len(questions) > BATCH_MAX_QUESTIONS:
+        return jsonify({"success": False, "message": f"Too many questions (max {BATCH_MAX_QUESTIONS})"}), 400
+
+    questions = [str(q or "").strip() for q in questions]
+    for i, q in enumerate(questions):
+        if not q:
+            return jsonify({"success": False, "message": f"Question {i + 1} is empty"}), 400
+        if len(q) > 2000:
+            return jsonify({"success": False, "message": f"Question {i + 1} too long (max 2000 chars)"}), 400
+
+    user_id = user["id"]
+    # One history read shared by every question in the batch
+    history = get_history(user_id, limit=20)
+
+    def generate():
+        replies = {}
+        pool = ThreadPoolExecutor(max_workers=min(BATCH_CONCURRENCY, len(questions)))
+        try:
+            futures = {
+                pool.submit(call_ai, history + [{"role": "user", "content": q}]): i
+                for i, q in enumerate(questions)
+            }
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    replies[i] = future.result()
+                    result = {"index": i, "success": True, "reply": replies[i]}
+                except Exception as e:
+                    print(f"❌ AI error (batch item {i}): {e}")
+                    result = {"index": i, "success": False, "message": "AI service error. Try again shortly."}
+                yield json.dumps(result) + "\n"
+            yield json.dumps({"done": True, "answered": len(replies), "total": len(questions)}) + "\n"
+        finally:
+            # Runs even if the client disconnects mid-stream
+            pool.shutdown(wait=True, cancel_futures=True)
+            base = datetime.now(timezone.utc)
+            rows = []
+            for i, q in enumerate(questions):
+                rows.append({"user_id": user_id, "role": "user", "content": q})
+                if i in replies:
+                    rows.append({"user_id": user_id, "role": "assistant", "content": replies[i]})
+            # Explicit timestamps keep question/answer order stable within one insert
+            for n, row in enumerate(rows):
+                row["created_at"] = (base + timedelta(microseconds=n)).isoformat()
+            save_messages(rows)
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
 @chat_bp.route("/api/chat/history", methods=["GET"])
 def chat_history():
     user, error = get_user_from_token()
@@ -0,0 +1,112 @@
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from supabase import create_client
+from pagination import fetch_page
+from datetime import datetime, timezone
+import os, csv, io, json, zlib
+
+SUPABASE_URL = os.environ.get("SUPABASE_URL")
+SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
+ADMIN_SECRET = os.environ.get("ADMIN_SECRET", "protege_admin_2024")
+supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+EXPORT_PAGE_SIZE = int(os.environ.get("EXPORT_PAGE_SIZE", 1000))
+
+export_bp = Blueprint("export", __name__)
+
+# Exportable tables and the columns written for each
+EXPORTS = {
+    "transactions": ("transactions", ["id", "user_id", "type", "amount", "description", "created_at"]),
+    "withdrawals": ("withdrawal_requests", ["id", "user_id", "amount", "method", "address", "account_name",
+                                            "status", "admin_note", "created_at"]),
+    "crypto_transactions": ("crypto_transactions", ["id", "user_id", "type", "amount", "status", "tx_hash",
+                                                    "asset", "destination", "withdraw_type", "created_at"]),
+}
+
+# ── Row stream ───────────────────────────────────────────
+def iter_rows(table, columns, filters):
+    """Walk the table oldest-first with keyset cursors; only one page is held in memory"""
+    cursor = None
+    while True:
+        query = supabase.table(table).select(",".join(columns))
+        if filters.get("user_id"):
+            query = query.eq("user_id", filters["user_id"])
+        if filters.get("status"):
+            query = query.eq("status", filters["status"])
+        if filters.get("from"):
+            query = query.gte("created_at", filters["from"])
+        if filters.get("to"):
+            query = query.lt("created_at", filters["to"])
+        rows, cursor = fetch_page(query, cursor, EXPORT_PAGE_SIZE, desc=False)
+        yield from rows
+        if not cursor:
+            return
+
+def encode_csv(rows, columns):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns)
+    for n, row in enumerate(rows, 1):
+        writer.writerow([row.get(c) for c in columns])
+        # Flush in chunks rather than per row
+        if n % 500 == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    buf.seek(0)
+    yield buf.read()
+
+def encode_ndjson(rows):
+    chunk = []
+    for row in rows:
+        chunk.append(json.dumps(row, default=str))
+        if len(chunk) == 500:
+            yield "\n".join(chunk) + "\n"
+            chunk = []
+    if chunk:
+        yield "\n".join(chunk) + "\n"
+
+def gzip_stream(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 -> gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+# ════════════════════════════════════════════════════════
+#  EXPORT ROUTES
+# ════════════════════════════════════════════════════════
+
+@export_bp.route("/api/admin/export/<name>", methods=["GET"])
+def export(name):
+    if request.headers.get("X-Admin-Key") != ADMIN_SECRET:
+        return jsonify({"success": False, "message": "Unauthorized"}), 403
+    if name not in EXPORTS:
+        return jsonify({"success": False, "message": f"Unknown export: {name}"}), 404
+
+    fmt = request.args.get("format", "csv")
+    if fmt not in ["csv", "ndjson"]:
+        return jsonify({"success": False, "message": "format must be csv or ndjson"}), 400
+    gzipped = request.args.get("gzip") in ["1", "true"]
+
+    table, columns = EXPORTS[name]
+    filters = {k: request.args.get(k) for k in ["user_id", "status", "from", "to"]}
+    if name == "transactions":
+        filters.pop("status")
+
+    rows = iter_rows(table, columns, filters)
+    body = encode_csv(rows, columns) if fmt == "csv" else encode_ndjson(rows)
+
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
+    filename = f"{name}-{stamp}.{fmt}"
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    if gzipped:
+        body = gzip_stream(body)
+        filename += ".gz"
+        mimetype = "application/gzip"
+
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
@@ -0,0 +1,42 @@
+import os, threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+FANOUT_WORKERS = int(os.environ.get("FANOUT_WORKERS", 16))
+FANOUT_TIMEOUT = float(os.environ.get("FANOUT_TIMEOUT", 5))
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+def _executor():
+    global _pool, _pool_pid
+    if _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool_pid != os.getpid():
+                _pool = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix="fanout")
+                _pool_pid = os.getpid()
+    return _pool
+
+# ── Concurrent independent reads ─────────────────────────
+def gather(tasks, timeout=FANOUT_TIMEOUT):
+    """
+    Run independent calls concurrently on a shared thread pool.
+
+    tasks: {name: zero-arg callable}, e.g. lambda: supabase.table(...).execute()
+    Returns (results, errors): results maps name -> return value for calls
+    that finished in time; errors maps name -> message for calls that raised
+    or missed the deadline. Latency is the slowest call, not the sum.
+    """
+    futures = {_executor().submit(fn): name for name, fn in tasks.items()}
+    done, pending = wait(futures, timeout=timeout)
+    results, errors = {}, {}
+    for future in done:
+        name = futures[future]
+        try:
+            results[name] = future.result()
+        except Exception as e:
+            errors[name] = str(e)
+    for future in pending:
+        future.cancel()
+        errors[futures[future]] = f"timed out after {timeout}s"
+    return results, errors
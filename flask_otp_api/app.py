@@ -1,15 +1,32 @@
 import os
 import random
 import string
+import uuid
 from flask import Flask, request, jsonify
 from supabase import create_client, Client
 from config import SUPABASE_URL, SUPABASE_KEY
 from utils import create_jwt, decode_jwt
+from rate_limiter import rate_limit
+import ledger
+import history
+import jobs
+from tx_writer import tx_writer
+import platform_stats
+from pagination import page_limit, fetch_page
+from fanout import gather
+from signup_index import signup_signals
+from user_purge import purge_jobs, delete_users, parse_user_ids, PURGE_MAX_IDS
+from password_pool import hash_password, verify_password, PasswordPoolBusy
 from flask_cors import CORS
 from chat import chat_bp
 from wallet import wallet
 from leader import leader_bp
 from game_server import game_bp
+from export import export_bp
+from referral_graph import referrals_bp, referral_graph
+from announcements import announcement_cache, ANNOUNCEMENT_MAX_AGE
+from wallet_sessions import wallet_sessions
+from fx_rate import fx
 
 app = Flask(__name__)
 CORS(app, resources={r"/api/*": {"origins": "*"}})
@@ -17,13 +34,23 @@ app.register_blueprint(chat_bp)
 app.register_blueprint(wallet)
 app.register_blueprint(leader_bp)
 app.register_blueprint(game_bp)
+app.register_blueprint(export_bp)
+app.register_blueprint(referrals_bp)
 
 print("🚀 APP STARTING...")
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
-USD_TO_NGN = 1600
+@app.before_request
+def start_background_jobs():
+    # Background threads do not survive a fork; start them in each worker
+    platform_stats.start_reconciler()
+    purge_jobs.ensure_started()
+    signup_signals.ensure_started()
+    referral_graph.ensure_started()
+    jobs.queue.ensure_started()
+    tx_writer.ensure_started()
 
+supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
 def generate_referral_code(length=6):
     return ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
@@ -49,16 +76,41 @@ def get_request_ip():
     return request.headers.get("X-Forwarded-For", request.remote_addr)
 
 
-def save_transaction(user_id, tx_type, amount, description):
+def save_transaction(user_id, tx_type, amount, description, dedup_key=None, sync=False):
+    """
+    Spool a transactions row for the batching writer. With sync=True the row
+    is written before returning (for admin routes). Returns False if the
+    row could not be spooled or, with sync, not written yet.
+    """
+    # One key for both paths, so a spool write that half-succeeded and the
+    # inline fallback cannot log the row twice
+    dedup_key = dedup_key or uuid.uuid4().hex
     try:
-        supabase.table("transactions").insert({
-            "user_id": user_id,
-            "type": tx_type,
-            "amount": amount,
-            "description": description
-        }).execute()
+        tx_writer.write(user_id, tx_type, amount, description, dedup_key)
+        return tx_writer.flush([dedup_key]) if sync else True
     except Exception as e:
-        print(f"⚠️ Failed to save transaction: {e}")
+        print(f"⚠️ Transaction spool failed, writing inline: {e}")
+        try:
+            supabase.table("transactions").upsert({
+                "user_id": user_id,
+                "type": tx_type,
+                "amount": amount,
+                "description": description,
+                "dedup_key": dedup_key
+            }, on_conflict="dedup_key", ignore_duplicates=True).execute()
+            history.invalidate(user_id)
+            return True
+        except Exception as e:
+            print(f"⚠️ Failed to save transaction: {e}")
+            return False
+
+
+@jobs.queue.handler("save_transaction", with_key=True)
+def save_queued_transaction(user_id, tx_type, amount, description, job_key):
+    # save_transaction jobs queued before rows went through tx_writer; the
+    # job key makes a retried or requeued job a no-op
+    if not save_transaction(user_id, tx_type, amount, description, dedup_key=job_key):
+        raise Exception("Transaction could not be saved")
 
 
 @app.route("/")
@@ -68,10 +120,11 @@ def home():
 
 @app.route("/api/rate", methods=["GET"])
 def get_rate():
-    return jsonify({"success": True, "usd_to_ngn": USD_TO_NGN})
+    return jsonify({"success": True, "usd_to_ngn": fx.get(), "updated_at": fx.stats()["updated_at"]})
 
 
 @app.route("/api/signup", methods=["POST"])
+@rate_limit(max_calls=5, window=3600, strict=True)
 def signup():
     data = request.json
     phone = data.get("phone")
@@ -83,52 +136,97 @@ def signup():
 
     if not phone or not name or not password or not device_id:
         return jsonify({"success": False, "message": "Phone, name, password and device_id required"}), 400
+    if not isinstance(password, str):
+        return jsonify({"success": False, "message": "Password must be a string"}), 400
+
+    # Answer phone/IP/device checks from the signup index; only values it
+    # cannot rule out (and the referrer, whose balance we need) hit the DB
+    signals = signup_signals.lookup(phone, signup_ip, device_id)
+    reads = {}
+    if signals["phone"] != 0:
+        reads["existing"] = lambda: supabase.table("users").select("id").eq("phone", phone).execute()
+    if signals["ip"] is None:
+        reads["ip_users"] = lambda: supabase.table("users").select("id").eq("signup_ip", signup_ip).execute()
+    if signals["device"] is None:
+        reads["device_users"] = lambda: supabase.table("users").select("id").eq("device_id", device_id).execute()
+    if referral_input:
+        reads["referrer"] = lambda: supabase.table("users").select("*").eq("referral_code", referral_input).execute()
+    results, errors = gather(reads)
+    if errors:
+        print(f"Signup lookups failed: {errors}")
+        return jsonify({"success": False, "message": "Server busy. Try again shortly."}), 503
 
-    existing = supabase.table("users").select("id").eq("phone", phone).execute()
-    if existing.data:
+    if "existing" in results and results["existing"].data:
         return jsonify({"success": False, "message": "User already exists"}), 400
 
-    ip_users = supabase.table("users").select("id").eq("signup_ip", signup_ip).execute()
-    ip_limit_reached = len(ip_users.data) >= 3
-
-    device_users = supabase.table("users").select("id").eq("device_id", device_id).execute()
-    device_used = len(device_users.data) > 0
+    ip_count = signals["ip"] if "ip_users" not in results else len(results["ip_users"].data)
+    device_count = signals["device"] if "device_users" not in results else len(results["device_users"].data)
+    ip_limit_reached = ip_count >= 3
+    device_used = device_count > 0
 
     referrer_user = None
     give_bonus = False
     if referral_input:
-        referrer = supabase.table("users").select("*").eq("referral_code", referral_input).execute()
+        referrer = results["referrer"]
         if not referrer.data:
             return jsonify({"success": False, "message": "Invalid referral code"}), 400
         referrer_user = referrer.data[0]
         if not ip_limit_reached and not device_used and referrer_user["device_id"] != device_id:
-            give_bonus = True
+            # The index can lag signups made in other workers; a bonus is only
+            # granted on counts confirmed in the DB
+            confirm = {}
+            if "ip_users" not in results:
+                confirm["ip_users"] = lambda: supabase.table("users").select("id").eq("signup_ip", signup_ip).limit(3).execute()
+            if "device_users" not in results:
+                confirm["device_users"] = lambda: supabase.table("users").select("id").eq("device_id", device_id).limit(1).execute()
+            confirmed, errors = gather(confirm)
+            if errors:
+                print(f"Signup bonus checks failed: {errors}")
+                return jsonify({"success": False, "message": "Server busy. Try again shortly."}), 503
+            results.update(confirmed)
+            ip_limit_reached = len(results["ip_users"].data) >= 3
+            device_used = len(results["device_users"].data) > 0
+            give_bonus = not ip_limit_reached and not device_used
+
+    try:
+        password_hash = hash_password(password)
+    except PasswordPoolBusy:
+        return jsonify({"success": False, "message": "Server busy. Try again shortly."}), 503
 
     my_code = generate_referral_code()
-    new_user = supabase.table("users").insert({
-        "phone": phone,
-        "name": name,
-        "password": password,
-        "referral_code": my_code,
-        "referred_by": referral_input if referral_input else None,
-        "balance": 0,
-        "total_referrals": 0,
-        "signup_ip": signup_ip,
-        "device_id": device_id,
-        "is_verified": True
-    }).execute()
+    try:
+        new_user = supabase.table("users").insert({
+            "phone": phone,
+            "name": name,
+            "password": password_hash,
+            "referral_code": my_code,
+            "referred_by": referral_input if referral_input else None,
+            "balance": 0,
+            "total_referrals": 0,
+            "signup_ip": signup_ip,
+            "device_id": device_id,
+            "is_verified": True
+        }).execute()
+    except Exception as e:
+        # users_phone_key catches duplicates the signup index had not seen yet
+        if "23505" in str(e) or "duplicate key" in str(e):
+            return jsonify({"success": False, "message": "User already exists"}), 400
+        raise
 
     user = new_user.data[0]
     user_id = user["id"]
+    signup_signals.record(phone, signup_ip, device_id, user_id)
 
     if give_bonus and referrer_user:
         supabase.table("users").update({
             "balance": float(referrer_user["balance"]) + 0.1,
             "total_referrals": referrer_user["total_referrals"] + 1
         }).eq("id", referrer_user["id"]).execute()
-        save_transaction(referrer_user["id"], "referral_bonus", 0.10, f"Referral bonus — {name} joined")
+        save_transaction(referrer_user["id"], "referral_bonus", 0.10, f"Referral bonus — {name} joined",
+                         dedup_key=f"referral_bonus:{user_id}")
         supabase.table("users").update({"balance": 0.5}).eq("id", user_id).execute()
-        save_transaction(user_id, "signup_bonus", 0.50, f"Welcome bonus — joined with referral code {referral_input}")
+        save_transaction(user_id, "signup_bonus", 0.50, f"Welcome bonus — joined with referral code {referral_input}",
+                         dedup_key=f"signup_bonus:{user_id}")
 
     token = create_jwt({"user_id": user_id})
     return jsonify({
@@ -141,21 +239,35 @@ def signup():
 
 
 @app.route("/api/login", methods=["POST"])
+@rate_limit(max_calls=10, window=300, strict=True)
 def login():
     data = request.json
     phone = data.get("phone")
     password = data.get("password")
     if not phone or not password:
         return jsonify({"success": False, "message": "Phone and password required"}), 400
+    if not isinstance(password, str):
+        return jsonify({"success": False, "message": "Password must be a string"}), 400
 
     user = supabase.table("users").select("*").eq("phone", phone).execute()
     if not user.data:
         return jsonify({"success": False, "message": "User not found"}), 404
 
     user = user.data[0]
-    if user["password"] != password:
+    try:
+        valid, new_hash = verify_password(password, user["password"])
+    except PasswordPoolBusy:
+        return jsonify({"success": False, "message": "Server busy. Try again shortly."}), 503
+    if not valid:
         return jsonify({"success": False, "message": "Invalid password"}), 400
 
+    # Upgrade legacy plaintext (or old-cost) passwords transparently
+    if new_hash:
+        try:
+            supabase.table("users").update({"password": new_hash}).eq("id", user["id"]).execute()
+        except Exception as e:
+            print(f"⚠️ Failed to rehash password: {e}")
+
     token = create_jwt({"user_id": user["id"]})
     return jsonify({"success": True, "token": token})
 
@@ -211,10 +323,15 @@ def change_password():
         return jsonify({"success": False, "message": "Old and new password required"}), 400
     if len(new_password) < 6:
         return jsonify({"success": False, "message": "New password must be at least 6 characters"}), 400
-    if user["password"] != old_password:
-        return jsonify({"success": False, "message": "Current password is incorrect"}), 400
-
-    supabase.table("users").update({"password": new_password}).eq("id", user["id"]).execute()
+    try:
+        valid, _ = verify_password(old_password, user["password"])
+        if not valid:
+            return jsonify({"success": False, "message": "Current password is incorrect"}), 400
+        new_hash = hash_password(new_password)
+    except PasswordPoolBusy:
+        return jsonify({"success": False, "message": "Server busy. Try again shortly."}), 503
+
+    supabase.table("users").update({"password": new_hash}).eq("id", user["id"]).execute()
     return jsonify({"success": True, "message": "Password changed successfully"})
 
 
@@ -231,6 +348,7 @@ def set_withdrawal_pin():
         return jsonify({"success": False, "message": "PIN must be 4 to 6 digits"}), 400
 
     supabase.table("users").update({"withdrawal_pin": pin}).eq("id", user["id"]).execute()
+    wallet_sessions.revoke_user(user["id"])
     return jsonify({"success": True, "message": "Withdrawal PIN set successfully"})
 
 
@@ -256,6 +374,7 @@ def change_withdrawal_pin():
         return jsonify({"success": False, "message": "Current PIN is incorrect"}), 400
 
     supabase.table("users").update({"withdrawal_pin": new_pin}).eq("id", user["id"]).execute()
+    wallet_sessions.revoke_user(user["id"])
     return jsonify({"success": True, "message": "Withdrawal PIN changed successfully"})
 
 
@@ -273,12 +392,15 @@ def withdraw():
     pin = str(data.get("pin", "")).strip()
     currency = data.get("currency", "usd")
 
-    amount_usd = amount_raw / USD_TO_NGN if currency == "ngn" else amount_raw
+    usd_to_ngn = fx.get()  # one rate for the whole request
+    if not fx.ready:
+        return jsonify({"success": False, "message": "Exchange rate unavailable. Try again shortly."}), 503
+    amount_usd = amount_raw / usd_to_ngn if currency == "ngn" else amount_raw
 
     if amount_usd <= 0:
         return jsonify({"success": False, "message": "Invalid amount"}), 400
     if amount_usd < 1.0:
-        return jsonify({"success": False, "message": "Minimum withdrawal is $1.00 (₦{:,.0f})".format(USD_TO_NGN)}), 400
+        return jsonify({"success": False, "message": "Minimum withdrawal is $1.00 (₦{:,.0f})".format(usd_to_ngn)}), 400
     if float(user["balance"]) < amount_usd:
         return jsonify({"success": False, "message": "Insufficient balance"}), 400
 
@@ -312,7 +434,7 @@ def withdraw():
     new_balance = float(user["balance"]) - amount_usd
     supabase.table("users").update({"balance": new_balance}).eq("id", user["id"]).execute()
 
-    supabase.table("withdrawal_requests").insert({
+    withdrawal = supabase.table("withdrawal_requests").insert({
         "user_id": user["id"],
         "amount": amount_usd,
         "method": method,
@@ -322,7 +444,7 @@ def withdraw():
     }).execute()
 
     desc = f"Withdrawal via {method_label} to {account_name + ' | ' if account_name else ''}{address}"
-    save_transaction(user["id"], "withdraw", -amount_usd, desc)
+    save_transaction(user["id"], "withdraw", -amount_usd, desc, dedup_key=f"withdraw:{withdrawal.data[0]['id']}")
 
     return jsonify({
         "success": True,
@@ -346,6 +468,7 @@ def get_withdrawals():
 
 
 @app.route("/api/transfer", methods=["POST"])
+@rate_limit(max_calls=10, window=60)
 def transfer():
     user, error = get_current_user()
     if error:
@@ -372,44 +495,25 @@ def transfer():
     if user["withdrawal_pin"] != pin:
         return jsonify({"success": False, "message": "Incorrect withdrawal PIN"}), 403
 
-    recipient = supabase.table("users").select("*").eq("phone", to_phone).execute()
-    if not recipient.data:
-        return jsonify({"success": False, "message": "Recipient not found. Check the phone number."}), 404
-    recipient = recipient.data[0]
-
-    new_sender_balance = float(user["balance"]) - amount
-    supabase.table("users").update({"balance": new_sender_balance}).eq("id", user["id"]).execute()
-    save_transaction(user["id"], "transfer", -amount, f"Transfer to {recipient['name']}|{to_phone}")
-
-    new_recipient_balance = float(recipient["balance"]) + amount
-    supabase.table("users").update({"balance": new_recipient_balance}).eq("id", recipient["id"]).execute()
-    save_transaction(recipient["id"], "transfer", amount, f"Transfer from {user['name']}|{user['phone']}")
-
-    try:
-        existing = supabase.table("recent_transfers").select("*").eq("user_id", user["id"]).eq("recipient_phone", to_phone).execute()
-        if existing.data:
-            supabase.table("recent_transfers").update({
-                "last_amount": amount,
-                "recipient_name": recipient["name"],
-                "transfer_count": existing.data[0]["transfer_count"] + 1,
-                "last_transferred_at": "now()"
-            }).eq("id", existing.data[0]["id"]).execute()
-        else:
-            supabase.table("recent_transfers").insert({
-                "user_id": user["id"],
-                "recipient_phone": to_phone,
-                "recipient_name": recipient["name"],
-                "last_amount": amount,
-                "transfer_count": 1
-            }).execute()
-    except Exception as e:
-        print(f"⚠️ Failed to save recent transfer: {e}")
+    # Debit, credit, transaction log and recent_transfers upsert in one atomic RPC
+    result = ledger.transfer(user["id"], to_phone, amount)
+    if not result["ok"]:
+        err = result["error"]
+        if err == "recipient_not_found":
+            return jsonify({"success": False, "message": "Recipient not found. Check the phone number."}), 404
+        if err == "insufficient_balance":
+            return jsonify({"success": False, "message": "Insufficient balance"}), 400
+        if err == "self_transfer":
+            return jsonify({"success": False, "message": "Cannot transfer to yourself"}), 400
+        if err == "invalid_amount":
+            return jsonify({"success": False, "message": "Invalid amount"}), 400
+        return jsonify({"success": False, "message": "Transfer failed. Try again shortly."}), 503
 
     return jsonify({
         "success": True,
-        "message": f"${amount:.2f} transferred to {recipient['name']} successfully!",
-        "recipient_name": recipient["name"],
-        "new_balance": new_sender_balance
+        "message": f"${amount:.2f} transferred to {result['recipient_name']} successfully!",
+        "recipient_name": result["recipient_name"],
+        "new_balance": result["balance"]
     })
 
 
@@ -450,21 +554,16 @@ def transactions():
     if error:
         return jsonify({"success": False, "message": error}), 401
 
-    tx_filter = request.args.get("filter", "all")
-    limit = int(request.args.get("limit", 50))
-
     try:
-        if tx_filter == "sent":
-            rows = supabase.table("transactions").select("*").eq("user_id", user["id"]).lt("amount", 0).order("created_at", desc=True).limit(limit).execute()
-        elif tx_filter == "received":
-            rows = supabase.table("transactions").select("*").eq("user_id", user["id"]).gt("amount", 0).order("created_at", desc=True).limit(limit).execute()
-        elif tx_filter == "withdraw":
-            rows = supabase.table("transactions").select("*").eq("user_id", user["id"]).eq("type", "withdraw").order("created_at", desc=True).limit(limit).execute()
-        else:
-            rows = supabase.table("transactions").select("*").eq("user_id", user["id"]).order("created_at", desc=True).limit(limit).execute()
-        return jsonify({"success": True, "transactions": rows.data})
+        filters = history.parse_filters(request.args)
+        rows, next_cursor = history.fetch("transactions", user["id"], filters,
+                                          cursor=request.args.get("cursor"),
+                                          limit=page_limit(request.args.get("limit"), default=50, maximum=200))
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
+    return jsonify({"success": True, "transactions": rows, "next_cursor": next_cursor})
 
 
 @app.route("/api/balance", methods=["GET"])
@@ -495,50 +594,83 @@ def admin_stats():
     if not verify_admin():
         return jsonify({"success": False, "message": "Unauthorized"}), 403
     try:
-        users = supabase.table("users").select("id, balance, is_banned").execute()
-        withdrawals = supabase.table("withdrawal_requests").select("id, amount, status").execute()
-        transactions = supabase.table("transactions").select("id, amount").execute()
+        # Trigger-maintained counters: a 16-row read regardless of platform size
+        return jsonify({"success": True, "stats": platform_stats.read()})
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)}), 500
 
-        total_users = len(users.data)
-        total_balance = sum(float(u.get("balance", 0)) for u in users.data)
-        banned_users = sum(1 for u in users.data if u.get("is_banned"))
-        pending_withdrawals = sum(1 for w in withdrawals.data if w["status"] == "pending")
-        pending_amount = sum(float(w["amount"]) for w in withdrawals.data if w["status"] == "pending")
-        total_paid = sum(float(w["amount"]) for w in withdrawals.data if w["status"] == "approved")
 
-        return jsonify({
-            "success": True,
-            "stats": {
-                "total_users": total_users,
-                "total_balance": round(total_balance, 2),
-                "banned_users": banned_users,
-                "pending_withdrawals": pending_withdrawals,
-                "pending_amount": round(pending_amount, 2),
-                "total_paid": round(total_paid, 2)
-            }
-        })
+@app.route("/api/admin/stats/reconcile", methods=["POST"])
+def admin_stats_reconcile():
+    if not verify_admin():
+        return jsonify({"success": False, "message": "Unauthorized"}), 403
+    try:
+        return jsonify({"success": True, "result": platform_stats.reconcile()})
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
 
+@app.route("/api/admin/jobs", methods=["GET"])
+def admin_jobs():
+    if not verify_admin():
+        return jsonify({"success": False, "message": "Unauthorized"}), 403
+    return jsonify({"success": True, "jobs": jobs.queue.stats(), "tx_writer": tx_writer.stats(),
+                    "dead": jobs.queue.dead(page_limit(request.args.get("limit"), default=20, maximum=200))})
+
+
+@app.route("/api/admin/jobs/dead/<int:job_id>/retry", methods=["POST"])
+def admin_retry_job(job_id):
+    if not verify_admin():
+        return jsonify({"success": False, "message": "Unauthorized"}), 403
+    if not jobs.queue.retry_dead(job_id):
+        return jsonify({"success": False, "message": "Job not found"}), 404
+    return jsonify({"success": True, "message": "Requeued"})
+
+
+@app.route("/api/admin/fx-rate", methods=["GET"])
+def admin_fx_rate():
+    if not verify_admin():
+        return jsonify({"success": False, "message": "Unauthorized"}), 403
+    return jsonify({"success": True, "stats": fx.stats()})
+
+
+@app.route("/api/admin/signup-index", methods=["GET"])
+def admin_signup_index():
+    if not verify_admin():
+        return jsonify({"success": False, "message": "Unauthorized"}), 403
+    return jsonify({"success": True, "stats": signup_signals.stats()})
+
+
+ADMIN_USER_COLUMNS = "id, name, phone, balance, referral_code, total_referrals, is_banned, created_at"
+
+
 @app.route("/api/admin/users", methods=["GET"])
 def admin_users():
     if not verify_admin():
         return jsonify({"success": False, "message": "Unauthorized"}), 403
     try:
         search = request.args.get("search", "").strip()
-        rows = supabase.table("users").select("*").order("created_at", desc=True).execute()
-        users = rows.data
+        limit = page_limit(request.args.get("limit"), default=50, maximum=200)
+        cursor = request.args.get("cursor")
+
+        query = supabase.table("users").select(ADMIN_USER_COLUMNS)
         if search:
-            users = [u for u in users if search.lower() in u["name"].lower() or search in u["phone"]]
+            # Served by the trigram indexes on name/phone (sql/005_admin_user_search.sql)
+            term = "".join(c for c in search if c not in ',()"\\*%')
+            query = query.or_(f'name.ilike."*{term}*",phone.ilike."*{term}*"')
+        try:
+            rows, next_cursor = fetch_page(query, cursor, limit)
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
+
         safe = [{
             "id": u["id"], "name": u["name"], "phone": u["phone"],
             "balance": u["balance"], "referral_code": u["referral_code"],
             "total_referrals": u.get("total_referrals", 0),
             "is_banned": u.get("is_banned", False),
             "created_at": u.get("created_at")
-        } for u in users]
-        return jsonify({"success": True, "users": safe, "total": len(safe)})
+        } for u in rows]
+        return jsonify({"success": True, "users": safe, "next_cursor": next_cursor})
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
@@ -548,13 +680,28 @@ def admin_user_detail(user_id):
     if not verify_admin():
         return jsonify({"success": False, "message": "Unauthorized"}), 403
     try:
-        user = supabase.table("users").select("*").eq("id", user_id).execute()
-        if not user.data:
+        def referrals():
+            # Keyed by the user's code; the chained lookup overlaps with the other reads
+            code = supabase.table("users").select("referral_code").eq("id", user_id).execute()
+            if not code.data:
+                return []
+            return supabase.table("users").select("name, phone, created_at, balance, device_id, signup_ip, referred_by") \
+                .eq("referred_by", code.data[0]["referral_code"]).execute().data
+
+        results, errors = gather({
+            "user": lambda: supabase.table("users").select("*").eq("id", user_id).execute().data,
+            "transactions": lambda: supabase.table("transactions").select("*").eq("user_id", user_id)
+                .order("created_at", desc=True).limit(20).execute().data,
+            "withdrawals": lambda: supabase.table("withdrawal_requests").select("*").eq("user_id", user_id)
+                .order("created_at", desc=True).execute().data,
+            "referrals": referrals,
+        })
+        if "user" in errors:
+            return jsonify({"success": False, "message": errors["user"]}), 500
+        if not results["user"]:
             return jsonify({"success": False, "message": "User not found"}), 404
-        u = user.data[0]
-        txs = supabase.table("transactions").select("*").eq("user_id", user_id).order("created_at", desc=True).limit(20).execute()
-        wds = supabase.table("withdrawal_requests").select("*").eq("user_id", user_id).order("created_at", desc=True).execute()
-        referrals = supabase.table("users").select("name, phone, created_at, balance, device_id, signup_ip, referred_by").eq("referred_by", u.get("referral_code")).execute()
+        u = results["user"][0]
+        # A failed section comes back as null and is listed in "errors"
         return jsonify({
             "success": True,
             "user": {
@@ -564,9 +711,11 @@ def admin_user_detail(user_id):
                 "is_banned": u.get("is_banned", False),
                 "created_at": u.get("created_at")
             },
-            "transactions": txs.data,
-            "withdrawals": wds.data,
-            "referrals": referrals.data
+            "transactions": results.get("transactions"),
+            "withdrawals": results.get("withdrawals"),
+            "referrals": results.get("referrals"),
+            "cluster": referral_graph.cluster_of(user_id),
+            "errors": errors
         })
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
@@ -592,17 +741,18 @@ def admin_update_balance(user_id):
 
         if action == "add":
             new_balance = current + amount
-            save_transaction(user_id, "deposit", amount, f"Admin credit: {note}")
+            logged = save_transaction(user_id, "deposit", amount, f"Admin credit: {note}", sync=True)
         elif action == "deduct":
             if current < amount:
                 return jsonify({"success": False, "message": "Insufficient user balance"}), 400
             new_balance = current - amount
-            save_transaction(user_id, "withdraw", -amount, f"Admin debit: {note}")
+            logged = save_transaction(user_id, "withdraw", -amount, f"Admin debit: {note}", sync=True)
         else:
             return jsonify({"success": False, "message": "Action must be add or deduct"}), 400
 
         supabase.table("users").update({"balance": new_balance}).eq("id", user_id).execute()
-        return jsonify({"success": True, "message": f"Balance updated", "new_balance": round(new_balance, 2)})
+        return jsonify({"success": True, "message": f"Balance updated", "new_balance": round(new_balance, 2),
+                        "transaction_logged": logged})
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
@@ -615,6 +765,8 @@ def admin_ban_user(user_id):
         data = request.json
         ban = data.get("ban", True)
         supabase.table("users").update({"is_banned": ban}).eq("id", user_id).execute()
+        if ban:
+            wallet_sessions.revoke_user(user_id)
         return jsonify({"success": True, "message": "Banned" if ban else "Unbanned"})
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
@@ -625,26 +777,85 @@ def admin_delete_user(user_id):
     if not verify_admin():
         return jsonify({"success": False, "message": "Unauthorized"}), 403
     try:
-        supabase.table("transactions").delete().eq("user_id", user_id).execute()
-        supabase.table("withdrawal_requests").delete().eq("user_id", user_id).execute()
-        supabase.table("recent_transfers").delete().eq("user_id", user_id).execute()
-        supabase.table("users").delete().eq("id", user_id).execute()
-        return jsonify({"success": True, "message": "User deleted"})
+        # Cascades across every user-owned table in one transaction
+        counts = delete_users([user_id])
+        if counts.get("skipped"):
+            return jsonify({"success": False, "message": "User has a crypto payout in flight; retry once it settles"}), 409
+        return jsonify({"success": True, "message": "User deleted", "rows_deleted": counts})
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
 
+@app.route("/api/admin/users/delete", methods=["POST"])
+def admin_bulk_delete_users():
+    if not verify_admin():
+        return jsonify({"success": False, "message": "Unauthorized"}), 403
+    data = request.json or {}
+    user_ids, invalid = parse_user_ids(data.get("user_ids"))
+    if invalid:
+        return jsonify({"success": False, "message": "Invalid user ids", "invalid": invalid[:100]}), 400
+    if not user_ids:
+        return jsonify({"success": False, "message": "user_ids required"}), 400
+    if len(user_ids) > PURGE_MAX_IDS:
+        return jsonify({"success": False, "message": f"At most {PURGE_MAX_IDS} users per job"}), 400
+    try:
+        job_id = purge_jobs.create(user_ids)
+        return jsonify({"success": True, "job_id": job_id, "total": len(user_ids)}), 202
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)}), 500
+
+
+@app.route("/api/admin/users/delete/<job_id>", methods=["GET"])
+def admin_bulk_delete_progress(job_id):
+    if not verify_admin():
+        return jsonify({"success": False, "message": "Unauthorized"}), 403
+    progress = purge_jobs.progress(job_id)
+    if not progress:
+        return jsonify({"success": False, "message": "Job not found"}), 404
+    return jsonify({"success": True, **progress})
+
+
+def admin_filters(query, status_column):
+    """Push ?status= (or ?type=), ?user_id=, ?from= and ?to= (ISO dates) into the query"""
+    status = request.args.get(status_column, "all")
+    if status and status != "all":
+        query = query.eq(status_column, status)
+    if request.args.get("user_id"):
+        query = query.eq("user_id", request.args["user_id"])
+    if request.args.get("from"):
+        query = query.gte("created_at", request.args["from"])
+    if request.args.get("to"):
+        query = query.lt("created_at", request.args["to"])
+    return query
+
+
 @app.route("/api/admin/withdrawals", methods=["GET"])
 def admin_withdrawals():
     if not verify_admin():
         return jsonify({"success": False, "message": "Unauthorized"}), 403
     try:
-        status_filter = request.args.get("status", "all")
-        rows = supabase.table("withdrawal_requests").select("*, users(name, phone)").order("created_at", desc=True).execute()
-        data = rows.data
-        if status_filter != "all":
-            data = [w for w in data if w["status"] == status_filter]
-        return jsonify({"success": True, "withdrawals": data})
+        limit = page_limit(request.args.get("limit"), default=50, maximum=200)
+        query = admin_filters(supabase.table("withdrawal_requests").select("*, users(name, phone)"), "status")
+        try:
+            rows, next_cursor = fetch_page(query, request.args.get("cursor"), limit)
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
+        return jsonify({"success": True, "withdrawals": rows, "next_cursor": next_cursor})
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)}), 500
+
+
+@app.route("/api/admin/withdrawals/count", methods=["GET"])
+def admin_withdrawals_count():
+    """Lightweight count for the dashboard badge (defaults to pending)"""
+    if not verify_admin():
+        return jsonify({"success": False, "message": "Unauthorized"}), 403
+    try:
+        status = request.args.get("status", "pending")
+        if status == "pending" and not any(request.args.get(k) for k in ["user_id", "from", "to"]):
+            return jsonify({"success": True, "count": platform_stats.read()["pending_withdrawals"]})
+        query = admin_filters(supabase.table("withdrawal_requests").select("id", count="exact"), "status")
+        return jsonify({"success": True, "count": query.limit(1).execute().count or 0})
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
@@ -679,7 +890,9 @@ def admin_withdrawal_action(wd_id):
                 u = user.data[0]
                 refund = float(wd["amount"])
                 supabase.table("users").update({"balance": float(u["balance"]) + refund}).eq("id", u["id"]).execute()
-                save_transaction(u["id"], "deposit", refund, f"Withdrawal declined — refunded. {note}")
+                logged = save_transaction(u["id"], "deposit", refund, f"Withdrawal declined — refunded. {note}",
+                                          dedup_key=f"refund:{wd_id}", sync=True)
+                return jsonify({"success": True, "message": f"Withdrawal {action}", "transaction_logged": logged})
 
         return jsonify({"success": True, "message": f"Withdrawal {action}"})
     except Exception as e:
@@ -691,9 +904,13 @@ def admin_transactions():
     if not verify_admin():
         return jsonify({"success": False, "message": "Unauthorized"}), 403
     try:
-        limit = int(request.args.get("limit", 100))
-        rows = supabase.table("transactions").select("*, users(name, phone)").order("created_at", desc=True).limit(limit).execute()
-        return jsonify({"success": True, "transactions": rows.data})
+        limit = page_limit(request.args.get("limit"), default=100, maximum=500)
+        query = admin_filters(supabase.table("transactions").select("*, users(name, phone)"), "type")
+        try:
+            rows, next_cursor = fetch_page(query, request.args.get("cursor"), limit)
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
+        return jsonify({"success": True, "transactions": rows, "next_cursor": next_cursor})
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
@@ -713,6 +930,7 @@ def admin_broadcast():
             "message": message,
             "is_active": True
         }).execute()
+        announcement_cache.invalidate()
         return jsonify({"success": True, "message": "Announcement sent"})
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
@@ -735,6 +953,7 @@ def admin_delete_broadcast(ann_id):
         return jsonify({"success": False, "message": "Unauthorized"}), 403
     try:
         supabase.table("announcements").delete().eq("id", ann_id).execute()
+        announcement_cache.invalidate()
         return jsonify({"success": True})
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
@@ -743,10 +962,12 @@ def admin_delete_broadcast(ann_id):
 @app.route("/api/announcement", methods=["GET"])
 def get_announcement():
     try:
-        rows = supabase.table("announcements").select("*").eq("is_active", True).order("created_at", desc=True).limit(1).execute()
-        if rows.data:
-            return jsonify({"success": True, "announcement": rows.data[0]})
-        return jsonify({"success": True, "announcement": None})
+        announcement, etag = announcement_cache.get()
+        resp = jsonify({"success": True, "announcement": announcement})
+        resp.set_etag(etag)
+        resp.headers["Cache-Control"] = f"public, max-age={ANNOUNCEMENT_MAX_AGE}"
+        # 304 with an empty body when If-None-Match matches
+        return resp.make_conditional(request)
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
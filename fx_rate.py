@@ -0,0 +1,159 @@
+import os, threading, time
+import requests
+
+FX_RATE_URL      = os.environ.get("FX_RATE_URL")                     # JSON feed, e.g. https://open.er-api.com/v6/latest/USD
+FX_RATE_FIELD    = os.environ.get("FX_RATE_FIELD", "rates.NGN")      # dotted path to the rate in the feed
+FX_RATE_DEFAULT  = float(os.environ.get("FX_RATE_DEFAULT", 1600))    # used until the first good fetch
+FX_RATE_TTL      = float(os.environ.get("FX_RATE_TTL", 300))
+FX_RATE_TIMEOUT  = float(os.environ.get("FX_RATE_TIMEOUT", 5))
+FX_RATE_MAX_JUMP = float(os.environ.get("FX_RATE_MAX_JUMP", 0.2))    # moves > 20% need two agreeing fetches
+FX_RATE_RETRY    = float(os.environ.get("FX_RATE_RETRY", 15))        # min seconds between blocking first fetches
+
+
+def _extract(payload, path):
+    for part in path.split("."):
+        payload = payload[part]
+    return float(payload)
+
+# ── USD -> NGN rate ──────────────────────────────────────
+class FxRate:
+    """
+    USD -> NGN rate served from memory. A read older than FX_RATE_TTL
+    returns the current value right away and starts one background refresh
+    (stale-while-revalidate). A failed fetch, or a value that is not
+    positive, keeps the last good rate. A move of more than FX_RATE_MAX_JUMP
+    is only accepted once the next fetch confirms it, so one bad tick from
+    the feed cannot reprice withdrawals. With no FX_RATE_URL the default
+    is served.
+
+    Until the first good fetch in this process, get() fetches inline
+    (single-flight, at most once per FX_RATE_RETRY) instead of serving the
+    default; `ready` stays False while the feed has never answered, and
+    money-moving callers must refuse rather than convert at the default.
+    """
+
+    def __init__(self, url=FX_RATE_URL, field=FX_RATE_FIELD, default=FX_RATE_DEFAULT, ttl=FX_RATE_TTL):
+        self.url = url
+        self.field = field
+        self.value = default
+        self.source = "default"
+        self.ttl = ttl
+        self.updated_at = 0.0
+        self.checked_at = 0.0
+        self.failures = 0
+        self.last_error = None
+        self._refreshing = False
+        self._unconfirmed = None
+        self._lock = threading.Lock()
+        self._first_lock = threading.Lock()
+        self.session = requests.Session()
+
+    def get(self):
+        if self.url and self.source != "feed":
+            self._first_fetch()
+        elif self.url and time.time() - self.checked_at > self.ttl:
+            self._trigger()
+        return self.value
+
+    @property
+    def ready(self):
+        """True once the rate came from the feed (or no feed is configured)"""
+        return not self.url or self.source == "feed"
+
+    def _first_fetch(self):
+        with self._first_lock:
+            if self.source == "feed" or time.time() - self.checked_at < FX_RATE_RETRY:
+                return
+            self._refresh_once()
+
+    def _trigger(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh_once, name="fx-refresh", daemon=True).start()
+
+    def _refresh_once(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            self.failures += 1
+            self.last_error = str(e)[:300]
+            print(f"FX rate refresh failed, keeping {self.value}: {e}")
+        finally:
+            self.checked_at = time.time()
+            self._refreshing = False
+
+    def refresh(self):
+        """Fetch the feed synchronously; raises on failure or an implausible value"""
+        res = self.session.get(self.url, timeout=FX_RATE_TIMEOUT)
+        res.raise_for_status()
+        rate = _extract(res.json(), self.field)
+        if rate <= 0:
+            raise ValueError(f"Non-positive rate {rate}")
+        if self.source == "feed" and abs(rate - self.value) / self.value > FX_RATE_MAX_JUMP:
+            confirmed = self._unconfirmed and abs(rate - self._unconfirmed) / self._unconfirmed <= 0.01
+            if not confirmed:
+                self._unconfirmed = rate
+                raise ValueError(f"Rate {rate} moved more than {FX_RATE_MAX_JUMP:.0%} from {self.value}; awaiting confirmation")
+        self._unconfirmed = None
+        self.value = rate
+        self.source = "feed"
+        self.updated_at = time.time()
+        self.last_error = None
+        return rate
+
+    def stats(self):
+        return {
+            "usd_to_ngn": self.value,
+            "source": self.source,
+            "ready": self.ready,
+            "updated_at": self.updated_at or None,
+            "age_seconds": round(time.time() - self.updated_at, 1) if self.updated_at else None,
+            "stale": self.source != "feed" or time.time() - self.updated_at > self.ttl,
+            "failures": self.failures,
+            "last_error": self.last_error
+        }
+
+fx = FxRate()
+
+
+if __name__ == "__main__":
+    # Exercise the provider against a local stub feed:
+    #   python fx_rate.py
+    import json
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class StubFeed(BaseHTTPRequestHandler):
+        responses = [(200, {"rates": {"NGN": 1550.5}}), (500, {}), (200, {"rates": {"NGN": 9999}}),
+                     (200, {"rates": {}}), (200, {"rates": {"NGN": 1580.25}}),
+                     (200, {"rates": {"NGN": 2100}}), (200, {"rates": {"NGN": 2105}})]
+        calls = 0
+
+        def do_GET(self):
+            status, body = StubFeed.responses[min(StubFeed.calls, len(StubFeed.responses) - 1)]
+            StubFeed.calls += 1
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubFeed)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    rate = FxRate(url=f"http://127.0.0.1:{server.server_port}/latest/USD", ttl=0.2)
+
+    for step in range(len(StubFeed.responses)):
+        served = rate.get()  # blocks only for the very first fetch
+        time.sleep(0.3)
+        print(f"step {step}: served {served}, now {rate.value} ({rate.source}), last_error={rate.last_error}")
+    print(json.dumps(rate.stats(), indent=2))
+    server.shutdown()
+
+    # Feed unreachable at startup: the default is returned but not ready
+    down = FxRate(url="http://127.0.0.1:9/latest/USD")
+    print(f"feed down: served {down.get()}, ready={down.ready}")
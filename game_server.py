@@ -1,6 +1,9 @@
 from flask import Blueprint, request, jsonify
 from supabase import create_client
 from utils import decode_jwt
+from rate_limiter import rate_limit
+from leader import pay_prize
+from fanout import gather
 from functools import wraps
 import os
 from datetime import datetime, timezone
@@ -9,6 +12,8 @@ SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
 supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
 
+SHOOT_READ_TIMEOUT = float(os.environ.get("SHOOT_READ_TIMEOUT", 2))
+
 game_bp = Blueprint("game_server", __name__)
 
 # ── Auth ─────────────────────────────────────────────────
@@ -87,6 +92,7 @@ def move_player():
 
 @game_bp.route("/api/game/shoot", methods=["POST"])
 @game_auth
+@rate_limit(max_calls=30, window=10)
 def shoot():
     data = request.json or {}
     room_id   = data.get("room_id")
@@ -100,15 +106,24 @@ def shoot():
     if user_id == target_id:
         return jsonify({"success": False, "error": "Cannot shoot yourself"}), 400
 
-    room = get_room(room_id)
+    results, errors = gather({
+        "room": lambda: get_room(room_id),
+        "shooter": lambda: get_player(room_id, user_id),
+        "target": lambda: get_player(room_id, target_id),
+    }, timeout=SHOOT_READ_TIMEOUT)
+    if errors:
+        print(f"Shoot lookups failed: {errors}")
+        return jsonify({"success": False, "error": "Server busy, try again"}), 503
+
+    room = results["room"]
     if not room or room["status"] != "active":
         return jsonify({"success": False, "error": "Game not active"}), 400
 
-    shooter = get_player(room_id, user_id)
+    shooter = results["shooter"]
     if not shooter or shooter["status"] != "alive":
         return jsonify({"success": False, "error": "Shooter not alive"}), 400
 
-    target = get_player(room_id, target_id)
+    target = results["target"]
     if not target or target["status"] != "alive":
         return jsonify({"success": False, "error": "Target not alive"}), 400
 
@@ -141,12 +156,9 @@ def shoot():
                 platform_fee = prize_pool * 0.10
                 winner_prize = prize_pool - platform_fee
 
-                wallet = supabase.table("crypto_wallets").select("usdt_balance") \
-                    .eq("user_id", winner_id).execute()
-                if wallet.data:
-                    new_bal = float(wallet.data[0].get("usdt_balance", 0)) + winner_prize
-                    supabase.table("crypto_wallets").update({"usdt_balance": new_bal}) \
-                        .eq("user_id", winner_id).execute()
+                if not pay_prize(room_id, winner_id, winner_prize):
+                    # Room stays active so /end can pay it out later
+                    return jsonify({"success": False, "error": "Prize payout failed"}), 502
 
             # Close room
             supabase.table("game_rooms").update({
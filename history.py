@@ -0,0 +1,145 @@
+import os
+from supabase import create_client
+from cache import TTLCache
+from local_store import connect, store_path
+from pagination import fetch_page, encode_cursor
+
+SUPABASE_URL = os.environ.get("SUPABASE_URL")
+SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
+supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+HISTORY_CACHE_ROWS = int(os.environ.get("HISTORY_CACHE_ROWS", 50))
+HISTORY_CACHE_TTL  = float(os.environ.get("HISTORY_CACHE_TTL", 60))
+HISTORY_DB         = os.environ.get("HISTORY_DB") or store_path("history.db")
+
+# History sources: name -> table
+SOURCES = {
+    "transactions": "transactions",       # app balance history
+    "wallet": "crypto_transactions"       # USDT wallet history
+}
+
+# Legacy ?filter= values of /api/transactions
+LEGACY_FILTERS = {
+    "sent": {"sign": "out"},
+    "received": {"sign": "in"},
+    "withdraw": {"type": "withdraw"}
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS history_versions (
+    user_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+"""
+
+# ── Query layer ──────────────────────────────────────────
+def parse_filters(args):
+    """
+    Read history filters from request args:
+      type=deposit,withdraw   sign=in|out   status=pending   from=/to= (ISO dates)
+    plus the legacy filter=sent|received|withdraw.
+    """
+    filters = dict(LEGACY_FILTERS.get(args.get("filter"), {}))
+    for key in ["type", "sign", "status", "from", "to"]:
+        if args.get(key):
+            filters[key] = args.get(key)
+    if filters.get("sign") not in [None, "in", "out"]:
+        raise ValueError("sign must be in or out")
+    return filters
+
+def build_query(source, user_id, filters):
+    query = supabase.table(SOURCES[source]).select("*").eq("user_id", user_id)
+    if filters.get("type"):
+        types = filters["type"].split(",")
+        query = query.eq("type", types[0]) if len(types) == 1 else query.in_("type", types)
+    if filters.get("sign"):
+        if source == "wallet":
+            # Wallet amounts are unsigned; direction is the row type
+            query = query.eq("type", "deposit" if filters["sign"] == "in" else "withdrawal")
+        else:
+            query = query.gt("amount", 0) if filters["sign"] == "in" else query.lt("amount", 0)
+    if filters.get("status"):
+        if source != "wallet":
+            raise ValueError("status filter is only available for wallet history")
+        query = query.eq("status", filters["status"])
+    if filters.get("from"):
+        query = query.gte("created_at", filters["from"])
+    if filters.get("to"):
+        query = query.lt("created_at", filters["to"])
+    return query
+
+def fetch(source, user_id, filters=None, cursor=None, limit=50):
+    """
+    Newest-first keyset page of a user's history. Returns (rows, next_cursor).
+    The unfiltered first page is served from the per-user cache.
+    """
+    filters = filters or {}
+    if not filters and not cursor and limit <= HISTORY_CACHE_ROWS:
+        return newest_pages.get(source, user_id, limit)
+    return fetch_page(build_query(source, user_id, filters), cursor, limit)
+
+# ── Newest-page cache ────────────────────────────────────
+class NewestPageCache:
+    """
+    Per-user cache of the newest HISTORY_CACHE_ROWS rows of each source,
+    which every request for a first page of that size or smaller is sliced
+    from. invalidate(user_id) bumps the user's version in a SQLite file
+    shared by the workers on the host, so a write in one worker is seen by
+    the others on their next read; the TTL bounds staleness from writers
+    on other hosts.
+    """
+
+    def __init__(self, path=HISTORY_DB):
+        self.path = path
+        self.pages = TTLCache(maxsize=20000, ttl=HISTORY_CACHE_TTL)
+        self.hits = 0
+        self.misses = 0
+
+    def _conn(self):
+        return connect(self.path, SCHEMA)
+
+    def _version(self, user_id):
+        row = self._conn().execute(
+            "SELECT version FROM history_versions WHERE user_id = ?", (str(user_id),)).fetchone()
+        return row[0] if row else 0
+
+    def get(self, source, user_id, limit):
+        key = (source, str(user_id))
+        version = self._version(user_id)
+        cached = self.pages.get(key)
+        if cached and cached[0] == version:
+            self.hits += 1
+            _, rows, next_cursor = cached
+        else:
+            self.misses += 1
+            rows, next_cursor = fetch_page(build_query(source, user_id, {}), None, HISTORY_CACHE_ROWS)
+            self.pages.set(key, (version, rows, next_cursor))
+        if limit < len(rows):
+            return rows[:limit], encode_cursor(rows[limit - 1])
+        return rows, next_cursor
+
+    def invalidate(self, *user_ids):
+        conn = self._conn()
+        for user_id in user_ids:
+            if not user_id:
+                continue
+            conn.execute(
+                "INSERT INTO history_versions VALUES (?, 1) "
+                "ON CONFLICT (user_id) DO UPDATE SET version = version + 1",
+                (str(user_id),)
+            )
+            for source in SOURCES:
+                self.pages.delete((source, str(user_id)))
+
+    def stats(self):
+        return {"cached_pages": len(self.pages), "hits": self.hits, "misses": self.misses}
+
+newest_pages = NewestPageCache()
+
+def invalidate(*user_ids):
+    """Call after any write to a user's transactions, crypto_transactions or wallet balance"""
+    try:
+        newest_pages.invalidate(*user_ids)
+    except Exception as e:
+        # Never fail the write that triggered this; the TTL bounds staleness
+        print(f"History cache invalidation failed: {e}")
@@ -0,0 +1,57 @@
+import threading
+from collections import OrderedDict
+from bloom import BloomFilter
+
+# ── Processed-key index ──────────────────────────────────
+class ProcessedIndex:
+    """
+    Per-worker index of already-processed keys (e.g. NOWPayments payment ids):
+    a bloom filter in front of an exact LRU.
+
+    check(key) returns
+      False -> definitely not seen by this worker, skip the DB check
+      True  -> exact hit in the LRU, reject without a DB round trip
+      None  -> possible hit (bloom positive, evicted from the LRU, or not
+               warmed yet); the caller must ask the DB
+
+    The index is only an accelerator: the authoritative guard is still the
+    database (and the ledger's unique ref), since other workers credit too.
+    """
+
+    def __init__(self, capacity=200000, fp_rate=0.001, lru_size=50000):
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.lru_size = lru_size
+        self.bloom = BloomFilter(capacity, fp_rate)
+        self.recent = OrderedDict()
+        self.warmed = False
+        self._lock = threading.Lock()
+
+    def add(self, key):
+        key = str(key)
+        with self._lock:
+            if self.bloom.saturated:
+                # Rebuild from the exact set so the false-positive rate stays bounded
+                self.bloom = BloomFilter(self.capacity, self.fp_rate)
+                for k in self.recent:
+                    self.bloom.add(k)
+            self.bloom.add(key)
+            self.recent[key] = True
+            self.recent.move_to_end(key)
+            if len(self.recent) > self.lru_size:
+                self.recent.popitem(last=False)
+
+    def check(self, key):
+        key = str(key)
+        with self._lock:
+            if key in self.recent:
+                self.recent.move_to_end(key)
+                return True
+            if not self.warmed:
+                return None
+            return None if key in self.bloom else False
+
+    def warm(self, keys):
+        for key in keys:
+            self.add(key)
+        self.warmed = True
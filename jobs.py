@@ -0,0 +1,244 @@
+import os, json, threading, time, uuid
+from local_store import connect, durable_path
+
+JOBS_DB           = os.environ.get("JOBS_DB") or durable_path("jobs.db")
+JOB_WORKERS       = int(os.environ.get("JOB_WORKERS", 2))
+JOB_MAX_ATTEMPTS  = int(os.environ.get("JOB_MAX_ATTEMPTS", 6))
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", 1))
+JOB_CLAIM_TIMEOUT = float(os.environ.get("JOB_CLAIM_TIMEOUT", 300))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    type         TEXT    NOT NULL,
+    payload      TEXT    NOT NULL,
+    status       TEXT    NOT NULL DEFAULT 'queued',   -- queued | running (done jobs are deleted)
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    created_at   REAL    NOT NULL,
+    available_at REAL    NOT NULL,
+    claimed_by   TEXT,
+    claimed_at   REAL,
+    last_error   TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_runnable_idx ON jobs (status, available_at, id);
+CREATE TABLE IF NOT EXISTS dead_jobs (
+    id         INTEGER PRIMARY KEY,
+    type       TEXT NOT NULL,
+    payload    TEXT NOT NULL,
+    attempts   INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    failed_at  REAL NOT NULL,
+    last_error TEXT
+);
+CREATE TABLE IF NOT EXISTS job_metrics (
+    type      TEXT PRIMARY KEY,
+    enqueued  INTEGER NOT NULL DEFAULT 0,
+    succeeded INTEGER NOT NULL DEFAULT 0,
+    retried   INTEGER NOT NULL DEFAULT 0,
+    dead      INTEGER NOT NULL DEFAULT 0,
+    run_ms    REAL    NOT NULL DEFAULT 0,
+    lag_s     REAL    NOT NULL DEFAULT 0
+);
+"""
+
+def _bump(conn, job_type, column, amount=1):
+    conn.execute(f"INSERT INTO job_metrics (type, {column}) VALUES (?, ?) "
+                 f"ON CONFLICT (type) DO UPDATE SET {column} = {column} + excluded.{column}",
+                 (job_type, amount))
+
+# ── Durable job queue ────────────────────────────────────
+class JobQueue:
+    """
+    SQLite-backed queue for side effects that should not block a request.
+    Handlers are registered per job type with @queue.handler("type") and
+    run on JOB_WORKERS threads in each worker process. A failed job is
+    retried with exponential backoff. After JOB_MAX_ATTEMPTS it moves to
+    dead_jobs, where it can be inspected and requeued. Delivery is
+    at-least-once, so handlers should be idempotent or tolerate a repeat;
+    @queue.handler(type, with_key=True) passes job_key, which stays the same
+    across retries and requeues and can serve as a dedup key.
+    """
+
+    def __init__(self, path=JOBS_DB, workers=JOB_WORKERS):
+        self.path = path
+        self.workers = workers
+        self.handlers = {}
+        self._pid = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._worker_id = None
+
+    def _conn(self):
+        return connect(self.path, SCHEMA, durable=True)
+
+    def handler(self, job_type, with_key=False):
+        def register(fn):
+            self.handlers[job_type] = (fn, with_key)
+            return fn
+        return register
+
+    def enqueue(self, job_type, delay=0, **payload):
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("INSERT INTO jobs (type, payload, created_at, available_at) VALUES (?, ?, ?, ?)",
+                         (job_type, json.dumps(payload, default=str), now, now + delay))
+            _bump(conn, job_type, "enqueued")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self.ensure_started()
+        self._wake.set()
+
+    # ── Workers ──────────────────────────────────────────
+    def ensure_started(self):
+        """Start the worker threads once per process (safe after fork)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+            for i in range(self.workers):
+                threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True).start()
+
+    def _claim(self):
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Release jobs held by a worker that died mid-run
+            conn.execute("UPDATE jobs SET status = 'queued', claimed_by = NULL "
+                         "WHERE status = 'running' AND claimed_at < ?", (now - JOB_CLAIM_TIMEOUT,))
+            # Only types this process can handle, so a half-deployed release cannot dead-letter them
+            types = list(self.handlers)
+            row = None
+            if types:
+                row = conn.execute(
+                    f"SELECT id, type, payload, attempts, created_at FROM jobs "
+                    f"WHERE status = 'queued' AND available_at <= ? AND type IN ({','.join('?' * len(types))}) "
+                    f"ORDER BY id LIMIT 1",
+                    (now, *types)
+                ).fetchone()
+            if row:
+                conn.execute("UPDATE jobs SET status = 'running', claimed_by = ?, claimed_at = ? WHERE id = ?",
+                             (self._worker_id, now, row[0]))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return row
+
+    def _run(self):
+        while True:
+            try:
+                row = self._claim()
+            except Exception as e:
+                print(f"Job queue claim error: {e}")
+                row = None
+            if not row:
+                self._wake.wait(JOB_POLL_INTERVAL)
+                self._wake.clear()
+                continue
+            try:
+                self._process(*row)
+            except Exception as e:
+                # Bookkeeping failed; the claim times out and the job runs again
+                print(f"Job queue error on job {row[0]}: {e}")
+
+    def _process(self, job_id, job_type, payload, attempts, created_at):
+        conn = self._conn()
+        started = time.perf_counter()
+        try:
+            fn, with_key = self.handlers[job_type]
+            kwargs = json.loads(payload)
+            if with_key:
+                kwargs["job_key"] = f"{job_type}:{job_id}:{created_at}"
+            fn(**kwargs)
+        except Exception as e:
+            attempts += 1
+            error = str(e)[:500]
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if attempts >= JOB_MAX_ATTEMPTS:
+                    print(f"Job {job_id} ({job_type}) dead after {attempts} attempts: {e}")
+                    conn.execute("INSERT OR REPLACE INTO dead_jobs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                 (job_id, job_type, payload, attempts, created_at, time.time(), error))
+                    conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+                    _bump(conn, job_type, "dead")
+                else:
+                    print(f"Job {job_id} ({job_type}) failed (attempt {attempts}): {e}")
+                    conn.execute(
+                        "UPDATE jobs SET status = 'queued', attempts = ?, available_at = ?, last_error = ?, "
+                        "claimed_by = NULL WHERE id = ?",
+                        (attempts, time.time() + min(2 ** attempts, 600), error, job_id)
+                    )
+                    _bump(conn, job_type, "retried")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            _bump(conn, job_type, "succeeded")
+            _bump(conn, job_type, "run_ms", (time.perf_counter() - started) * 1000)
+            _bump(conn, job_type, "lag_s", time.time() - created_at)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    # ── Dead letters and metrics ─────────────────────────
+    def dead(self, limit=50):
+        rows = self._conn().execute(
+            "SELECT id, type, payload, attempts, created_at, failed_at, last_error FROM dead_jobs "
+            "ORDER BY failed_at DESC LIMIT ?", (limit,)
+        ).fetchall()
+        return [{"id": r[0], "type": r[1], "payload": json.loads(r[2]), "attempts": r[3],
+                 "created_at": r[4], "failed_at": r[5], "last_error": r[6]} for r in rows]
+
+    def retry_dead(self, job_id):
+        """Move a dead job back to the queue with a fresh attempt count. Returns False if not found."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT type, payload, created_at FROM dead_jobs WHERE id = ?", (job_id,)).fetchone()
+            if row:
+                # Same id and created_at, so job_key is unchanged
+                conn.execute("INSERT INTO jobs (id, type, payload, created_at, available_at) VALUES (?, ?, ?, ?, ?)",
+                             (job_id, row[0], row[1], row[2], time.time()))
+                conn.execute("DELETE FROM dead_jobs WHERE id = ?", (job_id,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if row:
+            self._wake.set()
+        return bool(row)
+
+    def stats(self):
+        conn = self._conn()
+        depth = {}
+        for job_type, status, count, oldest in conn.execute(
+                "SELECT type, status, COUNT(*), MIN(created_at) FROM jobs GROUP BY type, status"):
+            entry = depth.setdefault(job_type, {"queued": 0, "running": 0, "oldest_age_s": None})
+            entry[status] = count
+            age = round(time.time() - oldest, 1)
+            entry["oldest_age_s"] = max(entry["oldest_age_s"] or 0, age)
+        stats = {}
+        for job_type, enqueued, succeeded, retried, dead, run_ms, lag_s in conn.execute(
+                "SELECT type, enqueued, succeeded, retried, dead, run_ms, lag_s FROM job_metrics"):
+            stats[job_type] = {
+                "enqueued": enqueued, "succeeded": succeeded, "retried": retried, "dead": dead,
+                "avg_run_ms": round(run_ms / succeeded, 1) if succeeded else None,
+                "avg_lag_s": round(lag_s / succeeded, 3) if succeeded else None,
+                **depth.get(job_type, {"queued": 0, "running": 0, "oldest_age_s": None})
+            }
+        return stats
+
+queue = JobQueue()
@@ -1,6 +1,9 @@
 from flask import Blueprint, request, jsonify
 from supabase import create_client
 from utils import decode_jwt
+from rate_limiter import rate_limit
+import ledger
+import jobs
 from functools import wraps
 import os, random, string
 from datetime import datetime, timezone
@@ -42,27 +45,46 @@ def generate_room_code():
             return code
 
 def update_leaderboard(user_id, wins=0, kills=0, games=0, earnings=0):
+    """Queue a leaderboard increment; applied by a job worker"""
     try:
-        existing = supabase.table("game_leaderboard").select("*").eq("user_id", user_id).execute()
-        if existing.data:
-            row = existing.data[0]
-            supabase.table("game_leaderboard").update({
-                "total_wins": row["total_wins"] + wins,
-                "total_kills": row["total_kills"] + kills,
-                "total_games": row["total_games"] + games,
-                "total_earnings": float(row["total_earnings"]) + earnings,
-                "updated_at": datetime.now(timezone.utc).isoformat()
-            }).eq("user_id", user_id).execute()
-        else:
-            supabase.table("game_leaderboard").insert({
-                "user_id": user_id,
-                "total_wins": wins,
-                "total_kills": kills,
-                "total_games": games,
-                "total_earnings": earnings
-            }).execute()
+        jobs.queue.enqueue("update_leaderboard", user_id=user_id, wins=wins, kills=kills,
+                           games=games, earnings=earnings)
     except Exception as e:
-        print(f"Leaderboard update error: {e}")
+        print(f"Leaderboard enqueue failed, applying inline: {e}")
+        try:
+            bump_leaderboard(user_id, wins, kills, games, earnings)
+        except Exception as e:
+            print(f"Leaderboard update error: {e}")
+
+def pay_prize(room_id, winner_id, amount):
+    """Credit the winner's prize; a failed credit is queued for retry. False if neither worked."""
+    result = ledger.credit(winner_id, amount, "game_prize", ref=f"prize:{room_id}")
+    if result["ok"] or result.get("error") == "duplicate":
+        return True
+    print(f"Prize credit for room {room_id} failed ({result.get('error')}), queueing a retry")
+    try:
+        jobs.queue.enqueue("game_prize", room_id=room_id, winner_id=winner_id, amount=amount)
+        return True
+    except Exception as e:
+        print(f"Prize retry enqueue failed for room {room_id}: {e}")
+        return False
+
+@jobs.queue.handler("game_prize")
+def credit_prize(room_id, winner_id, amount):
+    # Same ref as the first attempt, so a prize is never paid twice
+    result = ledger.credit(winner_id, amount, "game_prize", ref=f"prize:{room_id}")
+    if not result["ok"] and result.get("error") != "duplicate":
+        raise RuntimeError(f"Prize credit for room {room_id} failed: {result.get('error')}")
+
+@jobs.queue.handler("update_leaderboard")
+def bump_leaderboard(user_id, wins=0, kills=0, games=0, earnings=0):
+    supabase.rpc("bump_leaderboard", {
+        "p_user_id": user_id,
+        "p_wins": wins,
+        "p_kills": kills,
+        "p_games": games,
+        "p_earnings": earnings
+    }).execute()
 
 # ════════════════════════════════════════════════════════
 #  ROOM ROUTES
@@ -79,15 +101,8 @@ def create_room():
     if max_players < 2 or max_players > 20:
         return jsonify({"success": False, "error": "Max players must be between 2 and 20"}), 400
 
-    # Check entry fee — deduct from wallet if set
-    if entry_fee > 0:
-        wallet = supabase.table("crypto_wallets").select("usdt_balance").eq("user_id", user_id).execute()
-        if not wallet.data or float(wallet.data[0].get("usdt_balance", 0)) < entry_fee:
-            return jsonify({"success": False, "error": "Insufficient wallet balance"}), 400
-        new_bal = float(wallet.data[0]["usdt_balance"]) - entry_fee
-        supabase.table("crypto_wallets").update({"usdt_balance": new_bal}).eq("user_id", user_id).execute()
-
     room_code = generate_room_code()
+    # Inserted as "creating" so nobody can join before the creator has paid
     room = supabase.table("game_rooms").insert({
         "room_code": room_code,
         "max_players": max_players,
@@ -95,11 +110,18 @@ def create_room():
         "entry_fee": entry_fee,
         "prize_pool": entry_fee,
         "created_by": user_id,
-        "status": "waiting"
+        "status": "creating"
     }).execute()
 
     room_id = room.data[0]["id"]
 
+    # Entry fee — same ref as join_room, so the creator is only charged once
+    if entry_fee > 0:
+        debit = ledger.debit(user_id, entry_fee, "game_entry", ref=f"entry:{room_id}:{user_id}")
+        if not debit["ok"]:
+            supabase.table("game_rooms").delete().eq("id", room_id).execute()
+            return jsonify({"success": False, "error": "Insufficient wallet balance"}), 400
+
     # Add creator as first player
     supabase.table("game_players").insert({
         "room_id": room_id,
@@ -110,6 +132,8 @@ def create_room():
         "position_y": 100
     }).execute()
 
+    supabase.table("game_rooms").update({"status": "waiting"}).eq("id", room_id).execute()
+
     return jsonify({
         "success": True,
         "room_id": room_id,
@@ -121,6 +145,7 @@ def create_room():
 
 @leader_bp.route("/api/game/room/join", methods=["POST"])
 @game_auth
+@rate_limit(max_calls=10, window=60)
 def join_room():
     data = request.json or {}
     room_code = data.get("room_code", "").upper().strip()
@@ -149,11 +174,9 @@ def join_room():
     # Entry fee
     entry_fee = float(room.get("entry_fee", 0))
     if entry_fee > 0:
-        wallet = supabase.table("crypto_wallets").select("usdt_balance").eq("user_id", user_id).execute()
-        if not wallet.data or float(wallet.data[0].get("usdt_balance", 0)) < entry_fee:
+        debit = ledger.debit(user_id, entry_fee, "game_entry", ref=f"entry:{room['id']}:{user_id}")
+        if not debit["ok"]:
             return jsonify({"success": False, "error": "Insufficient wallet balance"}), 400
-        new_bal = float(wallet.data[0]["usdt_balance"]) - entry_fee
-        supabase.table("crypto_wallets").update({"usdt_balance": new_bal}).eq("user_id", user_id).execute()
 
     # Add player
     supabase.table("game_players").insert({
@@ -254,16 +277,16 @@ def end_game(room_id):
         return jsonify({"success": False, "error": "Game not active"}), 400
 
     prize_pool = float(room.get("prize_pool", 0))
+    winner_prize = 0
 
     # Pay winner — keep 10% as platform fee
     if winner_id and prize_pool > 0:
         platform_fee = prize_pool * 0.10
         winner_prize = prize_pool - platform_fee
 
-        wallet = supabase.table("crypto_wallets").select("usdt_balance").eq("user_id", winner_id).execute()
-        if wallet.data:
-            new_bal = float(wallet.data[0].get("usdt_balance", 0)) + winner_prize
-            supabase.table("crypto_wallets").update({"usdt_balance": new_bal}).eq("user_id", winner_id).execute()
+        # Same ref as the auto-payout in game_server.shoot, so a room only pays out once
+        if not pay_prize(room_id, winner_id, winner_prize):
+            return jsonify({"success": False, "error": "Prize payout failed, try again"}), 502
 
         update_leaderboard(winner_id, wins=1, games=1, earnings=winner_prize)
 
@@ -285,7 +308,7 @@ def end_game(room_id):
     return jsonify({
         "success": True,
         "winner_id": winner_id,
-        "prize_paid": winner_prize if prize_pool > 0 else 0,
+        "prize_paid": winner_prize,
         "message": "Game ended successfully"
     })
 
@@ -0,0 +1,65 @@
+from supabase import create_client
+import os
+import history
+
+SUPABASE_URL = os.environ.get("SUPABASE_URL")
+SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
+supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+# ── USDT wallet ledger ───────────────────────────────────
+# All crypto_wallets.usdt_balance changes go through the wallet_apply RPC
+# (sql/001_wallet_ledger.sql): one round trip, applied as an atomic
+# increment with a balance check, journaled with an optional idempotency ref.
+#
+# Every call returns {"ok": True, "balance": <new balance>} or
+# {"ok": False, "error": "insufficient_balance" | "no_wallet" | "duplicate" | "ledger_error"}.
+
+def apply(user_id, delta, reason, ref=None, create=False, touch_deposit=False):
+    try:
+        res = supabase.rpc("wallet_apply", {
+            "p_user_id": user_id,
+            "p_delta": delta,
+            "p_reason": reason,
+            "p_ref": ref,
+            "p_create": create,
+            "p_touch_deposit": touch_deposit
+        }).execute()
+        result = res.data or {"ok": False, "error": "ledger_error"}
+        if result.get("ok"):
+            result["balance"] = float(result["balance"])
+            history.invalidate(user_id)
+        return result
+    except Exception as e:
+        print(f"Ledger error ({reason} {delta} for {user_id}): {e}")
+        return {"ok": False, "error": "ledger_error"}
+
+def credit(user_id, amount, reason, ref=None, create=False, touch_deposit=False):
+    return apply(user_id, abs(float(amount)), reason, ref, create, touch_deposit)
+
+def debit(user_id, amount, reason, ref=None):
+    return apply(user_id, -abs(float(amount)), reason, ref)
+
+# ── Peer transfers (users.balance) ───────────────────────
+# transfer_funds RPC (sql/002_transfer_funds.sql): debit, credit, both
+# transactions rows and the recent_transfers upsert in one transaction.
+#
+# Returns {"ok": True, "balance": <sender balance>, "recipient_id", "recipient_name"} or
+# {"ok": False, "error": "insufficient_balance" | "recipient_not_found" | "self_transfer"
+#                        | "invalid_amount" | "ledger_error"}.
+
+def transfer(sender_id, recipient_phone, amount):
+    try:
+        res = supabase.rpc("transfer_funds", {
+            "p_sender_id": sender_id,
+            "p_recipient_phone": recipient_phone,
+            "p_amount": amount
+        }).execute()
+        result = res.data or {"ok": False, "error": "ledger_error"}
+        if result.get("ok"):
+            result["balance"] = float(result["balance"])
+            history.invalidate(sender_id, result.get("recipient_id"))
+        return result
+    except Exception as e:
+        print(f"Transfer error ({sender_id} -> {recipient_phone}, {amount}): {e}")
+        return {"ok": False, "error": "ledger_error"}
+
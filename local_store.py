@@ -0,0 +1,40 @@
+import os, sqlite3, threading
+
+# ── Local SQLite files shared by workers on one host ─────
+LOCAL_STORE_DIR   = os.environ.get("LOCAL_STORE_DIR", "/tmp/protege")
+# Files holding work that was already acked (webhooks, spooled writes) must
+# survive a restart: point this at a persistent volume in production
+DURABLE_STORE_DIR = os.environ.get("DURABLE_STORE_DIR",
+                                   os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+
+_local = threading.local()
+
+def store_path(name):
+    os.makedirs(LOCAL_STORE_DIR, exist_ok=True)
+    return os.path.join(LOCAL_STORE_DIR, name)
+
+def durable_path(name):
+    os.makedirs(DURABLE_STORE_DIR, exist_ok=True)
+    return os.path.join(DURABLE_STORE_DIR, name)
+
+def connect(path, schema=None, durable=False):
+    """
+    One connection per (thread, file). WAL lets gunicorn workers read while
+    another writes; isolation_level=None so callers control transactions
+    with explicit BEGIN IMMEDIATE / COMMIT. durable=True fsyncs every
+    commit (synchronous=FULL), for files whose rows have already been acked
+    to someone; the default NORMAL can lose the last commits on power loss.
+    """
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(path)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=FULL" if durable else "PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        if schema:
+            conn.executescript(schema)
+        conns[path] = conn
+    return conn
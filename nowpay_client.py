@@ -0,0 +1,254 @@
+import os, random, threading, time
+import requests
+from requests.adapters import HTTPAdapter
+
+NOWPAY_BASE              = os.environ.get("NOWPAY_BASE", "https://api.nowpayments.io/v1")
+NOWPAY_API_KEY           = os.environ.get("NOWPAY_API_KEY")
+NOWPAY_CONNECT_TIMEOUT   = float(os.environ.get("NOWPAY_CONNECT_TIMEOUT", 3.05))
+NOWPAY_READ_TIMEOUT      = float(os.environ.get("NOWPAY_READ_TIMEOUT", 15))
+NOWPAY_MAX_RETRIES       = int(os.environ.get("NOWPAY_MAX_RETRIES", 3))
+NOWPAY_POOL_SIZE         = int(os.environ.get("NOWPAY_POOL_SIZE", 10))
+NOWPAY_BREAKER_FAILURES  = int(os.environ.get("NOWPAY_BREAKER_FAILURES", 5))
+NOWPAY_BREAKER_COOLDOWN  = float(os.environ.get("NOWPAY_BREAKER_COOLDOWN", 30))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpen(Exception):
+    pass
+
+# ── Latency histogram ────────────────────────────────────
+class LatencyHistogram:
+    BUCKETS_MS = [50, 100, 250, 500, 1000, 2500, 5000, 10000, float("inf")]
+
+    def __init__(self):
+        self.counts = [0] * len(self.BUCKETS_MS)
+        self.total_ms = 0.0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def observe(self, ms, error=False):
+        with self._lock:
+            for i, bound in enumerate(self.BUCKETS_MS):
+                if ms <= bound:
+                    self.counts[i] += 1
+                    break
+            self.total_ms += ms
+            if error:
+                self.errors += 1
+
+    def snapshot(self):
+        with self._lock:
+            n = sum(self.counts)
+            return {
+                "count": n,
+                "errors": self.errors,
+                "avg_ms": round(self.total_ms / n, 1) if n else None,
+                "buckets": {("+Inf" if b == float("inf") else f"le_{b}"): c
+                            for b, c in zip(self.BUCKETS_MS, self.counts)}
+            }
+
+# ── Circuit breaker ──────────────────────────────────────
+class CircuitBreaker:
+    """
+    Opens after N consecutive failures; after the cooldown one trial call is
+    let through, and only that call's outcome closes or reopens it.
+    """
+
+    def __init__(self, failures=NOWPAY_BREAKER_FAILURES, cooldown=NOWPAY_BREAKER_COOLDOWN):
+        self.threshold = failures
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """False if the call must not be made; otherwise True, or "trial" for the half-open probe"""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.time() - self.opened_at >= self.cooldown and not self._trial:
+                self._trial = True
+                return "trial"
+            return False
+
+    def record(self, ok, trial=False):
+        with self._lock:
+            if trial:
+                self._trial = False
+            if ok:
+                # A call that started before the breaker opened cannot close it
+                if trial or self.opened_at is None:
+                    self.failures = 0
+                    self.opened_at = None
+            else:
+                self.failures += 1
+                if self.failures >= self.threshold or trial:
+                    self.opened_at = time.time()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.time() - self.opened_at >= self.cooldown else "open"
+
+# ── Client ───────────────────────────────────────────────
+class NowPaymentsClient:
+    """
+    Keep-alive session for the NOWPayments API with connect/read timeouts,
+    jittered retries, and a circuit breaker and latency histogram per
+    endpoint, so payouts failing does not block deposits.
+
+    Only idempotent calls (GET by default) are retried after a response or
+    read timeout. Any call is retried on a connect timeout, because then
+    the request never reached the server.
+    """
+
+    def __init__(self, base_url=NOWPAY_BASE, api_key=NOWPAY_API_KEY,
+                 timeout=(NOWPAY_CONNECT_TIMEOUT, NOWPAY_READ_TIMEOUT),
+                 max_retries=NOWPAY_MAX_RETRIES, breaker_failures=NOWPAY_BREAKER_FAILURES,
+                 breaker_cooldown=NOWPAY_BREAKER_COOLDOWN):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.breaker_failures = breaker_failures
+        self.breaker_cooldown = breaker_cooldown
+        self.breakers = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=NOWPAY_POOL_SIZE)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"x-api-key": api_key or "", "Content-Type": "application/json"})
+
+    def _histogram(self, endpoint):
+        hist = self.histograms.get(endpoint)
+        if hist is None:
+            hist = self.histograms.setdefault(endpoint, LatencyHistogram())
+        return hist
+
+    def _breaker(self, endpoint):
+        breaker = self.breakers.get(endpoint)
+        if breaker is None:
+            with self._lock:
+                breaker = self.breakers.setdefault(
+                    endpoint, CircuitBreaker(self.breaker_failures, self.breaker_cooldown))
+        return breaker
+
+    def request(self, method, path, endpoint=None, idempotent=None, **kwargs):
+        """Returns the requests.Response; raises CircuitOpen or the last transport error"""
+        endpoint = endpoint or f"{method} {path}"
+        idempotent = method.upper() == "GET" if idempotent is None else idempotent
+        kwargs.setdefault("timeout", self.timeout)
+        hist = self._histogram(endpoint)
+        breaker = self._breaker(endpoint)
+
+        for attempt in range(self.max_retries + 1):
+            allowed = breaker.allow()
+            if not allowed:
+                raise CircuitOpen(f"NOWPayments circuit open ({endpoint})")
+            trial = allowed == "trial"
+            started = time.perf_counter()
+            res = error = None
+            try:
+                res = self.session.request(method, f"{self.base_url}{path}", **kwargs)
+                failed = res.status_code >= 500
+                retryable = idempotent and res.status_code in RETRY_STATUSES
+            except requests.exceptions.ConnectTimeout as e:
+                failed, retryable, error = True, True, e
+            except requests.exceptions.RequestException as e:
+                failed, retryable, error = True, idempotent, e
+            except Exception:
+                # Never leave a trial outstanding, or the breaker stays open for good
+                breaker.record(False, trial)
+                raise
+
+            hist.observe((time.perf_counter() - started) * 1000, error=failed)
+            breaker.record(not failed, trial)
+            if not retryable or attempt == self.max_retries:
+                if res is None:
+                    raise error
+                return res
+            self._backoff(attempt)
+
+    def _backoff(self, attempt):
+        # Full jitter: uniform over [0, 0.25s * 2^attempt], capped at 5s
+        time.sleep(random.uniform(0, min(5.0, 0.25 * 2 ** attempt)))
+
+    # ── Endpoints ────────────────────────────────────────
+    def create_payment(self, payload):
+        return self.request("POST", "/payment", endpoint="create_payment", json=payload)
+
+    def get_payment(self, payment_id):
+        return self.request("GET", f"/payment/{payment_id}", endpoint="get_payment")
+
+    def create_payout(self, withdrawals):
+        return self.request("POST", "/payout", endpoint="create_payout", json={"withdrawals": withdrawals})
+
+    def stats(self):
+        return {
+            "endpoints": {name: {**hist.snapshot(), "breaker": self._breaker(name).state}
+                          for name, hist in self.histograms.items()}
+        }
+
+nowpay = NowPaymentsClient()
+
+
+if __name__ == "__main__":
+    # Exercise the client against a local fake NOWPayments server:
+    #   python nowpay_client.py
+    import json
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class FakeNowPayments(BaseHTTPRequestHandler):
+        calls = 0
+
+        def _reply(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            FakeNowPayments.calls += 1
+            # Every other status lookup fails, to show retries
+            if FakeNowPayments.calls % 2:
+                return self._reply(503, {"message": "busy"})
+            self._reply(200, {"payment_id": self.path.rsplit("/", 1)[-1], "payment_status": "waiting"})
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if self.path == "/v1/payment":
+                time.sleep(random.uniform(0.01, 0.2))
+                return self._reply(201, {"payment_id": random.randint(10**9, 10**10),
+                                         "pay_address": "TFakeAddress", "pay_amount": body.get("price_amount")})
+            self._reply(500, {"message": "payouts down"})
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeNowPayments)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = NowPaymentsClient(base_url=f"http://127.0.0.1:{server.server_port}/v1", api_key="test",
+                               breaker_failures=3, breaker_cooldown=1)
+
+    for _ in range(20):
+        client.create_payment({"price_amount": 10, "price_currency": "usd", "pay_currency": "usdttrc20"})
+    for i in range(5):
+        print("get_payment", client.get_payment(i).status_code)
+    for _ in range(5):
+        try:
+            print("create_payout", client.create_payout([{"address": "T", "amount": "1"}]).status_code)
+        except CircuitOpen as e:
+            print("create_payout", e)
+    # Payouts being down must not block deposits
+    print("create_payment after payout failures",
+          client.create_payment({"price_amount": 10, "price_currency": "usd", "pay_currency": "usdttrc20"}).status_code)
+    print("get_payment after payout failures", client.get_payment(99).status_code)
+    print(json.dumps(client.stats(), indent=2))
+    server.shutdown()
@@ -0,0 +1,50 @@
+import base64, json
+
+# ── Keyset pagination ────────────────────────────────────
+# Cursors encode the (sort key, id) of the last row of a page; the next page
+# is everything strictly after it in (sort key, id) order, which an index on
+# (sort key desc, id desc) serves without OFFSET scans.
+
+def page_limit(raw, default=50, maximum=200):
+    try:
+        return max(1, min(int(raw), maximum))
+    except (TypeError, ValueError):
+        return default
+
+def encode_cursor(row, key="created_at"):
+    raw = json.dumps([row.get(key), row.get("id")]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    """Returns (value, id) or None. Raises ValueError on a malformed cursor."""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        value, row_id = json.loads(base64.urlsafe_b64decode(padded))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    return value, row_id
+
+def quote(value):
+    """Quote a value for use inside a PostgREST or=(...) filter"""
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+def apply_cursor(query, cursor, key="created_at", desc=True):
+    decoded = decode_cursor(cursor)
+    if not decoded:
+        return query
+    value, row_id = decoded
+    op = "lt" if desc else "gt"
+    return query.or_(f"{key}.{op}.{quote(value)},and({key}.eq.{quote(value)},id.{op}.{quote(row_id)})")
+
+def ordered(query, key="created_at", desc=True):
+    return query.order(key, desc=desc).order("id", desc=desc)
+
+def fetch_page(query, cursor, limit, key="created_at", desc=True):
+    """Run a keyset-paged query. Returns (rows, next_cursor)."""
+    rows = ordered(apply_cursor(query, cursor, key, desc), key, desc).limit(limit + 1).execute().data or []
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1], key)
+    return rows, None
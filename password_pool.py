@@ -0,0 +1,109 @@
+import os, hmac, threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from utils import hash_password as _hash_password, verify_password as _verify_password
+
+BCRYPT_ROUNDS         = int(os.environ.get("BCRYPT_ROUNDS", 12))
+PASSWORD_POOL_SIZE    = int(os.environ.get("PASSWORD_POOL_SIZE", os.cpu_count() or 2))
+PASSWORD_POOL_QUEUE   = int(os.environ.get("PASSWORD_POOL_QUEUE", 64))
+PASSWORD_POOL_TIMEOUT = float(os.environ.get("PASSWORD_POOL_TIMEOUT", 10))
+
+
+class PasswordPoolBusy(Exception):
+    pass
+
+# ── Bounded bcrypt process pool ──────────────────────────
+# bcrypt at a useful cost takes hundreds of ms of CPU; running it in worker
+# processes keeps request threads free. At most PASSWORD_POOL_QUEUE jobs may
+# be in flight; beyond that callers get PasswordPoolBusy instead of queueing
+# without bound.
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(PASSWORD_POOL_QUEUE)
+
+def _executor():
+    global _pool, _pool_pid
+    if _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool_pid != os.getpid():
+                # Created lazily so each gunicorn worker gets its own pool. The
+                # pool processes are started from a clean forkserver/spawn
+                # parent: forking a worker that already runs threads can copy
+                # a lock some other thread held and hang the child.
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+                _pool = ProcessPoolExecutor(max_workers=PASSWORD_POOL_SIZE, mp_context=context)
+                _pool_pid = os.getpid()
+    return _pool
+
+def _run(fn, *args):
+    if not _slots.acquire(timeout=PASSWORD_POOL_TIMEOUT):
+        raise PasswordPoolBusy("Password hashing pool is saturated")
+    try:
+        return _executor().submit(fn, *args).result(timeout=PASSWORD_POOL_TIMEOUT)
+    except FutureTimeout:
+        raise PasswordPoolBusy("Password hashing timed out")
+    finally:
+        _slots.release()
+
+def is_bcrypt_hash(stored):
+    return isinstance(stored, str) and stored.startswith(("$2a$", "$2b$", "$2y$"))
+
+def _cost(stored):
+    # $2b$12$... -> 12
+    try:
+        return int(stored.split("$")[2])
+    except (IndexError, ValueError):
+        return None
+
+def hash_password(password, rounds=BCRYPT_ROUNDS):
+    if not isinstance(password, str):
+        raise TypeError("password must be a string")
+    return _run(_hash_password, password, rounds)
+
+def verify_password(password, stored, rounds=BCRYPT_ROUNDS):
+    """
+    Returns (ok, new_hash). new_hash is set when the stored value should be
+    replaced: a legacy plaintext password, or a bcrypt hash with a different
+    cost than BCRYPT_ROUNDS.
+    """
+    if not stored or not isinstance(password, str):
+        return False, None
+    if not is_bcrypt_hash(stored):
+        # Legacy plaintext row — compare in constant time, then upgrade it
+        if not hmac.compare_digest(str(stored).encode(), password.encode()):
+            return False, None
+        return True, hash_password(password, rounds)
+    if not _run(_verify_password, password, stored):
+        return False, None
+    if _cost(stored) != rounds:
+        return True, hash_password(password, rounds)
+    return True, None
+
+
+if __name__ == "__main__":
+    # Login throughput at several cost factors: python password_pool.py
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    LOGINS = 64
+    for rounds in [4, 8, 10, 12]:
+        stored = _hash_password("correct horse", rounds)
+        start = time.perf_counter()
+
+        def login(_):
+            try:
+                return verify_password("correct horse", stored, rounds)[0]
+            except PasswordPoolBusy:
+                return None
+
+        with ThreadPoolExecutor(max_workers=32) as threads:
+            results = list(threads.map(login, range(LOGINS)))
+        elapsed = time.perf_counter() - start
+        done = sum(1 for r in results if r is not None)
+        assert all(r is not False for r in results)
+        print(f"cost {rounds:2d}: {done}/{LOGINS} logins in {elapsed:.2f}s -> {done / elapsed:,.1f} logins/s, "
+              f"{LOGINS - done} shed as busy ({PASSWORD_POOL_SIZE} processes)")
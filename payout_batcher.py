@@ -0,0 +1,155 @@
+import os, threading
+from datetime import datetime, timedelta, timezone
+from supabase import create_client
+from nowpay_client import nowpay, CircuitOpen
+import history
+
+SUPABASE_URL = os.environ.get("SUPABASE_URL")
+SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
+supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+PAYOUT_BATCH_INTERVAL = float(os.environ.get("PAYOUT_BATCH_INTERVAL", 300))
+PAYOUT_BATCH_SIZE     = int(os.environ.get("PAYOUT_BATCH_SIZE", 25))
+PAYOUT_BATCH_MAX      = int(os.environ.get("PAYOUT_BATCH_MAX", 100))
+PAYOUT_CLAIM_TIMEOUT  = float(os.environ.get("PAYOUT_CLAIM_TIMEOUT", 900))  # seconds a row may sit in batching
+
+# ── Mass-payout batcher ──────────────────────────────────
+class PayoutBatcher:
+    """
+    Groups queued crypto withdrawals into one NOWPayments mass payout.
+    A flush runs every PAYOUT_BATCH_INTERVAL seconds, or sooner once this
+    worker has seen PAYOUT_BATCH_SIZE new withdrawals.
+
+    Each withdrawal keeps its own unique_external_id (nowpay_withdrawal_id),
+    which is also the tx_hash of its crypto_transactions row. That lets the
+    payout_completed webhook settle exactly the matching rows.
+
+    Status flow of crypto_withdrawal_requests:
+      queued -> batching (claimed by one worker) -> processing (sent)
+                                                 -> pending (rejected or unknown
+                                                    outcome; left for manual review)
+                                                 -> queued (circuit open; never sent)
+      batching for longer than PAYOUT_CLAIM_TIMEOUT (worker died, or _settle
+      failed) -> pending: the payout may or may not have gone out, so it is
+      left for manual review rather than resent.
+    """
+
+    def __init__(self):
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._pending = 0
+        self.batches = 0
+        self.items = 0
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name="payout-batcher", daemon=True).start()
+
+    def notify(self):
+        """Called after a withdrawal is queued; triggers an early flush at the size threshold"""
+        self.ensure_started()
+        with self._lock:
+            self._pending += 1
+            if self._pending >= PAYOUT_BATCH_SIZE:
+                self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(PAYOUT_BATCH_INTERVAL)
+            self._wake.clear()
+            with self._lock:
+                self._pending = 0
+            try:
+                self.reap()
+            except Exception as e:
+                print(f"Payout reaper error: {e}")
+            try:
+                while self.flush() >= PAYOUT_BATCH_MAX:
+                    pass
+            except Exception as e:
+                print(f"Payout batch error: {e}")
+
+    def flush(self):
+        """Send one mass payout for up to PAYOUT_BATCH_MAX queued withdrawals. Returns the batch size."""
+        queued = supabase.table("crypto_withdrawal_requests") \
+            .select("id").eq("type", "crypto").eq("status", "queued") \
+            .order("created_at").limit(PAYOUT_BATCH_MAX).execute()
+        ids = [r["id"] for r in (queued.data or [])]
+        if not ids:
+            return 0
+
+        # Claim — the status condition makes sure only one worker sends each row
+        claimed = supabase.table("crypto_withdrawal_requests") \
+            .update({"status": "batching", "batched_at": datetime.now(timezone.utc).isoformat()}) \
+            .in_("id", ids).eq("status", "queued").execute()
+        rows = claimed.data or []
+        if not rows:
+            return 0
+
+        callback = f"{os.environ.get('APP_URL', '')}/api/wallet/webhook/nowpayments"
+        try:
+            res = nowpay.create_payout([{
+                "address": r["destination"],
+                "currency": "usdttrc20",
+                "amount": str(r["amount"]),
+                "ipn_callback_url": callback,
+                "unique_external_id": r["nowpay_withdrawal_id"]
+            } for r in rows])
+        except CircuitOpen as e:
+            print(f"Payout batch deferred: {e}")
+            self._settle(rows, "queued", None)
+            return 0
+        except Exception as e:
+            # Outcome unknown (e.g. read timeout) — never resend automatically
+            print(f"Payout batch of {len(rows)} failed: {e}")
+            self._settle(rows, "pending", None)
+            return len(rows)
+
+        if res.status_code in [200, 201]:
+            batch_id = (res.json() or {}).get("id")
+            self._settle(rows, "processing", batch_id)
+            self.batches += 1
+            self.items += len(rows)
+            print(f"Payout batch {batch_id}: {len(rows)} withdrawals sent")
+        else:
+            print(f"NOWPayments payout batch error: {res.text}")
+            self._settle(rows, "pending", None)
+        return len(rows)
+
+    def reap(self):
+        """Move rows stuck in batching past PAYOUT_CLAIM_TIMEOUT to pending. Returns how many."""
+        cutoff = (datetime.now(timezone.utc) - timedelta(seconds=PAYOUT_CLAIM_TIMEOUT)).strftime("%Y-%m-%dT%H:%M:%SZ")
+        stuck = supabase.table("crypto_withdrawal_requests").update({"status": "pending"}) \
+            .eq("status", "batching").or_(f"batched_at.is.null,batched_at.lt.{cutoff}").execute()
+        rows = stuck.data or []
+        if rows:
+            print(f"Payout reaper: {len(rows)} withdrawals stuck in batching moved to pending for review")
+            self._mark_transactions(rows, "pending")
+        return len(rows)
+
+    def _settle(self, rows, status, batch_id):
+        update = {"status": status}
+        if batch_id:
+            update["nowpay_batch_id"] = str(batch_id)
+        # Only rows still in batching: a reaped row may already be under review
+        settled = supabase.table("crypto_withdrawal_requests").update(update) \
+            .in_("id", [r["id"] for r in rows]).eq("status", "batching").execute()
+        if len(settled.data or []) < len(rows):
+            print(f"Payout settle: {len(rows) - len(settled.data or [])} of {len(rows)} rows were no longer batching")
+        if status != "queued":
+            self._mark_transactions(settled.data or [], status)
+
+    def _mark_transactions(self, rows, status):
+        if not rows:
+            return
+        supabase.table("crypto_transactions").update({"status": status}) \
+            .in_("tx_hash", [r["nowpay_withdrawal_id"] for r in rows]).execute()
+        history.invalidate(*{r["user_id"] for r in rows})
+
+payouts = PayoutBatcher()
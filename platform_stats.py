@@ -0,0 +1,62 @@
+import os, threading, time
+from supabase import create_client
+
+SUPABASE_URL = os.environ.get("SUPABASE_URL")
+SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
+supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+STATS_RECONCILE_INTERVAL = float(os.environ.get("STATS_RECONCILE_INTERVAL", 6 * 3600))
+
+FIELDS = ["total_users", "total_balance", "banned_users",
+          "pending_withdrawals", "pending_amount", "total_paid"]
+
+# ── Admin stats counters ─────────────────────────────────
+# Maintained by triggers (sql/004_platform_stats.sql) as 16 shard rows.
+
+def read():
+    rows = supabase.table("platform_stats").select(",".join(FIELDS)).execute().data or []
+    totals = {f: sum(float(r.get(f) or 0) for r in rows) for f in FIELDS}
+    return {
+        "total_users": int(totals["total_users"]),
+        "total_balance": round(totals["total_balance"], 2),
+        "banned_users": int(totals["banned_users"]),
+        "pending_withdrawals": int(totals["pending_withdrawals"]),
+        "pending_amount": round(totals["pending_amount"], 2),
+        "total_paid": round(totals["total_paid"], 2)
+    }
+
+def reconcile(min_age=0):
+    """
+    Recompute the counters from the base tables; returns before/after totals,
+    or {"skipped": "running" | "recent"} when another caller holds the
+    reconcile lock or finished one less than min_age seconds ago
+    """
+    result = supabase.rpc("reconcile_platform_stats", {"p_min_age_seconds": min_age}).execute().data
+    if (result or {}).get("skipped"):
+        return result
+    before, after = (result or {}).get("before"), (result or {}).get("after")
+    if before != after:
+        print(f"Platform stats drift corrected: {before} -> {after}")
+    return result
+
+# ── Periodic reconciliation ──────────────────────────────
+_reconciler_pid = None
+_reconciler_lock = threading.Lock()
+
+def _reconcile_loop():
+    while True:
+        time.sleep(STATS_RECONCILE_INTERVAL)
+        try:
+            # Every worker runs this loop; only the first one per interval scans
+            reconcile(min_age=STATS_RECONCILE_INTERVAL / 2)
+        except Exception as e:
+            print(f"Platform stats reconcile failed: {e}")
+
+def start_reconciler():
+    global _reconciler_pid
+    if _reconciler_pid == os.getpid():
+        return
+    with _reconciler_lock:
+        if _reconciler_pid != os.getpid():
+            _reconciler_pid = os.getpid()
+            threading.Thread(target=_reconcile_loop, name="stats-reconciler", daemon=True).start()
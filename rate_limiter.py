@@ -0,0 +1,289 @@
+from flask import request, jsonify
+from functools import wraps
+from collections import OrderedDict
+import os, threading, time
+from local_store import connect, store_path
+
+RATE_LIMIT_BACKEND        = os.environ.get("RATE_LIMIT_BACKEND", "shared")  # shared | memory
+RATE_LIMIT_DB             = os.environ.get("RATE_LIMIT_DB") or store_path("ratelimit.db")
+RATE_LIMIT_MAX_KEYS       = int(os.environ.get("RATE_LIMIT_MAX_KEYS", 200000))
+RATE_LIMIT_SWEEP_INTERVAL = float(os.environ.get("RATE_LIMIT_SWEEP_INTERVAL", 30))
+RATE_LIMIT_FLUSH_INTERVAL = float(os.environ.get("RATE_LIMIT_FLUSH_INTERVAL", 0.5))
+TRUSTED_PROXY_HOPS        = int(os.environ.get("TRUSTED_PROXY_HOPS", 1))  # proxies in front of gunicorn
+
+# ── Client keys ──────────────────────────────────────────
+def remote_addr_key():
+    return request.remote_addr or "unknown"
+
+def forwarded_for_key():
+    """
+    The client address as seen by our outermost trusted proxy: the
+    TRUSTED_PROXY_HOPS-th X-Forwarded-For entry from the right. Entries to
+    the left of it are whatever the client sent and cannot be trusted, so
+    rotating them must not change the key. Falls back to remote_addr when
+    there is no proxy (TRUSTED_PROXY_HOPS=0) or the header is short.
+    """
+    if TRUSTED_PROXY_HOPS <= 0:
+        return remote_addr_key()
+    hops = [h.strip() for h in request.headers.get("X-Forwarded-For", "").split(",") if h.strip()]
+    if len(hops) < TRUSTED_PROXY_HOPS:
+        return remote_addr_key()
+    return hops[-TRUSTED_PROXY_HOPS]
+
+# ── Sliding window limiter ───────────────────────────────
+class SlidingWindowLimiter:
+    """
+    Sliding-window counter: each key keeps only the count for the current
+    and previous fixed window, and the previous count is weighted by how
+    much of it still overlaps the sliding window. Every check is O(1) and
+    every key is a fixed-size entry, regardless of max_calls.
+
+    Keys live in an OrderedDict in last-seen order, so idle keys are
+    always at the front and can be swept without scanning active ones.
+    At max_keys only idle keys are evicted; while every tracked key is
+    still live, new keys are refused rather than pushing out a bucket
+    that is holding a client back.
+    """
+
+    def __init__(self, max_calls, window, max_keys=RATE_LIMIT_MAX_KEYS,
+                 sweep_interval=RATE_LIMIT_SWEEP_INTERVAL):
+        self.max_calls = max_calls
+        self.window = float(window)
+        self.max_keys = max_keys
+        self.sweep_interval = sweep_interval
+        self._entries = OrderedDict()  # key -> [bucket, current, previous, last_seen]
+        self._lock = threading.Lock()
+        self._next_sweep = time.time() + sweep_interval
+
+    def hit(self, key, now=None):
+        """Record one call for key. Returns False if it is over the limit."""
+        now = time.time() if now is None else now
+        bucket = int(now // self.window)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                if len(self._entries) >= self.max_keys:
+                    self._sweep(now)
+                    if len(self._entries) >= self.max_keys:
+                        return False
+                entry = [bucket, 0, 0, now]
+                self._entries[key] = entry
+            else:
+                self._entries.move_to_end(key)
+                if entry[0] != bucket:
+                    entry[2] = entry[1] if entry[0] == bucket - 1 else 0
+                    entry[1] = 0
+                    entry[0] = bucket
+                entry[3] = now
+
+            overlap = 1.0 - (now % self.window) / self.window
+            if entry[2] * overlap + entry[1] >= self.max_calls:
+                allowed = False
+            else:
+                entry[1] += 1
+                allowed = True
+
+            if now >= self._next_sweep:
+                self._sweep(now)
+        return allowed
+
+    def _sweep(self, now):
+        """Drop keys idle for more than two windows (they can no longer affect a decision)"""
+        idle_before = now - 2 * self.window
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry[3] >= idle_before:
+                break
+            self._entries.popitem(last=False)
+        self._next_sweep = now + self.sweep_interval
+
+    def __len__(self):
+        return len(self._entries)
+
+# ── Shared (cross-worker) limiter ────────────────────────
+SHARED_SCHEMA = """
+DROP TABLE IF EXISTS rate_windows;
+CREATE TABLE IF NOT EXISTS rate_counts (
+    scope  TEXT    NOT NULL,
+    key    TEXT    NOT NULL,
+    bucket INTEGER NOT NULL,
+    count  INTEGER NOT NULL,
+    PRIMARY KEY (scope, key, bucket)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS rate_counts_expiry_idx ON rate_counts (scope, bucket);
+"""
+
+class SharedWindowLimiter:
+    """
+    Same sliding-window counter as SlidingWindowLimiter, but the counts live
+    in a SQLite file shared by every gunicorn worker on the host, so the
+    configured limit holds across workers rather than being max_calls x
+    workers.
+
+    strict=True (auth and PIN routes): the read and the increment run as
+    one IMMEDIATE transaction, so the check is exact across processes.
+
+    Otherwise increments are batched: a check reads the shared counts (a
+    WAL read, no write lock) plus this worker's unflushed hits, and the
+    hits are written once per RATE_LIMIT_FLUSH_INTERVAL in one transaction
+    for all keys. Between flushes each worker can let through up to its own
+    share of the remaining budget, so the limit may be overshot by roughly
+    (workers - 1) x the calls one client makes in a flush interval.
+
+    Expired windows are deleted on a sweep interval via the (scope, bucket)
+    index.
+    """
+
+    def __init__(self, scope, max_calls, window, path=RATE_LIMIT_DB, strict=False,
+                 sweep_interval=RATE_LIMIT_SWEEP_INTERVAL, flush_interval=RATE_LIMIT_FLUSH_INTERVAL):
+        self.scope = scope
+        self.max_calls = max_calls
+        self.window = float(window)
+        self.path = path
+        self.strict = strict
+        self.sweep_interval = sweep_interval
+        self.flush_interval = flush_interval
+        self._next_sweep = 0.0
+        self._next_flush = 0.0
+        self._pending = {}      # (key, bucket) -> hits not yet written
+        self._pending_pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def _conn(self):
+        return connect(self.path, SHARED_SCHEMA)
+
+    def _counts(self, conn, key, bucket):
+        return dict(conn.execute(
+            "SELECT bucket, count FROM rate_counts WHERE scope = ? AND key = ? AND bucket IN (?, ?)",
+            (self.scope, key, bucket, bucket - 1)
+        ).fetchall())
+
+    def _allowed(self, counts, now, bucket):
+        overlap = 1.0 - (now % self.window) / self.window
+        return counts.get(bucket - 1, 0) * overlap + counts.get(bucket, 0) < self.max_calls
+
+    def hit(self, key, now=None):
+        now = time.time() if now is None else now
+        bucket = int(now // self.window)
+        if self.strict:
+            return self._hit_now(key, now, bucket)
+        counts = self._counts(self._conn(), key, bucket)
+        with self._lock:
+            if self._pending_pid != os.getpid():
+                # Hits counted in the parent before fork belong to the parent
+                self._pending, self._pending_pid = {}, os.getpid()
+            for b in (bucket, bucket - 1):
+                counts[b] = counts.get(b, 0) + self._pending.get((key, b), 0)
+            allowed = self._allowed(counts, now, bucket)
+            if allowed:
+                self._pending[(key, bucket)] = self._pending.get((key, bucket), 0) + 1
+            if now < self._next_flush:
+                return allowed
+            self._next_flush = now + self.flush_interval
+            pending, self._pending = self._pending, {}
+        self._flush(pending, now, bucket)
+        return allowed
+
+    def _hit_now(self, key, now, bucket):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            allowed = self._allowed(self._counts(conn, key, bucket), now, bucket)
+            if allowed:
+                self._increment(conn, [(key, bucket, 1)])
+            self._maybe_sweep(conn, now, bucket)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed
+
+    def _flush(self, pending, now, bucket):
+        conn = self._conn()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._increment(conn, [(k, b, n) for (k, b), n in pending.items()])
+                self._maybe_sweep(conn, now, bucket)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except Exception:
+            # Keep the hits so the next flush writes them
+            with self._lock:
+                for k, n in pending.items():
+                    self._pending[k] = self._pending.get(k, 0) + n
+            raise
+
+    def _increment(self, conn, rows):
+        conn.executemany(
+            "INSERT INTO rate_counts (scope, key, bucket, count) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (scope, key, bucket) DO UPDATE SET count = count + excluded.count",
+            [(self.scope, k, b, n) for k, b, n in rows]
+        )
+
+    def _maybe_sweep(self, conn, now, bucket):
+        if now >= self._next_sweep:
+            conn.execute("DELETE FROM rate_counts WHERE scope = ? AND bucket < ?", (self.scope, bucket - 1))
+            self._next_sweep = now + self.sweep_interval
+
+def make_limiter(scope, max_calls, window, strict=False):
+    if RATE_LIMIT_BACKEND == "shared":
+        return SharedWindowLimiter(scope, max_calls, window, strict=strict)
+    return SlidingWindowLimiter(max_calls, window)
+
+# ── Decorator ────────────────────────────────────────────
+def rate_limit(max_calls=5, window=60, key_func=forwarded_for_key, scope=None, strict=False):
+    """
+    Usable on any blueprint route; scope defaults to the view function name.
+    strict=True is for brute-force protection (login, PIN): the shared count
+    is checked and written on every call, and a limiter error rejects the
+    request instead of letting it through.
+    """
+    def decorator(f):
+        limiter = make_limiter(scope or f"{f.__module__}.{f.__name__}", max_calls, window, strict)
+        @wraps(f)
+        def wrapped(*args, **kwargs):
+            try:
+                allowed = limiter.hit(key_func())
+            except Exception as e:
+                print(f"Rate limiter error: {e}")
+                if strict:
+                    msg = "Service temporarily unavailable. Try again shortly."
+                    return jsonify({"success": False, "error": msg, "message": msg}), 503
+                # A locked or unwritable limiter file must not take ordinary routes down
+                allowed = True
+            if not allowed:
+                msg = "Too many requests. Try again later."
+                return jsonify({"success": False, "error": msg, "message": msg}), 429
+            return f(*args, **kwargs)
+        wrapped.limiter = limiter
+        return wrapped
+    return decorator
+
+
+if __name__ == "__main__":
+    # Benchmark: python rate_limiter.py
+    import random, tracemalloc
+
+    clients = 100_000
+    calls = 1_000_000
+    keys = [f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(clients)]
+
+    tracemalloc.start()
+    limiter = SlidingWindowLimiter(max_calls=5, window=60, max_keys=clients * 2)
+    now = time.time()
+    start = time.perf_counter()
+    for n in range(calls):
+        limiter.hit(keys[random.randrange(clients)], now + n * 0.0001)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{calls:,} checks over {clients:,} clients: {elapsed:.2f}s "
+          f"({calls / elapsed:,.0f} checks/s, {elapsed / calls * 1e6:.2f} µs/check)")
+    print(f"tracked keys: {len(limiter):,}, peak memory: {peak / 1e6:.1f} MB")
+
+    start = time.perf_counter()
+    limiter._sweep(now + 10_000)
+    print(f"sweep of {clients:,} idle keys: {(time.perf_counter() - start) * 1000:.1f} ms, remaining: {len(limiter)}")
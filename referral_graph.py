@@ -0,0 +1,439 @@
+from flask import Blueprint, request, jsonify
+from supabase import create_client
+from pagination import fetch_page, encode_cursor, page_limit
+from local_store import connect, store_path
+from collections import Counter
+import os, json, threading, time, uuid
+
+SUPABASE_URL = os.environ.get("SUPABASE_URL")
+SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
+ADMIN_SECRET = os.environ.get("ADMIN_SECRET", "protege_admin_2024")
+supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+REFERRAL_GRAPH_DB      = os.environ.get("REFERRAL_GRAPH_DB") or store_path("referral_graph.db")
+REFERRAL_GRAPH_REFRESH = float(os.environ.get("REFERRAL_GRAPH_REFRESH", 60))
+REFERRAL_GRAPH_REBUILD = float(os.environ.get("REFERRAL_GRAPH_REBUILD", 3600))
+REFERRAL_GRAPH_LEASE   = float(os.environ.get("REFERRAL_GRAPH_LEASE", 180))   # builder lease, renewed while loading
+REFERRAL_TOP_KEEP      = int(os.environ.get("REFERRAL_TOP_KEEP", 200))
+REFERRAL_CLUSTER_KEEP  = int(os.environ.get("REFERRAL_CLUSTER_KEEP", 500))
+REFERRAL_CLUSTER_SAMPLE = int(os.environ.get("REFERRAL_CLUSTER_SAMPLE", 20))  # members listed per cluster
+
+# Only what the graph needs; names and phones are fetched for the snapshot rows
+USER_COLUMNS    = "id, referral_code, referred_by, signup_ip, device_id, is_banned, created_at"
+PROFILE_COLUMNS = "id, name, phone, created_at"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS lease (
+    name       TEXT PRIMARY KEY,
+    owner      TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS snapshot (
+    id          INTEGER PRIMARY KEY CHECK (id = 1),
+    computed_at REAL NOT NULL,
+    body        TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS clusters (
+    cluster_id TEXT PRIMARY KEY,
+    size       INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cluster_members (
+    user_id    TEXT PRIMARY KEY,
+    cluster_id TEXT NOT NULL
+);
+"""
+
+referrals_bp = Blueprint("referrals", __name__)
+
+# ── Top-K ────────────────────────────────────────────────
+class _TopK:
+    """The `keep` largest values seen per key. Values only grow between rebuilds."""
+
+    def __init__(self, keep):
+        self.keep = keep
+        self.values = {}
+        self._floor = None   # smallest kept value, recomputed lazily
+
+    def offer(self, key, value):
+        values = self.values
+        if key in values:
+            if values[key] == self._floor:
+                self._floor = None
+            values[key] = value
+            return
+        if len(values) < self.keep:
+            values[key] = value
+            self._floor = None
+            return
+        if self._floor is None:
+            self._floor = min(values.values())
+        if value > self._floor:
+            del values[min(values, key=values.get)]
+            values[key] = value
+            self._floor = None
+
+    def discard(self, key):
+        if self.values.pop(key, None) is not None:
+            self._floor = None
+
+    def ranked(self):
+        return sorted(self.values.items(), key=lambda item: item[1], reverse=True)
+
+# ── Referral graph ───────────────────────────────────────
+class ReferralGraph:
+    """
+    Referrer -> referees graph plus union-find clusters of users that share
+    a signup IP or device id. New users are applied incrementally (keyset
+    cursor over users.created_at), and every REFERRAL_GRAPH_REBUILD seconds
+    the graph is rebuilt to pick up bans and deletions.
+
+    One worker per host builds it: whoever holds the lease in a SQLite file
+    shared by the workers. The builder keeps one slot per user with only
+    the fields the graph needs, and updates the size histogram, top
+    referrers and largest clusters as users are added. After a refresh
+    that added users it publishes a snapshot (with names and phones
+    fetched for the rows it lists) and the cluster of every clustered user
+    to the shared file, which is what every worker's endpoints read.
+
+    Top clusters are exact after a rebuild; between rebuilds a merge of
+    two listed clusters can leave the tail of the list one short.
+    """
+
+    def __init__(self, path=REFERRAL_GRAPH_DB):
+        self.path = path
+        self._reset()
+        self.cursor = None
+        self.built_at = 0.0
+        self._pid = None
+        self._worker_id = None
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._cached = (None, None)   # (computed_at, snapshot) last read from the file
+
+    def _reset(self):
+        self.slot = {}          # user id -> slot
+        self.uids = []          # slot -> user id
+        self.referred_by = []   # slot -> referral code used at signup
+        self.ips = []
+        self.devices = []
+        self.banned = bytearray()
+        self.parent = []        # union-find over slots
+        self.ring = []          # circular list through each cluster's members
+        self.size = {}          # root -> cluster size
+        self.code_owner = {}    # referral_code -> slot
+        self.referees = {}      # referral_code -> [referee slots]
+        self.ip_anchor = {}     # signup_ip -> first slot seen with it
+        self.device_anchor = {}
+        self.histogram = Counter()   # cluster size -> number of clusters
+        self.top_codes = _TopK(REFERRAL_TOP_KEEP)       # referral_code -> referrals
+        self.top_roots = _TopK(REFERRAL_CLUSTER_KEEP)   # root -> size, clusters of 2+
+        self._moved = set()          # slots whose cluster changed since the last publish
+        self._resized = set()        # roots whose size changed since the last publish
+        self._full = True            # next publish rewrites the shared cluster tables
+        self._changed = True         # something to publish
+
+    def _conn(self):
+        return connect(self.path, SCHEMA)
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+                threading.Thread(target=self._run, name="referral-graph", daemon=True).start()
+
+    def _hold_lease(self):
+        """Take or renew the builder lease; False while another worker holds it"""
+        now = time.time()
+        cur = self._conn().execute(
+            "INSERT INTO lease (name, owner, expires_at) VALUES ('builder', ?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+            "WHERE lease.owner = excluded.owner OR lease.expires_at < ?",
+            (self._worker_id, now + REFERRAL_GRAPH_LEASE, now)
+        )
+        return cur.rowcount == 1
+
+    # ── Union-find ───────────────────────────────────────
+    def _find(self, i):
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]  # path halving
+            i = parent[i]
+        return i
+
+    def _union(self, a, b):
+        ra, rb = self._find(a), self._find(b)
+        if ra == rb:
+            return
+        if self.size[ra] < self.size[rb]:
+            ra, rb = rb, ra
+        sa, sb = self.size[ra], self.size.pop(rb)
+        if not self._full:
+            # rb's members now report ra; ra itself is new to the tables if it was alone
+            self._moved.update(self._members(rb))
+            if sa == 1:
+                self._moved.add(ra)
+            self._resized.update((ra, rb))
+        self.parent[rb] = ra
+        self.size[ra] = sa + sb
+        # Splice the two member rings together
+        self.ring[ra], self.ring[rb] = self.ring[rb], self.ring[ra]
+
+        for s in (sa, sb):
+            self.histogram[s] -= 1
+            if not self.histogram[s]:
+                del self.histogram[s]
+        self.histogram[sa + sb] += 1
+
+        self.top_roots.discard(rb)
+        self.top_roots.offer(ra, sa + sb)
+
+    def _members(self, root):
+        i = root
+        while True:
+            yield i
+            i = self.ring[i]
+            if i == root:
+                return
+
+    def _add(self, row):
+        uid = str(row["id"])
+        if uid in self.slot:
+            return
+        i = len(self.uids)
+        self.slot[uid] = i
+        self.uids.append(uid)
+        self.referred_by.append(row.get("referred_by"))
+        self.ips.append(row.get("signup_ip"))
+        self.devices.append(row.get("device_id"))
+        self.banned.append(1 if row.get("is_banned") else 0)
+        self.parent.append(i)
+        self.ring.append(i)
+        self.size[i] = 1
+        self.histogram[1] += 1
+        self._changed = True
+
+        if row.get("referral_code"):
+            self.code_owner[row["referral_code"]] = i
+        code = row.get("referred_by")
+        if code:
+            referees = self.referees.setdefault(code, [])
+            referees.append(i)
+            self.top_codes.offer(code, len(referees))
+        for value, anchors in ((row.get("signup_ip"), self.ip_anchor), (row.get("device_id"), self.device_anchor)):
+            if not value:
+                continue
+            if value in anchors:
+                self._union(i, anchors[value])
+            else:
+                anchors[value] = i
+
+    # ── Loading ──────────────────────────────────────────
+    def _load(self, cursor, page=1000):
+        """Apply users created after cursor; returns the cursor of the last row applied"""
+        while True:
+            rows, next_cursor = fetch_page(supabase.table("users").select(USER_COLUMNS), cursor, page, desc=False)
+            for row in rows:
+                self._add(row)
+            if rows:
+                cursor = encode_cursor(rows[-1])
+            if not next_cursor:
+                return cursor
+            if not self._hold_lease():
+                raise RuntimeError("referral graph builder lease lost")
+
+    def refresh(self):
+        """Load new users (or rebuild) and publish if anything changed. Builder only."""
+        with self._lock:
+            if time.time() - self.built_at > REFERRAL_GRAPH_REBUILD:
+                started = time.time()
+                self._reset()
+                self.cursor = self._load(None)
+                self.built_at = time.time()
+                print(f"Referral graph built with {len(self.uids)} users in {time.time() - started:.1f}s")
+            else:
+                self.cursor = self._load(self.cursor)
+            if self._changed:
+                self._publish(self._summarize())
+
+    def _run(self):
+        while True:
+            try:
+                if self._hold_lease():
+                    self.refresh()
+                elif self.uids:
+                    # Another worker took over; start from scratch if this one wins again
+                    with self._lock:
+                        self._reset()
+                        self.built_at = 0.0
+            except Exception as e:
+                print(f"Referral graph refresh failed: {e}")
+            time.sleep(REFERRAL_GRAPH_REFRESH)
+
+    # ── Snapshot ─────────────────────────────────────────
+    def _profiles(self, uids):
+        """id -> {name, phone, created_at} for the users a snapshot lists"""
+        uids, found = list(dict.fromkeys(uids)), {}
+        for start in range(0, len(uids), 500):
+            rows = supabase.table("users").select(PROFILE_COLUMNS).in_("id", uids[start:start + 500]).execute().data
+            found.update((str(r["id"]), r) for r in rows or [])
+        return found
+
+    def _summarize(self):
+        ranked = self.top_codes.ranked()
+        clusters = [self._describe(root) for root, _ in self.top_roots.ranked()]
+
+        owners = [self.uids[self.code_owner[code]] for code, _ in ranked if code in self.code_owner]
+        sampled = [m["id"] for c in clusters for m in c["members"]]
+        profiles = self._profiles(owners + sampled)
+
+        top = []
+        for code, count in ranked:
+            owner = self.code_owner.get(code)
+            owner_id = self.uids[owner] if owner is not None else None
+            profile = profiles.get(owner_id, {})
+            referee_slots = self.referees[code]
+            top.append({
+                "user_id": owner_id,
+                "name": profile.get("name"),
+                "phone": profile.get("phone"),
+                "referral_code": code,
+                "referrals": count,
+                # Referees sitting in a shared IP/device cluster of two or more
+                "clustered_referrals": sum(1 for r in referee_slots if self.size[self._find(r)] > 1),
+                "banned_referrals": sum(self.banned[r] for r in referee_slots)
+            })
+        for cluster in clusters:
+            for member in cluster["members"]:
+                profile = profiles.get(member["id"], {})
+                member.update(name=profile.get("name"), phone=profile.get("phone"),
+                              created_at=profile.get("created_at"))
+
+        return {
+            "users": len(self.uids),
+            "clusters": sum(n for size, n in self.histogram.items() if size > 1),
+            "histogram": {str(k): v for k, v in sorted(self.histogram.items())},
+            "top_referrers": top,
+            "top_clusters": clusters,
+            "computed_at": time.time()
+        }
+
+    def _describe(self, root):
+        members = list(self._members(root))
+        referrers = Counter(self.referred_by[i] for i in members if self.referred_by[i])
+        top_code, top_count = referrers.most_common(1)[0] if referrers else (None, 0)
+        top_owner = self.code_owner.get(top_code)
+        return {
+            "cluster_id": self.uids[root],
+            "size": len(members),
+            "ips": sorted({self.ips[i] for i in members if self.ips[i]})[:20],
+            "devices": sorted({self.devices[i] for i in members if self.devices[i]})[:20],
+            "banned": sum(self.banned[i] for i in members),
+            # Share of members referred by the same code — a farm feeding one referrer
+            "top_referral_code": top_code,
+            "top_referrer_id": self.uids[top_owner] if top_owner is not None else None,
+            "top_referrer_share": round(top_count / len(members), 3),
+            "members": [{"id": self.uids[i], "referred_by": self.referred_by[i]}
+                        for i in members[:REFERRAL_CLUSTER_SAMPLE]]
+        }
+
+    def _publish(self, snapshot):
+        """Write the snapshot and the cluster changes since the last publish to the shared file"""
+        if self._full:
+            moved = [i for i in range(len(self.uids)) if self.size[self._find(i)] > 1]
+            resized = [r for r, size in self.size.items() if size > 1]
+        else:
+            moved, resized = self._moved, self._resized
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            owner = conn.execute("SELECT owner FROM lease WHERE name = 'builder'").fetchone()
+            if not owner or owner[0] != self._worker_id:
+                raise RuntimeError("referral graph builder lease lost")
+            if self._full:
+                conn.execute("DELETE FROM clusters")
+                conn.execute("DELETE FROM cluster_members")
+            conn.executemany("INSERT OR REPLACE INTO cluster_members (user_id, cluster_id) VALUES (?, ?)",
+                             [(self.uids[i], self.uids[self._find(i)]) for i in moved])
+            conn.executemany("DELETE FROM clusters WHERE cluster_id = ?",
+                             [(self.uids[r],) for r in resized if r not in self.size or self.size[r] < 2])
+            conn.executemany("INSERT OR REPLACE INTO clusters (cluster_id, size) VALUES (?, ?)",
+                             [(self.uids[r], self.size[r]) for r in resized if self.size.get(r, 0) > 1])
+            conn.execute("INSERT OR REPLACE INTO snapshot (id, computed_at, body) VALUES (1, ?, ?)",
+                         (snapshot["computed_at"], json.dumps(snapshot)))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._moved, self._resized, self._full, self._changed = set(), set(), False, False
+
+    # ── Readers (any worker) ─────────────────────────────
+    def snapshot(self):
+        """The last published snapshot, or None before the first build"""
+        row = self._conn().execute("SELECT computed_at FROM snapshot WHERE id = 1").fetchone()
+        if not row:
+            return None
+        computed_at, cached = self._cached
+        if computed_at != row[0]:
+            body = self._conn().execute("SELECT body FROM snapshot WHERE id = 1").fetchone()[0]
+            cached = json.loads(body)
+            self._cached = (cached["computed_at"], cached)
+        return cached
+
+    def cluster_of(self, user_id):
+        """Size and id of the IP/device cluster a user belongs to, or None before the first build"""
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT c.cluster_id, c.size FROM cluster_members m JOIN clusters c ON c.cluster_id = m.cluster_id "
+            "WHERE m.user_id = ?", (str(user_id),)
+        ).fetchone()
+        if row:
+            return {"cluster_id": row[0], "size": row[1]}
+        if not conn.execute("SELECT 1 FROM snapshot WHERE id = 1").fetchone():
+            return None
+        # Not in any shared cluster (or signed up since the last refresh)
+        return {"cluster_id": str(user_id), "size": 1}
+
+referral_graph = ReferralGraph()
+
+# ════════════════════════════════════════════════════════
+#  REFERRAL ANALYTICS ROUTES
+# ════════════════════════════════════════════════════════
+
+def _snapshot():
+    if request.headers.get("X-Admin-Key") != ADMIN_SECRET:
+        return None, (jsonify({"success": False, "message": "Unauthorized"}), 403)
+    referral_graph.ensure_started()
+    snapshot = referral_graph.snapshot()
+    if snapshot is None:
+        return None, (jsonify({"success": False, "message": "Referral graph is still loading"}), 503)
+    return snapshot, None
+
+@referrals_bp.route("/api/admin/referrals/top", methods=["GET"])
+def top_referrers():
+    snap, error = _snapshot()
+    if error:
+        return error
+    limit = page_limit(request.args.get("limit"), default=20, maximum=REFERRAL_TOP_KEEP)
+    return jsonify({"success": True, "referrers": snap["top_referrers"][:limit], "computed_at": snap["computed_at"]})
+
+@referrals_bp.route("/api/admin/referrals/clusters", methods=["GET"])
+def suspicious_clusters():
+    snap, error = _snapshot()
+    if error:
+        return error
+    limit = page_limit(request.args.get("limit"), default=20, maximum=REFERRAL_CLUSTER_KEEP)
+    min_size = page_limit(request.args.get("min_size"), default=3, maximum=10**6)
+    clusters = [c for c in snap["top_clusters"] if c["size"] >= min_size][:limit]
+    return jsonify({"success": True, "clusters": clusters, "total_clusters": snap["clusters"],
+                    "computed_at": snap["computed_at"]})
+
+@referrals_bp.route("/api/admin/referrals/histogram", methods=["GET"])
+def cluster_histogram():
+    snap, error = _snapshot()
+    if error:
+        return error
+    return jsonify({"success": True, "users": snap["users"], "histogram": snap["histogram"],
+                    "computed_at": snap["computed_at"]})
@@ -0,0 +1,197 @@
+import os, threading, time
+from collections import OrderedDict
+from supabase import create_client
+from bloom import BloomFilter
+from pagination import fetch_page, encode_cursor
+
+SUPABASE_URL = os.environ.get("SUPABASE_URL")
+SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
+supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+SIGNUP_INDEX_CAPACITY = int(os.environ.get("SIGNUP_INDEX_CAPACITY", 1000000))
+SIGNUP_INDEX_EXACT    = int(os.environ.get("SIGNUP_INDEX_EXACT", 200000))
+SIGNUP_INDEX_REFRESH  = float(os.environ.get("SIGNUP_INDEX_REFRESH", 30))
+SIGNUP_INDEX_REBUILD  = float(os.environ.get("SIGNUP_INDEX_REBUILD", 6 * 3600))
+
+# ── Per-signal counts ────────────────────────────────────
+class SignalIndex:
+    """
+    Number of users per value of one signup signal (phone, IP or device).
+    A bloom filter holds every value ever seen, and an LRU holds exact
+    counts for the most recent ones.
+
+    count(value) returns
+      int  -> exact count (as of the last refresh)
+      0    -> bloom negative: no user has this value
+      None -> possible match (bloom positive, evicted from the LRU, or not
+              warmed yet); the caller must ask the DB
+    """
+
+    def __init__(self, capacity=SIGNUP_INDEX_CAPACITY, exact_size=SIGNUP_INDEX_EXACT):
+        self.bloom = BloomFilter(capacity, 0.001)
+        self.counts = OrderedDict()
+        self.exact_size = exact_size
+        self.warmed = False
+        self._lock = threading.Lock()
+
+    def add(self, value):
+        if not value:
+            return
+        value = str(value)
+        with self._lock:
+            if value in self.counts:
+                self.counts[value] += 1
+                self.counts.move_to_end(value)
+            elif value not in self.bloom:
+                self.counts[value] = 1
+            else:
+                # Seen before but evicted: the exact count is unknown now
+                return
+            self.bloom.add(value)
+            if len(self.counts) > self.exact_size:
+                self.counts.popitem(last=False)
+
+    def count(self, value):
+        value = str(value)
+        with self._lock:
+            if not self.warmed or self.bloom.saturated:
+                return None
+            if value in self.counts:
+                self.counts.move_to_end(value)
+                return self.counts[value]
+            return None if value in self.bloom else 0
+
+# ── Signup signals ───────────────────────────────────────
+class SignupSignals:
+    """
+    In-process index of phones, signup IPs and device ids, so most signups
+    are admitted without reading users. It is warmed from users in the
+    background and kept current by record() on local signups and by an
+    incremental refresh (users created since the last row seen). Signups
+    from other workers can therefore be missed for up to
+    SIGNUP_INDEX_REFRESH seconds. The database is still authoritative: the
+    caller checks possible matches there, and the unique index on
+    users.phone rejects duplicates the index missed. Every
+    SIGNUP_INDEX_REBUILD seconds the index is rebuilt from scratch, which
+    also drops deleted users; the blooms are sized for twice the current
+    user count, so a growing table never leaves them saturated.
+    """
+
+    def __init__(self):
+        self._fresh()
+        self.cursor = None
+        self.built_at = 0.0
+        self._recorded = set()  # ids recorded locally, skipped once when the refresh reaches them
+        self._pid = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.fallbacks = 0
+
+    def _fresh(self, capacity=SIGNUP_INDEX_CAPACITY):
+        self.phones = SignalIndex(capacity)
+        self.ips = SignalIndex(capacity)
+        self.devices = SignalIndex(capacity)
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, name="signup-index", daemon=True).start()
+
+    def record(self, phone, signup_ip, device_id, user_id=None):
+        if user_id:
+            self._recorded.add(str(user_id))
+        self._add(phone, signup_ip, device_id)
+
+    def _add(self, phone, signup_ip, device_id):
+        self.phones.add(phone)
+        self.ips.add(signup_ip)
+        self.devices.add(device_id)
+
+    def lookup(self, phone, signup_ip, device_id):
+        """Returns {"phone", "ip", "device"} counts; None entries must be checked in the DB"""
+        result = {
+            "phone": self.phones.count(phone),
+            "ip": self.ips.count(signup_ip),
+            "device": self.devices.count(device_id)
+        }
+        if None in result.values():
+            self.fallbacks += 1
+        else:
+            self.hits += 1
+        return result
+
+    # ── Warm-up and refresh ──────────────────────────────
+    def _load(self, cursor, page=1000):
+        """Apply users created after cursor; returns the cursor of the last row applied"""
+        while True:
+            rows, next_cursor = fetch_page(
+                supabase.table("users").select("id, phone, signup_ip, device_id, created_at"),
+                cursor, page, desc=False
+            )
+            for r in rows:
+                if str(r["id"]) in self._recorded:
+                    self._recorded.discard(str(r["id"]))
+                    continue
+                self._add(r.get("phone"), r.get("signup_ip"), r.get("device_id"))
+            if rows:
+                cursor = encode_cursor(rows[-1])
+            if not next_cursor:
+                return cursor
+
+    def _capacity(self):
+        """Bloom capacity with room for the table to double before the next rebuild"""
+        try:
+            users = supabase.table("users").select("id", count="exact").limit(1).execute().count or 0
+        except Exception as e:
+            print(f"Signup index could not count users: {e}")
+            users = self.phones.bloom.count
+        return max(SIGNUP_INDEX_CAPACITY, 2 * users)
+
+    def rebuild(self):
+        """Load every user into fresh indexes, then swap them in"""
+        started = time.time()
+        current = self.phones, self.ips, self.devices
+        self._fresh(self._capacity())
+        self._recorded.clear()
+        try:
+            cursor = self._load(None)
+        except Exception:
+            self.phones, self.ips, self.devices = current
+            raise
+        for index in (self.phones, self.ips, self.devices):
+            index.warmed = True
+        self.cursor = cursor
+        self.built_at = time.time()
+        print(f"Signup index built with {self.phones.bloom.count} users "
+              f"(capacity {self.phones.bloom.capacity}) in {time.time() - started:.1f}s")
+
+    def refresh(self):
+        self.cursor = self._load(self.cursor)
+
+    def _run(self):
+        while True:
+            try:
+                if time.time() - self.built_at > SIGNUP_INDEX_REBUILD or self.phones.bloom.saturated:
+                    self.rebuild()
+                else:
+                    self.refresh()
+            except Exception as e:
+                print(f"Signup index refresh failed: {e}")
+            time.sleep(SIGNUP_INDEX_REFRESH)
+
+    def stats(self):
+        return {
+            "warmed": self.phones.warmed,
+            "users_indexed": self.phones.bloom.count,
+            "capacity": self.phones.bloom.capacity,
+            "distinct_ips": len(self.ips.counts),
+            "distinct_devices": len(self.devices.counts),
+            "admitted_from_index": self.hits,
+            "db_fallbacks": self.fallbacks,
+            "built_at": self.built_at
+        }
+
+signup_signals = SignupSignals()
@@ -0,0 +1,70 @@
+-- Atomic USDT wallet ledger.
+-- Every crypto_wallets.usdt_balance mutation goes through wallet_apply(), which
+-- applies the delta as a single conditional UPDATE (no read-modify-write) and
+-- appends a row to wallet_journal in the same transaction.
+
+create unique index if not exists crypto_wallets_user_id_key on crypto_wallets (user_id);
+
+create table if not exists wallet_journal (
+    id            bigserial primary key,
+    user_id       uuid        not null,
+    delta         numeric     not null,
+    balance_after numeric     not null,
+    reason        text        not null,
+    ref           text        unique,          -- idempotency key, e.g. deposit:<payment_id>
+    created_at    timestamptz not null default now()
+);
+
+create index if not exists wallet_journal_user_id_idx on wallet_journal (user_id, created_at desc);
+
+-- Journal is append-only
+revoke update, delete on wallet_journal from anon, authenticated;
+
+create or replace function wallet_apply(
+    p_user_id       uuid,
+    p_delta         numeric,
+    p_reason        text,
+    p_ref           text    default null,
+    p_create        boolean default false,
+    p_touch_deposit boolean default false
+) returns jsonb
+language plpgsql
+as $$
+declare
+    v_balance numeric;
+begin
+    if p_ref is not null and exists (select 1 from wallet_journal where ref = p_ref) then
+        return jsonb_build_object('ok', false, 'error', 'duplicate');
+    end if;
+
+    if p_create then
+        insert into crypto_wallets (user_id, usdt_balance)
+        values (p_user_id, 0)
+        on conflict (user_id) do nothing;
+    end if;
+
+    update crypto_wallets
+       set usdt_balance    = coalesce(usdt_balance, 0) + p_delta,
+           last_deposit_at = case when p_touch_deposit then now() else last_deposit_at end
+     where user_id = p_user_id
+       and coalesce(usdt_balance, 0) + p_delta >= 0
+    returning usdt_balance into v_balance;
+
+    if not found then
+        return jsonb_build_object(
+            'ok', false,
+            'error', case when exists (select 1 from crypto_wallets where user_id = p_user_id)
+                          then 'insufficient_balance' else 'no_wallet' end
+        );
+    end if;
+
+    insert into wallet_journal (user_id, delta, balance_after, reason, ref)
+    values (p_user_id, p_delta, v_balance, p_reason, p_ref);
+
+    return jsonb_build_object('ok', true, 'balance', v_balance);
+exception
+    when unique_violation then
+        -- Concurrent call with the same ref won the race; this one is a no-op
+        return jsonb_build_object('ok', false, 'error', 'duplicate');
+end;
+$$;
@@ -0,0 +1,67 @@
+-- Atomic peer transfer on users.balance.
+-- Debit, credit, both transactions rows and the recent_transfers upsert run in
+-- one transaction, so /api/transfer is a single round trip and can never leave
+-- one side applied without the other.
+
+create unique index if not exists recent_transfers_user_recipient_key
+    on recent_transfers (user_id, recipient_phone);
+
+create or replace function transfer_funds(
+    p_sender_id       uuid,
+    p_recipient_phone text,
+    p_amount          numeric
+) returns jsonb
+language plpgsql
+as $$
+declare
+    v_sender    users%rowtype;
+    v_recipient users%rowtype;
+    v_balance   numeric;
+begin
+    if p_amount is null or p_amount <= 0 then
+        return jsonb_build_object('ok', false, 'error', 'invalid_amount');
+    end if;
+
+    select * into v_recipient from users where phone = p_recipient_phone;
+    if not found then
+        return jsonb_build_object('ok', false, 'error', 'recipient_not_found');
+    end if;
+    if v_recipient.id = p_sender_id then
+        return jsonb_build_object('ok', false, 'error', 'self_transfer');
+    end if;
+
+    -- Lock both rows in id order so opposite-direction transfers cannot deadlock
+    perform 1 from users where id in (p_sender_id, v_recipient.id) order by id for update;
+
+    update users
+       set balance = balance - p_amount
+     where id = p_sender_id
+       and balance >= p_amount
+    returning * into v_sender;
+    if not found then
+        return jsonb_build_object('ok', false, 'error', 'insufficient_balance');
+    end if;
+    v_balance := v_sender.balance;
+
+    update users set balance = balance + p_amount where id = v_recipient.id;
+
+    insert into transactions (user_id, type, amount, description) values
+        (p_sender_id,    'transfer', -p_amount, 'Transfer to '   || v_recipient.name || '|' || v_recipient.phone),
+        (v_recipient.id, 'transfer',  p_amount, 'Transfer from ' || v_sender.name    || '|' || v_sender.phone);
+
+    insert into recent_transfers (user_id, recipient_phone, recipient_name, last_amount, transfer_count, last_transferred_at)
+    values (p_sender_id, v_recipient.phone, v_recipient.name, p_amount, 1, now())
+    on conflict (user_id, recipient_phone) do update
+        set recipient_name      = excluded.recipient_name,
+            last_amount         = excluded.last_amount,
+            transfer_count      = recent_transfers.transfer_count + 1,
+            last_transferred_at = now();
+
+    return jsonb_build_object(
+        'ok', true,
+        'balance', v_balance,
+        'recipient_id', v_recipient.id,
+        'recipient_name', v_recipient.name
+    );
+end;
+$$;
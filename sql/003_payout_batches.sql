@@ -0,0 +1,10 @@
+-- Mass payouts: withdrawals are queued, claimed and sent in NOWPayments batches.
+
+alter table crypto_withdrawal_requests add column if not exists nowpay_batch_id text;
+
+create index if not exists crypto_withdrawal_requests_queue_idx
+    on crypto_withdrawal_requests (status, created_at) where type = 'crypto';
+create index if not exists crypto_withdrawal_requests_nowpay_id_idx
+    on crypto_withdrawal_requests (nowpay_withdrawal_id);
+create index if not exists crypto_transactions_tx_hash_idx
+    on crypto_transactions (tx_hash);
@@ -0,0 +1,163 @@
+-- Incrementally maintained counters for /api/admin/stats.
+-- Triggers on users and withdrawal_requests apply deltas to one of 16 shard
+-- rows (chosen by row id), so concurrent balance updates do not all queue on
+-- a single hot row. Reading the stats sums 16 rows: O(1) in platform size.
+-- reconcile_platform_stats() recomputes everything from the base tables.
+
+create table if not exists platform_stats (
+    shard               int     primary key,
+    total_users         bigint  not null default 0,
+    total_balance       numeric not null default 0,
+    banned_users        bigint  not null default 0,
+    pending_withdrawals bigint  not null default 0,
+    pending_amount      numeric not null default 0,
+    total_paid          numeric not null default 0,
+    reconciled_at       timestamptz
+);
+
+insert into platform_stats (shard)
+select g from generate_series(0, 15) g
+on conflict (shard) do nothing;
+
+create or replace function platform_stats_users_trg() returns trigger
+language plpgsql
+as $$
+declare
+    d_users   bigint  := 0;
+    d_balance numeric := 0;
+    d_banned  bigint  := 0;
+begin
+    if tg_op in ('INSERT', 'UPDATE') then
+        d_users   := d_users + case when tg_op = 'INSERT' then 1 else 0 end;
+        d_balance := d_balance + coalesce(new.balance, 0);
+        d_banned  := d_banned + case when coalesce(new.is_banned, false) then 1 else 0 end;
+    end if;
+    if tg_op in ('UPDATE', 'DELETE') then
+        d_users   := d_users - case when tg_op = 'DELETE' then 1 else 0 end;
+        d_balance := d_balance - coalesce(old.balance, 0);
+        d_banned  := d_banned - case when coalesce(old.is_banned, false) then 1 else 0 end;
+    end if;
+
+    if d_users <> 0 or d_balance <> 0 or d_banned <> 0 then
+        update platform_stats
+           set total_users   = total_users + d_users,
+               total_balance = total_balance + d_balance,
+               banned_users  = banned_users + d_banned
+         where shard = abs(hashtext(coalesce(new.id, old.id)::text)) % 16;
+    end if;
+    return null;
+end;
+$$;
+
+drop trigger if exists platform_stats_users on users;
+create trigger platform_stats_users
+    after insert or update of balance, is_banned or delete on users
+    for each row execute function platform_stats_users_trg();
+
+create or replace function platform_stats_withdrawals_trg() returns trigger
+language plpgsql
+as $$
+declare
+    d_pending bigint  := 0;
+    d_amount  numeric := 0;
+    d_paid    numeric := 0;
+begin
+    if tg_op in ('INSERT', 'UPDATE') then
+        if new.status = 'pending' then
+            d_pending := d_pending + 1;
+            d_amount  := d_amount + coalesce(new.amount, 0);
+        elsif new.status = 'approved' then
+            d_paid := d_paid + coalesce(new.amount, 0);
+        end if;
+    end if;
+    if tg_op in ('UPDATE', 'DELETE') then
+        if old.status = 'pending' then
+            d_pending := d_pending - 1;
+            d_amount  := d_amount - coalesce(old.amount, 0);
+        elsif old.status = 'approved' then
+            d_paid := d_paid - coalesce(old.amount, 0);
+        end if;
+    end if;
+
+    if d_pending <> 0 or d_amount <> 0 or d_paid <> 0 then
+        update platform_stats
+           set pending_withdrawals = pending_withdrawals + d_pending,
+               pending_amount      = pending_amount + d_amount,
+               total_paid          = total_paid + d_paid
+         where shard = abs(hashtext(coalesce(new.id, old.id)::text)) % 16;
+    end if;
+    return null;
+end;
+$$;
+
+drop trigger if exists platform_stats_withdrawals on withdrawal_requests;
+create trigger platform_stats_withdrawals
+    after insert or update of status, amount or delete on withdrawal_requests
+    for each row execute function platform_stats_withdrawals_trg();
+
+drop function if exists reconcile_platform_stats();
+
+-- Every worker runs the periodic reconcile; the advisory lock lets only one
+-- run at a time, and p_min_age_seconds makes the others return without
+-- scanning when a reconcile finished recently.
+create or replace function reconcile_platform_stats(p_min_age_seconds double precision default 0)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_before jsonb;
+    v_after  jsonb;
+begin
+    if not pg_try_advisory_xact_lock(hashtext('reconcile_platform_stats')) then
+        return jsonb_build_object('skipped', 'running');
+    end if;
+    if p_min_age_seconds > 0 and (select max(reconciled_at) from platform_stats)
+            > now() - make_interval(secs => p_min_age_seconds) then
+        return jsonb_build_object('skipped', 'recent');
+    end if;
+
+    -- Blocks trigger updates until we commit, so no delta lands between the
+    -- aggregate scan and the rewrite
+    lock table platform_stats in exclusive mode;
+
+    select jsonb_build_object(
+        'total_users', sum(total_users), 'total_balance', sum(total_balance),
+        'banned_users', sum(banned_users), 'pending_withdrawals', sum(pending_withdrawals),
+        'pending_amount', sum(pending_amount), 'total_paid', sum(total_paid))
+      into v_before from platform_stats;
+
+    update platform_stats
+       set total_users = 0, total_balance = 0, banned_users = 0,
+           pending_withdrawals = 0, pending_amount = 0, total_paid = 0,
+           reconciled_at = now();
+
+    update platform_stats s
+       set total_users   = u.n,
+           total_balance = u.balance,
+           banned_users  = u.banned
+      from (select count(*) n, coalesce(sum(balance), 0) balance,
+                   count(*) filter (where is_banned) banned
+              from users) u
+     where s.shard = 0;
+
+    update platform_stats s
+       set pending_withdrawals = w.pending,
+           pending_amount      = w.pending_amount,
+           total_paid          = w.paid
+      from (select count(*) filter (where status = 'pending') pending,
+                   coalesce(sum(amount) filter (where status = 'pending'), 0) pending_amount,
+                   coalesce(sum(amount) filter (where status = 'approved'), 0) paid
+              from withdrawal_requests) w
+     where s.shard = 0;
+
+    select jsonb_build_object(
+        'total_users', sum(total_users), 'total_balance', sum(total_balance),
+        'banned_users', sum(banned_users), 'pending_withdrawals', sum(pending_withdrawals),
+        'pending_amount', sum(pending_amount), 'total_paid', sum(total_paid))
+      into v_after from platform_stats;
+
+    return jsonb_build_object('before', v_before, 'after', v_after);
+end;
+$$;
+
+select reconcile_platform_stats();
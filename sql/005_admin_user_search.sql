@@ -0,0 +1,8 @@
+-- Admin user search: trigram indexes serve ILIKE '%term%' on name and phone,
+-- and (created_at, id) serves keyset paging in newest-first order.
+
+create extension if not exists pg_trgm;
+
+create index if not exists users_name_trgm_idx  on users using gin (name gin_trgm_ops);
+create index if not exists users_phone_trgm_idx on users using gin (phone gin_trgm_ops);
+create index if not exists users_created_id_idx on users (created_at desc, id desc);
@@ -0,0 +1,15 @@
+-- Keyset paging + filter pushdown for the admin withdrawals/transactions queues.
+
+create index if not exists withdrawal_requests_status_created_idx
+    on withdrawal_requests (status, created_at desc, id desc);
+create index if not exists withdrawal_requests_created_idx
+    on withdrawal_requests (created_at desc, id desc);
+create index if not exists withdrawal_requests_user_created_idx
+    on withdrawal_requests (user_id, created_at desc, id desc);
+
+create index if not exists transactions_created_idx
+    on transactions (created_at desc, id desc);
+create index if not exists transactions_user_created_idx
+    on transactions (user_id, created_at desc, id desc);
+create index if not exists transactions_type_created_idx
+    on transactions (type, created_at desc, id desc);
@@ -0,0 +1,68 @@
+-- Transactional user deletion.
+-- delete_users() removes a batch of users and every row they own in one
+-- transaction: either the whole chunk is gone or nothing is. Used by the
+-- single-user admin delete and by the bulk purge job (user_purge.py).
+--
+-- wallet_journal is kept on purpose: it is the append-only audit trail of
+-- wallet balance changes and has no foreign key to users.
+--
+-- Game rooms outlive their creator and winner (other players' history and
+-- prizes hang off them), so those references are cleared instead.
+--
+-- Users with a crypto withdrawal in batching or processing are skipped and
+-- returned under "skipped": the payout is already with NOWPayments and its
+-- webhook needs the rows. Retry them once the payout settles.
+
+create index if not exists conversations_user_id_idx on conversations (user_id);
+create index if not exists crypto_transactions_user_id_idx on crypto_transactions (user_id);
+create index if not exists crypto_withdrawal_requests_user_id_idx on crypto_withdrawal_requests (user_id);
+create index if not exists game_players_user_id_idx on game_players (user_id);
+create index if not exists game_leaderboard_user_id_idx on game_leaderboard (user_id);
+create index if not exists game_rooms_created_by_idx on game_rooms (created_by);
+create index if not exists game_rooms_winner_id_idx on game_rooms (winner_id);
+
+alter table game_rooms alter column created_by drop not null;
+
+create or replace function delete_users(p_user_ids uuid[]) returns jsonb
+language plpgsql
+as $$
+declare
+    v_table   text;
+    v_rows    integer;
+    v_counts  jsonb := '{}'::jsonb;
+    v_ids     uuid[];
+    v_skipped uuid[];
+begin
+    -- Lock the withdrawals first so the payout batcher cannot claim one
+    -- between the check and the delete
+    perform 1 from crypto_withdrawal_requests where user_id = any(p_user_ids) for update;
+
+    select coalesce(array_agg(distinct user_id), '{}') into v_skipped
+      from crypto_withdrawal_requests
+     where user_id = any(p_user_ids) and status in ('batching', 'processing');
+
+    select coalesce(array_agg(id), '{}') into v_ids
+      from unnest(p_user_ids) id
+     where id <> all(v_skipped);
+
+    update game_rooms set created_by = null where created_by = any(v_ids);
+    get diagnostics v_rows = row_count;
+    update game_rooms set winner_id = null where winner_id = any(v_ids);
+    v_counts := jsonb_build_object('game_rooms_reassigned', v_rows);
+
+    -- Children first, users last
+    foreach v_table in array array[
+        'transactions', 'withdrawal_requests', 'recent_transfers', 'conversations',
+        'crypto_transactions', 'crypto_withdrawal_requests', 'crypto_wallets',
+        'game_players', 'game_leaderboard'
+    ] loop
+        execute format('delete from %I where user_id = any($1)', v_table) using v_ids;
+        get diagnostics v_rows = row_count;
+        v_counts := v_counts || jsonb_build_object(v_table, v_rows);
+    end loop;
+
+    delete from users where id = any(v_ids);
+    get diagnostics v_rows = row_count;
+    return v_counts || jsonb_build_object('users', v_rows, 'skipped', to_jsonb(v_skipped));
+end;
+$$;
@@ -0,0 +1,11 @@
+-- Signup checks.
+-- The in-process signup index (signup_index.py) skips the phone lookup for
+-- phones it has never seen, so the database must reject duplicates itself.
+-- Fails if duplicate phones already exist; clean those up first.
+
+create unique index if not exists users_phone_key on users (phone);
+
+-- Fallback lookups when the index cannot answer
+create index if not exists users_signup_ip_idx on users (signup_ip);
+create index if not exists users_device_id_idx on users (device_id);
+create index if not exists users_referral_code_idx on users (referral_code);
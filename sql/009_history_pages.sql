@@ -0,0 +1,5 @@
+-- Keyset paging of the per-user wallet history (/api/wallet/transactions).
+-- transactions is already covered by transactions_user_created_idx (006).
+
+create index if not exists crypto_transactions_user_created_idx
+    on crypto_transactions (user_id, created_at desc, id desc);
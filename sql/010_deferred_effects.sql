@@ -0,0 +1,36 @@
+-- Targets of the deferred side effects run by the local job queue (jobs.py).
+
+-- Leaderboard increments as one atomic upsert, so concurrent job workers
+-- cannot lose each other's updates the way the old read-then-update could.
+create unique index if not exists game_leaderboard_user_id_key on game_leaderboard (user_id);
+
+create or replace function bump_leaderboard(
+    p_user_id  uuid,
+    p_wins     integer default 0,
+    p_kills    integer default 0,
+    p_games    integer default 0,
+    p_earnings numeric default 0
+) returns void
+language sql
+as $$
+    insert into game_leaderboard (user_id, total_wins, total_kills, total_games, total_earnings, updated_at)
+    values (p_user_id, p_wins, p_kills, p_games, p_earnings, now())
+    on conflict (user_id) do update set
+        total_wins     = game_leaderboard.total_wins + excluded.total_wins,
+        total_kills    = game_leaderboard.total_kills + excluded.total_kills,
+        total_games    = game_leaderboard.total_games + excluded.total_games,
+        total_earnings = game_leaderboard.total_earnings + excluded.total_earnings,
+        updated_at     = now();
+$$;
+
+-- Durable log of NOWPayments IPN payloads (previously only printed)
+create table if not exists webhook_log (
+    id          bigserial primary key,
+    provider    text        not null,
+    payment_id  text,
+    status      text,
+    payload     jsonb       not null,
+    received_at timestamptz not null default now()
+);
+
+create index if not exists webhook_log_payment_idx on webhook_log (payment_id, received_at desc);
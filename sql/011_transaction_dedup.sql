@@ -0,0 +1,9 @@
+-- Idempotent transaction log writes.
+-- tx_writer.py sends spooled rows at least once; each row carries a
+-- dedup_key and is upserted with ON CONFLICT (dedup_key) DO NOTHING, so a
+-- batch resent after a crash or timeout never logs a row twice.
+-- Older rows keep a NULL key (NULLs never conflict).
+
+alter table transactions add column if not exists dedup_key text;
+
+create unique index if not exists transactions_dedup_key on transactions (dedup_key);
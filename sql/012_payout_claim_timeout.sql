@@ -0,0 +1,6 @@
+-- Claim time of a payout batch, so rows stranded in 'batching' can be reaped.
+
+alter table crypto_withdrawal_requests add column if not exists batched_at timestamptz;
+
+create index if not exists crypto_withdrawal_requests_batching_idx
+    on crypto_withdrawal_requests (batched_at) where status = 'batching';
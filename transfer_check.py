@@ -0,0 +1,61 @@
+import os, random, sys, time
+from concurrent.futures import ThreadPoolExecutor
+
+TRANSFERS = int(os.environ.get("TRANSFER_CHECK_COUNT", 2000))
+THREADS   = int(os.environ.get("TRANSFER_CHECK_THREADS", 16))
+
+# ── transfer_funds concurrency check ─────────────────────
+# Fires concurrent transfers between the given users through the real
+# transfer_funds RPC, so the row locks under test are Postgres's own, then
+# checks that their combined balance is unchanged and none went negative.
+# It moves real balances: run it against a staging project only.
+#   SUPABASE_URL=... SUPABASE_KEY=... python transfer_check.py <user_id> <user_id> [...]
+
+def balances(ledger, user_ids):
+    rows = ledger.supabase.table("users").select("id,balance").in_("id", user_ids).execute().data
+    return {r["id"]: float(r["balance"]) for r in rows}
+
+def main(user_ids):
+    import ledger  # creates the Supabase client, so only once the arguments are checked
+    rows = ledger.supabase.table("users").select("id,phone").in_("id", user_ids).execute().data
+    phones = {r["id"]: r["phone"] for r in rows}
+    missing = set(user_ids) - set(phones)
+    if missing:
+        sys.exit(f"Unknown users: {', '.join(sorted(missing))}")
+
+    def one(_):
+        sender, recipient = random.sample(user_ids, 2)
+        result = ledger.transfer(sender, phones[recipient], round(random.uniform(0.01, 5), 2))
+        return result["ok"], result.get("error")
+
+    before = balances(ledger, user_ids)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        results = list(pool.map(one, range(TRANSFERS)))
+    elapsed = time.perf_counter() - start
+    after = balances(ledger, user_ids)
+
+    applied = sum(1 for ok, _ in results if ok)
+    errors = {}
+    for ok, error in results:
+        if not ok:
+            errors[error] = errors.get(error, 0) + 1
+    total_before, total_after = round(sum(before.values()), 6), round(sum(after.values()), 6)
+    negative = [u for u, b in after.items() if b < 0]
+
+    print(f"{TRANSFERS} transfers on {THREADS} threads: {elapsed:.2f}s ({TRANSFERS / elapsed:,.0f}/s), "
+          f"{applied} applied, rejected: {errors or 0}")
+    print(f"total balance before={total_before} after={total_after} -> "
+          f"{'conserved' if total_before == total_after else 'MISMATCH'}")
+    if negative:
+        print(f"negative balances: {negative}")
+    # ledger_error means the RPC itself failed (e.g. a deadlock), which the locking should prevent
+    return total_before == total_after and not negative and "ledger_error" not in errors
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        sys.exit("usage: python transfer_check.py <user_id> <user_id> [...]")
+    if not os.environ.get("SUPABASE_URL") or not os.environ.get("SUPABASE_KEY"):
+        sys.exit("SUPABASE_URL and SUPABASE_KEY must point at the (staging) project to test")
+    sys.exit(0 if main(sys.argv[1:]) else 1)
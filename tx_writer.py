@@ -0,0 +1,309 @@
+import os, json, threading, time, uuid
+from datetime import datetime, timezone
+from supabase import create_client
+from postgrest.exceptions import APIError
+from local_store import connect, durable_path
+import history
+
+SUPABASE_URL = os.environ.get("SUPABASE_URL")
+SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
+supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+TX_SPOOL_DB      = os.environ.get("TX_SPOOL_DB") or durable_path("tx_spool.db")
+TX_BATCH_WINDOW  = float(os.environ.get("TX_BATCH_WINDOW", 0.25))
+TX_BATCH_SIZE    = int(os.environ.get("TX_BATCH_SIZE", 50))      # wake the flusher early at this many
+TX_BATCH_MAX     = int(os.environ.get("TX_BATCH_MAX", 500))      # rows per bulk insert
+TX_CLAIM_TIMEOUT = float(os.environ.get("TX_CLAIM_TIMEOUT", 60))
+TX_FLUSH_TIMEOUT = float(os.environ.get("TX_FLUSH_TIMEOUT", 5))
+TX_MAX_ATTEMPTS  = int(os.environ.get("TX_MAX_ATTEMPTS", 10))    # a row rejected this often is parked as failed
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tx_spool (
+    dedup_key    TEXT PRIMARY KEY,
+    row          TEXT NOT NULL,
+    status       TEXT NOT NULL DEFAULT 'pending',   -- pending | sending | failed (sent rows are deleted)
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    created_at   REAL NOT NULL,
+    available_at REAL NOT NULL,
+    claimed_by   TEXT,
+    claimed_at   REAL,
+    last_error   TEXT
+);
+CREATE INDEX IF NOT EXISTS tx_spool_status_idx ON tx_spool (status, available_at, created_at);
+"""
+
+# ── Batched transactions writer ──────────────────────────
+class TransactionWriter:
+    """
+    Batches transactions rows into bulk inserts.
+
+    write() commits the row to a local SQLite spool and returns. The spool
+    is shared by the workers on the host, lives under DURABLE_STORE_DIR and
+    fsyncs every commit. A flusher thread in each worker sends pending rows
+    every TX_BATCH_WINDOW seconds, or sooner once TX_BATCH_SIZE rows are
+    waiting, as one upsert of up to TX_BATCH_MAX rows. Spooled rows survive
+    a worker crash or restart: another worker reclaims them after
+    TX_CLAIM_TIMEOUT. Delivery is at-least-once, and every row carries a
+    dedup_key with a unique index on transactions (sql/011), so a resent
+    row is ignored instead of logged twice.
+
+    A batch the database rejects is split in halves and resent, so one bad
+    row (e.g. its user was purged) cannot hold back the rest. A single row
+    rejected TX_MAX_ATTEMPTS times is parked as failed and counted in
+    stats(). Transport errors never park rows; they are retried with
+    backoff until the database is reachable again.
+
+    flush(keys) sends specific rows from the calling thread, for routes
+    that must not respond before the log is written.
+    """
+
+    def __init__(self, path=TX_SPOOL_DB):
+        self.path = path
+        self._pid = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._worker_id = None
+        self._pending = 0
+        self.batches = 0
+        self.rows = 0
+        self.errors = 0
+
+    def _conn(self):
+        return connect(self.path, SCHEMA, durable=True)
+
+    def write(self, user_id, tx_type, amount, description, dedup_key=None):
+        """Spool one transactions row. Returns its dedup_key."""
+        dedup_key = dedup_key or uuid.uuid4().hex
+        now = time.time()
+        row = {
+            "user_id": user_id,
+            "type": tx_type,
+            "amount": amount,
+            "description": description,
+            "dedup_key": dedup_key,
+            # Stamped now so batching does not reorder history
+            "created_at": datetime.now(timezone.utc).isoformat()
+        }
+        self._conn().execute(
+            "INSERT OR IGNORE INTO tx_spool (dedup_key, row, created_at, available_at) VALUES (?, ?, ?, ?)",
+            (dedup_key, json.dumps(row, default=str), now, now)
+        )
+        self.ensure_started()
+        with self._lock:
+            self._pending += 1
+            if self._pending >= TX_BATCH_SIZE:
+                self._wake.set()
+        return dedup_key
+
+    def flush(self, keys=None, timeout=TX_FLUSH_TIMEOUT):
+        """
+        Send the given rows (or everything pending) now. Returns True once
+        they are all written; False on error or if the flusher still holds
+        some of them after `timeout` seconds.
+        """
+        deadline = time.time() + timeout
+        while True:
+            try:
+                self._send(self._claim(keys))
+            except Exception as e:
+                print(f"Transaction flush failed: {e}")
+                return False
+            remaining = self._remaining(keys)
+            if not remaining:
+                return True
+            if time.time() >= deadline:
+                return False
+            # Rows claimed by a flusher thread are in flight; wait for them
+            time.sleep(0.05)
+
+    def _remaining(self, keys):
+        conn = self._conn()
+        if keys is None:
+            return conn.execute("SELECT COUNT(*) FROM tx_spool WHERE status != 'failed'").fetchone()[0]
+        marks = ",".join("?" * len(keys))
+        return conn.execute(f"SELECT COUNT(*) FROM tx_spool WHERE dedup_key IN ({marks})", list(keys)).fetchone()[0]
+
+    # ── Flusher ──────────────────────────────────────────
+    def ensure_started(self):
+        """Start the flusher thread once per process (safe after fork)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+            threading.Thread(target=self._run, name="tx-writer", daemon=True).start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(TX_BATCH_WINDOW)
+            self._wake.clear()
+            with self._lock:
+                self._pending = 0
+            try:
+                while self._send(self._claim()) >= TX_BATCH_MAX:
+                    pass
+            except Exception as e:
+                print(f"Transaction batch failed: {e}")
+
+    def _claim(self, keys=None):
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Release rows held by a worker that died mid-send
+            conn.execute("UPDATE tx_spool SET status = 'pending', claimed_by = NULL "
+                         "WHERE status = 'sending' AND claimed_at < ?", (now - TX_CLAIM_TIMEOUT,))
+            if keys is None:
+                rows = conn.execute(
+                    "SELECT dedup_key, row FROM tx_spool WHERE status = 'pending' AND available_at <= ? "
+                    "ORDER BY created_at LIMIT ?", (now, TX_BATCH_MAX)
+                ).fetchall()
+            else:
+                # Explicit flushes ignore the retry backoff
+                marks = ",".join("?" * len(keys))
+                rows = conn.execute(
+                    f"SELECT dedup_key, row FROM tx_spool WHERE status = 'pending' AND dedup_key IN ({marks})",
+                    list(keys)
+                ).fetchall()
+            conn.executemany("UPDATE tx_spool SET status = 'sending', claimed_by = ?, claimed_at = ? WHERE dedup_key = ?",
+                             [(self._worker_id, now, r[0]) for r in rows])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return rows
+
+    def _send(self, claimed):
+        """Upsert claimed rows; returns how many were written. Raises if any row was not."""
+        if not claimed:
+            return 0
+        sent, error = self._send_batch(claimed)
+        if error:
+            raise error
+        return sent
+
+    def _send_batch(self, claimed):
+        rows = [json.loads(r[1]) for r in claimed]
+        try:
+            supabase.table("transactions").upsert(rows, on_conflict="dedup_key", ignore_duplicates=True).execute()
+        except APIError as e:
+            if len(claimed) > 1:
+                # Rejected by the database: bisect so the good rows still commit
+                mid = len(claimed) // 2
+                left, left_error = self._send_batch(claimed[:mid])
+                right, right_error = self._send_batch(claimed[mid:])
+                return left + right, left_error or right_error
+            self._release(claimed, e, park=True)
+            return 0, e
+        except Exception as e:
+            self._release(claimed, e)
+            return 0, e
+        self._conn().executemany("DELETE FROM tx_spool WHERE dedup_key = ?", [(r[0],) for r in claimed])
+        self.batches += 1
+        self.rows += len(rows)
+        history.invalidate(*{r["user_id"] for r in rows})
+        return len(rows), None
+
+    def _release(self, claimed, error, park=False):
+        """Back to pending with backoff; with park, a row out of attempts becomes failed"""
+        self.errors += 1
+        limit = TX_MAX_ATTEMPTS if park else None
+        self._conn().executemany(
+            "UPDATE tx_spool SET status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END, "
+            "claimed_by = NULL, attempts = attempts + 1, "
+            "available_at = ? + MIN(300, 1 << MIN(attempts, 8)), last_error = ? WHERE dedup_key = ?",
+            [(limit, time.time(), str(error)[:500], r[0]) for r in claimed]
+        )
+        if park:
+            print(f"Transaction row {claimed[0][0]} rejected: {error}")
+
+    def stats(self):
+        conn = self._conn()
+        counts = dict(conn.execute("SELECT status, COUNT(*) FROM tx_spool GROUP BY status").fetchall())
+        oldest = conn.execute("SELECT MIN(created_at) FROM tx_spool").fetchone()[0]
+        return {
+            "pending": counts.get("pending", 0),
+            "sending": counts.get("sending", 0),
+            "failed": counts.get("failed", 0),
+            "oldest_age_seconds": round(time.time() - oldest, 3) if oldest else 0,
+            "worker": {
+                "batches": self.batches,
+                "rows": self.rows,
+                "avg_batch": round(self.rows / self.batches, 1) if self.batches else None,
+                "errors": self.errors
+            }
+        }
+
+tx_writer = TransactionWriter()
+
+
+if __name__ == "__main__":
+    # Batched vs one-insert-per-row against a stand-in sink with a fixed
+    # per-request latency (like a PostgREST round trip):
+    #   python tx_writer.py [rows] [latency_ms]
+    import sys, tempfile
+    from concurrent.futures import ThreadPoolExecutor
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    latency = (float(sys.argv[2]) if len(sys.argv) > 2 else 20) / 1000
+    sink = {}
+    sink_lock = threading.Lock()
+
+    class FakeTable:
+        def upsert(self, rows, on_conflict=None, ignore_duplicates=False):
+            self.rows = rows
+            return self
+
+        def execute(self):
+            time.sleep(latency)
+            if any(r.get("user_id") == "purged" for r in self.rows):
+                raise APIError({"message": "violates foreign key constraint", "code": "23503"})
+            with sink_lock:
+                for r in self.rows:
+                    sink.setdefault(r["dedup_key"], r)
+
+    class FakeClient:
+        def table(self, name):
+            return FakeTable()
+
+    supabase = FakeClient()
+    history.invalidate = lambda *user_ids: None
+
+    # One insert per row from 16 request threads
+    started = time.perf_counter()
+    with ThreadPoolExecutor(16) as pool:
+        list(pool.map(lambda i: FakeTable().upsert([{"dedup_key": f"d{i}"}]).execute(), range(n)))
+    direct = time.perf_counter() - started
+    print(f"direct:  {n} rows in {direct:.2f}s ({n / direct:,.0f} rows/s, {n} requests)")
+
+    sink.clear()
+    writer = TransactionWriter(path=os.path.join(tempfile.mkdtemp(), "tx_spool.db"))
+    started = time.perf_counter()
+    with ThreadPoolExecutor(16) as pool:
+        list(pool.map(lambda i: writer.write(f"u{i % 50}", "deposit", 1, "bench"), range(n)))
+    spooled = time.perf_counter() - started
+    writer.flush(timeout=60)
+    total = time.perf_counter() - started
+    print(f"batched: {len(sink)} rows spooled in {spooled:.2f}s, all written after {total:.2f}s "
+          f"({writer.batches} requests, avg batch {writer.stats()['worker']['avg_batch']})")
+
+    # Resending a claimed batch (e.g. after a crash) must not duplicate rows
+    key = writer.write("u1", "deposit", 1, "resend")
+    claimed = writer._claim([key])
+    writer._send(claimed)
+    writer._send(claimed)
+    print(f"resend:  {sum(1 for k in sink if k == key)} row for dedup_key {key[:8]}…")
+
+    # A row the database always rejects must not hold back its batch
+    TX_MAX_ATTEMPTS = 3
+    good = [writer.write(f"u{i}", "deposit", 1, "batch") for i in range(9)]
+    bad = writer.write("purged", "deposit", 1, "batch")
+    for _ in range(TX_MAX_ATTEMPTS):
+        try:
+            writer._send(writer._claim(good + [bad]))
+        except APIError:
+            pass
+    print(f"bad row: {sum(1 for k in good if k in sink)}/{len(good)} good rows written, "
+          f"stats {dict((k, v) for k, v in writer.stats().items() if k in ('pending', 'failed'))}")
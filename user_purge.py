@@ -0,0 +1,246 @@
+import os, json, threading, time, uuid
+from supabase import create_client
+from local_store import connect, store_path
+
+SUPABASE_URL = os.environ.get("SUPABASE_URL")
+SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
+supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+PURGE_DB            = os.environ.get("PURGE_DB") or store_path("user_purge.db")
+PURGE_CHUNK_SIZE    = int(os.environ.get("PURGE_CHUNK_SIZE", 100))
+PURGE_MAX_IDS       = int(os.environ.get("PURGE_MAX_IDS", 50000))
+PURGE_CLAIM_TIMEOUT = float(os.environ.get("PURGE_CLAIM_TIMEOUT", 120))
+PURGE_DEFER_WAIT    = float(os.environ.get("PURGE_DEFER_WAIT", 60))  # recheck users with a payout in flight
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS purge_jobs (
+    id         TEXT PRIMARY KEY,
+    status     TEXT NOT NULL DEFAULT 'queued',   -- queued | running | done
+    total      INTEGER NOT NULL,
+    deleted    INTEGER NOT NULL DEFAULT 0,
+    failed     INTEGER NOT NULL DEFAULT 0,
+    row_counts TEXT NOT NULL DEFAULT '{}',
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    claimed_by TEXT,
+    heartbeat  REAL
+);
+CREATE TABLE IF NOT EXISTS purge_items (
+    job_id  TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    status  TEXT NOT NULL DEFAULT 'pending',      -- pending | deferred | done | failed
+    error   TEXT,
+    PRIMARY KEY (job_id, user_id)
+);
+CREATE INDEX IF NOT EXISTS purge_items_status_idx ON purge_items (job_id, status);
+"""
+
+def delete_users(user_ids):
+    """
+    Delete users and all rows they own in one transaction; returns per-table
+    row counts plus "skipped": ids left alone because a payout is in flight
+    """
+    return supabase.rpc("delete_users", {"p_user_ids": list(user_ids)}).execute().data or {}
+
+def parse_user_ids(raw):
+    """Dedupe and validate a list of user ids. Returns (ids, invalid)."""
+    ids, invalid, seen = [], [], set()
+    for value in raw or []:
+        try:
+            uid = str(uuid.UUID(str(value)))
+        except ValueError:
+            invalid.append(value)
+            continue
+        if uid not in seen:
+            seen.add(uid)
+            ids.append(uid)
+    return ids, invalid
+
+# ── Bulk purge jobs ──────────────────────────────────────
+class PurgeJobs:
+    """
+    Deletes many users as one background job. Ids are persisted in a SQLite
+    file shared by the workers on the host, then removed in chunks of
+    PURGE_CHUNK_SIZE with one delete_users() call each. Each chunk is a
+    single transaction. If a chunk fails, its users are retried one by one
+    so that one bad id does not block the rest. Users delete_users() skips
+    (a crypto payout in flight) are deferred and retried every
+    PURGE_DEFER_WAIT seconds until their payout settles. Progress can be
+    read from any worker, and a job left by a dead worker is picked up by
+    another.
+    """
+
+    def __init__(self, path=PURGE_DB):
+        self.path = path
+        self._pid = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._worker_id = None
+
+    def _conn(self):
+        return connect(self.path, SCHEMA)
+
+    def create(self, user_ids):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("INSERT INTO purge_jobs (id, total, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                         (job_id, len(user_ids), now, now))
+            conn.executemany("INSERT INTO purge_items (job_id, user_id) VALUES (?, ?)",
+                             [(job_id, uid) for uid in user_ids])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self.ensure_started()
+        self._wake.set()
+        return job_id
+
+    def progress(self, job_id):
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT status, total, deleted, failed, row_counts, created_at, updated_at FROM purge_jobs WHERE id = ?",
+            (job_id,)
+        ).fetchone()
+        if not row:
+            return None
+        status, total, deleted, failed, row_counts, created_at, updated_at = row
+        errors = conn.execute(
+            "SELECT user_id, error FROM purge_items WHERE job_id = ? AND status = 'failed' LIMIT 100", (job_id,)
+        ).fetchall()
+        return {
+            "job_id": job_id,
+            "status": status,
+            "total": total,
+            "deleted": deleted,
+            "failed": failed,
+            "remaining": total - deleted - failed,
+            "deferred": conn.execute("SELECT COUNT(*) FROM purge_items WHERE job_id = ? AND status = 'deferred'",
+                                     (job_id,)).fetchone()[0],
+            "percent": round(100 * (deleted + failed) / total, 1) if total else 100.0,
+            "rows_deleted": json.loads(row_counts),
+            "errors": [{"user_id": uid, "error": err} for uid, err in errors],
+            "created_at": created_at,
+            "updated_at": updated_at
+        }
+
+    # ── Runner ───────────────────────────────────────────
+    def ensure_started(self):
+        """Start the runner thread once per process (safe after fork)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+            threading.Thread(target=self._run, name="user-purge", daemon=True).start()
+
+    def _claim(self):
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Queued jobs, or running jobs whose worker stopped heartbeating
+            row = conn.execute(
+                "SELECT id FROM purge_jobs WHERE status = 'queued' "
+                "OR (status = 'running' AND heartbeat < ?) ORDER BY created_at LIMIT 1",
+                (now - PURGE_CLAIM_TIMEOUT,)
+            ).fetchone()
+            if row:
+                conn.execute(
+                    "UPDATE purge_jobs SET status = 'running', claimed_by = ?, heartbeat = ? WHERE id = ?",
+                    (self._worker_id, now, row[0])
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return row[0] if row else None
+
+    def _run(self):
+        while True:
+            try:
+                job_id = self._claim()
+            except Exception as e:
+                print(f"User purge claim error: {e}")
+                job_id = None
+            if not job_id:
+                self._wake.wait(30)
+                self._wake.clear()
+                continue
+            try:
+                self._process(job_id)
+            except Exception as e:
+                # Leave the job 'running'; it is reclaimed after PURGE_CLAIM_TIMEOUT
+                print(f"User purge job {job_id} error: {e}")
+                time.sleep(5)
+
+    def _process(self, job_id):
+        conn = self._conn()
+        while True:
+            chunk = [r[0] for r in conn.execute(
+                "SELECT user_id FROM purge_items WHERE job_id = ? AND status = 'pending' LIMIT ?",
+                (job_id, PURGE_CHUNK_SIZE)
+            )]
+            if not chunk and self._requeue_deferred(job_id):
+                continue
+            if not chunk:
+                conn.execute("UPDATE purge_jobs SET status = 'done', updated_at = ? WHERE id = ?",
+                             (time.time(), job_id))
+                print(f"User purge job {job_id} finished")
+                return
+            try:
+                self._record(job_id, chunk, delete_users(chunk))
+            except Exception as e:
+                print(f"User purge chunk of {len(chunk)} failed, retrying individually: {e}")
+                for uid in chunk:
+                    try:
+                        self._record(job_id, [uid], delete_users([uid]))
+                    except Exception as err:
+                        self._record(job_id, [uid], None, error=str(err)[:500])
+
+    def _requeue_deferred(self, job_id):
+        """Wait, then put deferred users back to pending; False if there are none"""
+        conn = self._conn()
+        if not conn.execute("SELECT 1 FROM purge_items WHERE job_id = ? AND status = 'deferred' LIMIT 1",
+                            (job_id,)).fetchone():
+            return False
+        conn.execute("UPDATE purge_jobs SET heartbeat = ? WHERE id = ?", (time.time(), job_id))
+        time.sleep(PURGE_DEFER_WAIT)
+        conn.execute("UPDATE purge_items SET status = 'pending' WHERE job_id = ? AND status = 'deferred'", (job_id,))
+        conn.execute("UPDATE purge_jobs SET heartbeat = ? WHERE id = ?", (time.time(), job_id))
+        return True
+
+    def _record(self, job_id, user_ids, counts, error=None):
+        counts = dict(counts or {})
+        skipped = {str(uid) for uid in counts.pop("skipped", None) or []}
+        user_ids = [uid for uid in user_ids if uid not in skipped]
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "UPDATE purge_items SET status = 'deferred' WHERE job_id = ? AND user_id = ?",
+                [(job_id, uid) for uid in skipped]
+            )
+            conn.executemany(
+                "UPDATE purge_items SET status = ?, error = ? WHERE job_id = ? AND user_id = ?",
+                [("failed" if error else "done", error, job_id, uid) for uid in user_ids]
+            )
+            totals = json.loads(conn.execute("SELECT row_counts FROM purge_jobs WHERE id = ?", (job_id,)).fetchone()[0])
+            for table, n in counts.items():
+                totals[table] = totals.get(table, 0) + n
+            now = time.time()
+            conn.execute(
+                "UPDATE purge_jobs SET deleted = deleted + ?, failed = failed + ?, row_counts = ?, "
+                "updated_at = ?, heartbeat = ? WHERE id = ?",
+                (0 if error else len(user_ids), len(user_ids) if error else 0, json.dumps(totals), now, now, job_id)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+purge_jobs = PurgeJobs()
@@ -1,7 +1,7 @@
 import random
 import jwt
 from datetime import datetime, timedelta
-from passlib.hash import bcrypt
+import bcrypt
 from config import JWT_SECRET, JWT_ALGORITHM
 
 # ------------------------------
@@ -14,12 +14,22 @@ def generate_otp():
 # ------------------------------
 # Password hashing
 # ------------------------------
-def hash_password(password: str) -> str:
-    return bcrypt.hash(password)
+# bcrypt only reads the first 72 bytes; truncate explicitly (as passlib
+# did) so bcrypt>=5, which raises on longer input, accepts the same passwords
+def _bcrypt_secret(password: str) -> bytes:
+    return password.encode("utf-8")[:72]
+
+
+def hash_password(password: str, rounds: int = 12) -> str:
+    return bcrypt.hashpw(_bcrypt_secret(password), bcrypt.gensalt(rounds)).decode()
 
 
 def verify_password(password: str, hashed: str) -> bool:
-    return bcrypt.verify(password, hashed)
+    try:
+        return bcrypt.checkpw(_bcrypt_secret(password), hashed.encode())
+    except ValueError:
+        # Malformed stored hash
+        return False
 
 
 # ------------------------------
@@ -1,7 +1,7 @@
 from flask import Blueprint, request, jsonify
 from functools import wraps
-import os, hashlib, hmac, time, uuid, requests
-from datetime import datetime, timezone, timedelta
+import os, hashlib, hmac, time, uuid, threading
+from datetime import datetime, timezone
 from supabase import create_client
 
 # ── Config from environment ──────────────────────────────
@@ -12,29 +12,24 @@ NOWPAY_IPN_SECRET    = os.environ.get("NOWPAY_IPN_SECRET")
 WALLET_SECRET        = os.environ.get("WALLET_SECRET")
 ADMIN_SECRET         = os.environ.get("ADMIN_SECRET")
 
-NOWPAY_BASE = "https://api.nowpayments.io/v1"
+PAYMENT_INDEX_WARM   = int(os.environ.get("PAYMENT_INDEX_WARM", 50000))
+DEPOSIT_CACHE_TTL    = int(os.environ.get("DEPOSIT_CACHE_TTL", 1200))  # used when NOWPayments gives no expiry
 
 supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
 wallet = Blueprint("wallet", __name__)
 
-# ── Rate limiting ────────────────────────────────────────
-rate_store = {}
-def rate_limit(max_calls=5, window=60):
-    def decorator(f):
-        @wraps(f)
-        def wrapped(*args, **kwargs):
-            key = request.remote_addr + f.__name__
-            now = time.time()
-            calls = [t for t in rate_store.get(key, []) if now - t < window]
-            if len(calls) >= max_calls:
-                return jsonify({"success": False, "error": "Too many requests. Try again later."}), 429
-            calls.append(now)
-            rate_store[key] = calls
-            return f(*args, **kwargs)
-        return wrapped
-    return decorator
-
+from rate_limiter import rate_limit
+import ledger
+import history
+import jobs
+from webhook_queue import nowpay_events
+from idempotency import ProcessedIndex
+from nowpay_client import nowpay, CircuitOpen
+from payout_batcher import payouts
+from cache import TTLCache
+from wallet_sessions import wallet_sessions, PIN_MAX_ATTEMPTS, WALLET_SESSION_ENFORCE
 from utils import decode_jwt
+from pagination import page_limit
 
 # ── Auth middleware ──────────────────────────────────────
 def wallet_auth(f):
@@ -60,14 +55,28 @@ def wallet_auth(f):
         return f(*args, **kwargs)
     return decorated
 
+def wallet_session_required(f):
+    """
+    Sensitive wallet operations need a PIN session (X-Wallet-Session), checked
+    without a DB call. A header that is sent must be valid; a missing header is
+    only rejected once WALLET_SESSION_ENFORCE is on.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        token = request.headers.get("X-Wallet-Session", "")
+        if not token and not WALLET_SESSION_ENFORCE:
+            print(f"Wallet session missing on {request.path} for user {request.user['id']} (not enforced)")
+            return f(*args, **kwargs)
+        if not wallet_sessions.validate(token, request.user["id"]):
+            return jsonify({"success": False, "error": "Wallet session expired. Verify your PIN.", "needs_pin": True}), 401
+        return f(*args, **kwargs)
+    return decorated
+
 # ── PIN helpers ──────────────────────────────────────────
 def hash_pin(pin):
     return hashlib.sha256((pin + WALLET_SECRET).encode()).hexdigest()
 
 # ── NOWPayments helpers ──────────────────────────────────
-def nowpay_headers():
-    return {"x-api-key": NOWPAY_API_KEY, "Content-Type": "application/json"}
-
 def create_nowpay_deposit(user_id, amount_usd=5):
     """Create a NOWPayments payment for USDT TRC20 deposit"""
     try:
@@ -80,37 +89,18 @@ def create_nowpay_deposit(user_id, amount_usd=5):
             "ipn_callback_url": f"{os.environ.get('APP_URL', 'https://sample-api-1-ryj7.onrender.com')}/api/wallet/webhook/nowpayments"
         }
         print(f"NOWPayments request: {payload}")
-        res = requests.post(f"{NOWPAY_BASE}/payment", headers=nowpay_headers(), json=payload)
+        res = nowpay.create_payment(payload)
         print(f"NOWPayments response {res.status_code}: {res.text}")
         if res.status_code in [200, 201]:
             return res.json()
         return None
+    except CircuitOpen as e:
+        print(f"NOWPayments deposit skipped: {e}")
+        return None
     except Exception as e:
         print(f"NOWPayments deposit exception: {e}")
         return None
 
-def create_nowpay_payout(address, amount_usdt):
-    """Send USDT TRC20 to a wallet address via NOWPayments custody"""
-    try:
-        withdrawal_id = str(uuid.uuid4())
-        res = requests.post(f"{NOWPAY_BASE}/payout", headers=nowpay_headers(), json={
-            "withdrawals": [{
-                "address": address,
-                "currency": "usdttrc20",
-                "amount": str(amount_usdt),
-                "ipn_callback_url": f"{os.environ.get('APP_URL', '')}/api/wallet/webhook/nowpayments",
-                "unique_external_id": withdrawal_id
-            }]
-        })
-        if res.status_code in [200, 201]:
-            data = res.json()
-            return {"success": True, "data": data, "withdrawal_id": withdrawal_id}
-        print(f"NOWPayments payout error: {res.text}")
-        return {"success": False, "error": res.text}
-    except Exception as e:
-        print(f"NOWPayments payout exception: {e}")
-        return {"success": False, "error": str(e)}
-
 def verify_ipn_signature(request_body, signature):
     """Verify NOWPayments IPN webhook signature"""
     try:
@@ -129,7 +119,7 @@ def verify_ipn_signature(request_body, signature):
 
 @wallet.route("/api/wallet/pin/setup", methods=["POST"])
 @wallet_auth
-@rate_limit(max_calls=5, window=300)
+@rate_limit(max_calls=5, window=300, strict=True)
 def setup_pin():
     data = request.json or {}
     pin = str(data.get("pin", "")).strip()
@@ -148,13 +138,14 @@ def setup_pin():
         supabase.table("crypto_wallets").update({"pin_hash": pin_hash}).eq("user_id", user_id).execute()
     else:
         supabase.table("crypto_wallets").insert({"user_id": user_id, "pin_hash": pin_hash}).execute()
+    wallet_sessions.revoke_user(user_id)
 
     return jsonify({"success": True, "message": "PIN created successfully"})
 
 
 @wallet.route("/api/wallet/pin/verify", methods=["POST"])
 @wallet_auth
-@rate_limit(max_calls=5, window=300)
+@rate_limit(max_calls=5, window=300, strict=True)
 def verify_pin():
     data = request.json or {}
     pin = str(data.get("pin", "")).strip()
@@ -163,6 +154,13 @@ def verify_pin():
         return jsonify({"success": False, "error": "Invalid PIN format"}), 400
 
     user_id = request.user["id"]
+
+    # Lockout is checked in memory before touching the DB
+    locked = wallet_sessions.locked_until(user_id)
+    if locked:
+        mins = int((locked - time.time()) / 60)
+        return jsonify({"success": False, "error": f"Wallet locked. Try again in {mins} minutes."}), 429
+
     result = supabase.table("crypto_wallets").select(
         "pin_hash,locked_until,failed_attempts"
     ).eq("user_id", user_id).execute()
@@ -172,38 +170,76 @@ def verify_pin():
 
     wallet_row = result.data[0]
 
-    # Check lockout
+    # Lockout persisted in the DB (e.g. from before a restart)
     locked_until = wallet_row.get("locked_until")
     if locked_until:
         locked_dt = datetime.fromisoformat(locked_until.replace("Z", "+00:00"))
         if datetime.now(timezone.utc) < locked_dt:
+            wallet_sessions.lock(user_id, locked_dt.timestamp())
             mins = int((locked_dt - datetime.now(timezone.utc)).total_seconds() / 60)
             return jsonify({"success": False, "error": f"Wallet locked. Try again in {mins} minutes."}), 429
 
     if wallet_row["pin_hash"] != hash_pin(pin):
-        attempts = (wallet_row.get("failed_attempts") or 0) + 1
-        update = {"failed_attempts": attempts}
-        if attempts >= 5:
-            update["locked_until"] = (datetime.now(timezone.utc) + timedelta(minutes=30)).isoformat()
-        supabase.table("crypto_wallets").update(update).eq("user_id", user_id).execute()
-        left = max(0, 5 - attempts)
+        attempts, locked = wallet_sessions.record_failure(user_id)
+        if locked:
+            # Only the lockout itself is written to the DB (audit + survives restarts)
+            supabase.table("crypto_wallets").update({
+                "failed_attempts": attempts,
+                "locked_until": datetime.fromtimestamp(locked, timezone.utc).isoformat()
+            }).eq("user_id", user_id).execute()
+        left = max(0, PIN_MAX_ATTEMPTS - attempts)
         return jsonify({"success": False, "error": f"Wrong PIN. {left} attempts left."}), 401
 
     # Reset on success + issue session token
-    session_token = str(uuid.uuid4())
-    supabase.table("crypto_wallets").update({
-        "failed_attempts": 0,
-        "locked_until": None,
-        "session_token": session_token,
-        "session_expires": int((datetime.now(timezone.utc) + timedelta(minutes=30)).timestamp())
-    }).eq("user_id", user_id).execute()
+    wallet_sessions.reset(user_id)
+    if wallet_row.get("failed_attempts") or locked_until:
+        supabase.table("crypto_wallets").update({
+            "failed_attempts": 0,
+            "locked_until": None
+        }).eq("user_id", user_id).execute()
 
-    return jsonify({"success": True, "session_token": session_token})
+    session_token, expires_at = wallet_sessions.issue(user_id)
+    return jsonify({"success": True, "session_token": session_token, "expires_at": expires_at})
+
+
+@wallet.route("/api/wallet/session/revoke", methods=["POST"])
+@wallet_auth
+def revoke_session():
+    token = request.headers.get("X-Wallet-Session", "")
+    if token:
+        wallet_sessions.revoke(token)
+    return jsonify({"success": True, "message": "Wallet locked"})
 
 # ════════════════════════════════════════════════════════
 #  DEPOSIT ROUTES
 # ════════════════════════════════════════════════════════
 
+# Unexpired pending payments keyed by (user_id, amount), so repeated taps reuse
+# the same address instead of creating new NOWPayments payments. The cache is
+# per worker and the IPN may be handled by another one, so an entry is only
+# reused after deposit_still_pending confirms it in the DB.
+pending_deposits = TTLCache(maxsize=50000, ttl=DEPOSIT_CACHE_TTL)
+
+def deposit_cache_key(user_id, amount):
+    return (str(user_id), round(float(amount), 2))
+
+def deposit_cache_ttl(payment):
+    """Seconds until the provider expires the payment, minus a safety margin"""
+    expires = payment.get("expiration_estimate_date")
+    if not expires:
+        return DEPOSIT_CACHE_TTL
+    try:
+        expires_dt = datetime.fromisoformat(expires.replace("Z", "+00:00"))
+        return int((expires_dt - datetime.now(timezone.utc)).total_seconds()) - 60
+    except ValueError:
+        return DEPOSIT_CACHE_TTL
+
+def deposit_still_pending(payment_id):
+    row = supabase.table("crypto_transactions").select("status") \
+        .eq("tx_hash", str(payment_id)).eq("type", "deposit").limit(1).execute()
+    return bool(row.data) and row.data[0]["status"] == "pending"
+
+
 @wallet.route("/api/wallet/deposit/create", methods=["POST"])
 @wallet_auth
 @rate_limit(max_calls=10, window=60)
@@ -216,6 +252,13 @@ def create_deposit():
 
     user_id = request.user["id"]
 
+    cache_key = deposit_cache_key(user_id, amount)
+    cached = pending_deposits.get(cache_key)
+    if cached:
+        if deposit_still_pending(cached["payment_id"]):
+            return jsonify(dict(cached, reused=True))
+        pending_deposits.delete(cache_key)
+
     # Create NOWPayments payment
     payment = create_nowpay_deposit(user_id, amount)
     if not payment:
@@ -236,6 +279,7 @@ def create_deposit():
         "destination": pay_address,
         "created_at": datetime.now(timezone.utc).isoformat()
     }).execute()
+    history.invalidate(user_id)
 
     # Save address to wallet row
     existing = supabase.table("crypto_wallets").select("id").eq("user_id", user_id).execute()
@@ -244,14 +288,16 @@ def create_deposit():
     else:
         supabase.table("crypto_wallets").insert({"user_id": user_id, "deposit_address": pay_address}).execute()
 
-    return jsonify({
+    result = {
         "success": True,
         "payment_id": payment_id,
         "address": pay_address,
         "amount": pay_amount,
         "currency": "USDT TRC20",
         "network": "TRON"
-    })
+    }
+    pending_deposits.set(cache_key, result, ttl=deposit_cache_ttl(payment))
+    return jsonify(result)
 
 
 @wallet.route("/api/wallet/balance", methods=["GET"])
@@ -273,11 +319,13 @@ def get_balance():
 @wallet.route("/api/wallet/transactions", methods=["GET"])
 @wallet_auth
 def get_transactions():
-    user_id = request.user["id"]
-    result = supabase.table("crypto_transactions") \
-        .select("*").eq("user_id", user_id) \
-        .order("created_at", desc=True).limit(50).execute()
-    return jsonify({"success": True, "transactions": result.data or []})
+    try:
+        rows, next_cursor = history.fetch("wallet", request.user["id"], history.parse_filters(request.args),
+                                          cursor=request.args.get("cursor"),
+                                          limit=page_limit(request.args.get("limit"), default=50, maximum=200))
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    return jsonify({"success": True, "transactions": rows, "next_cursor": next_cursor})
 
 # ════════════════════════════════════════════════════════
 #  WITHDRAWAL ROUTES
@@ -285,6 +333,7 @@ def get_transactions():
 
 @wallet.route("/api/wallet/withdraw", methods=["POST"])
 @wallet_auth
+@wallet_session_required
 @rate_limit(max_calls=3, window=3600)
 def request_withdrawal():
     data = request.json or {}
@@ -306,20 +355,20 @@ def request_withdrawal():
     if existing.data:
         return jsonify({"success": True, "message": "Already submitted", "status": existing.data[0]["status"]})
 
-    # Balance check
-    wallet_row = supabase.table("crypto_wallets").select("usdt_balance").eq("user_id", user_id).execute()
-    if not wallet_row.data or float(wallet_row.data[0].get("usdt_balance") or 0) < amount:
+    # Check and deduct balance in one atomic ledger call
+    debit = ledger.debit(user_id, amount, "withdrawal", ref=f"withdrawal:{idempotency_key}")
+    if not debit["ok"]:
+        if debit["error"] == "duplicate":
+            return jsonify({"success": True, "message": "Already submitted", "status": "pending"})
+        if debit["error"] == "ledger_error":
+            return jsonify({"success": False, "error": "Wallet service unavailable. Try again shortly."}), 503
         return jsonify({"success": False, "error": "Insufficient balance"}), 400
 
-    # Deduct balance immediately
-    new_balance = float(wallet_row.data[0]["usdt_balance"]) - amount
-    supabase.table("crypto_wallets").update({"usdt_balance": new_balance}).eq("user_id", user_id).execute()
-
-    payout_result = None
-
-    # Auto payout for crypto withdrawals via NOWPayments
-    if withdraw_type == "crypto":
-        payout_result = create_nowpay_payout(destination, amount)
+    # Crypto withdrawals are queued for the next NOWPayments mass payout; the
+    # external id ties the request, its transaction row and the payout webhook together
+    is_crypto = withdraw_type == "crypto"
+    withdrawal_id = str(uuid.uuid4()) if is_crypto else None
+    status = "queued" if is_crypto else "pending"
 
     # Save withdrawal request
     supabase.table("crypto_withdrawal_requests").insert({
@@ -327,9 +376,9 @@ def request_withdrawal():
         "amount": amount,
         "type": withdraw_type,
         "destination": destination,
-        "status": "processing" if (payout_result and payout_result.get("success")) else "pending",
+        "status": status,
         "idempotency_key": idempotency_key,
-        "nowpay_withdrawal_id": payout_result.get("withdrawal_id") if payout_result else None,
+        "nowpay_withdrawal_id": withdrawal_id,
         "created_at": datetime.now(timezone.utc).isoformat()
     }).execute()
 
@@ -338,13 +387,16 @@ def request_withdrawal():
         "user_id": user_id,
         "type": "withdrawal",
         "amount": amount,
-        "status": "processing" if (payout_result and payout_result.get("success")) else "pending",
+        "status": status,
+        "tx_hash": withdrawal_id,
         "destination": destination,
         "withdraw_type": withdraw_type,
         "created_at": datetime.now(timezone.utc).isoformat()
     }).execute()
+    history.invalidate(user_id)
 
-    if withdraw_type == "crypto" and payout_result and payout_result.get("success"):
+    if is_crypto:
+        payouts.notify()
         return jsonify({"success": True, "message": "Withdrawal processing! USDT will arrive in your wallet shortly."})
     elif withdraw_type == "bank":
         return jsonify({"success": True, "message": "Bank withdrawal submitted! You will receive NGN within 24 hours."})
@@ -355,72 +407,158 @@ def request_withdrawal():
 #  NOWPAYMENTS WEBHOOK
 # ════════════════════════════════════════════════════════
 
-@wallet.route("/api/wallet/webhook/nowpayments", methods=["POST"])
-def nowpay_webhook():
-    # Verify signature
-    sig = request.headers.get("x-nowpayments-sig", "")
-    if NOWPAY_IPN_SECRET and sig:
-        if not verify_ipn_signature(request.data, sig):
-            print("Invalid NOWPayments webhook signature")
-            return jsonify({"error": "Invalid signature"}), 401
+# ── Processed-payment index ──────────────────────────────
+processed_payments = ProcessedIndex()
 
-    data = request.json or {}
-    print(f"NOWPayments webhook: {data}")
+def warm_processed_payments(limit=PAYMENT_INDEX_WARM, page=1000):
+    """Load recent confirmed deposit payment ids so NOWPayments retries skip the DB"""
+    try:
+        keys = []
+        for offset in range(0, limit, page):
+            rows = supabase.table("crypto_transactions").select("tx_hash") \
+                .eq("type", "deposit").eq("status", "confirmed") \
+                .order("created_at", desc=True).range(offset, offset + page - 1).execute()
+            keys += [r["tx_hash"] for r in (rows.data or []) if r.get("tx_hash")]
+            if len(rows.data or []) < page:
+                break
+        # Oldest first so the newest ids end up most recent in the LRU
+        processed_payments.warm(reversed(keys))
+        print(f"Processed-payment index warmed with {len(keys)} ids")
+    except Exception as e:
+        print(f"Processed-payment index warm-up failed: {e}")
 
+threading.Thread(target=warm_processed_payments, name="payment-index-warm", daemon=True).start()
+
+def process_nowpay_event(data):
+    """Apply one NOWPayments IPN event. Runs on the webhook queue consumer; raising retries it."""
     payment_status  = data.get("payment_status", "")
     payment_id      = str(data.get("payment_id", ""))
     order_id        = data.get("order_id", "")  # this is user_id
     actually_paid   = float(data.get("actually_paid", 0))
-    pay_currency    = data.get("pay_currency", "")
+
+    # Once the user pays, their pending payment must not be handed out again
+    if order_id and data.get("price_amount") and payment_status not in ["waiting", ""]:
+        pending_deposits.delete(deposit_cache_key(order_id, data["price_amount"]))
 
     # Only process confirmed/finished deposits
     if payment_status in ["finished", "confirmed", "partially_paid"]:
         if not order_id or actually_paid <= 0:
-            return jsonify({"status": "ignored"}), 200
-
-        # Prevent duplicate processing
-        existing = supabase.table("crypto_transactions") \
-            .select("id").eq("tx_hash", payment_id).eq("status", "confirmed").execute()
-        if existing.data:
-            return jsonify({"status": "already processed"}), 200
+            return "ignored"
+
+        # Prevent duplicate processing — the DB is only asked when the index can't rule it out
+        seen = processed_payments.check(payment_id)
+        if seen:
+            return "already processed"
+        if seen is None:
+            existing = supabase.table("crypto_transactions") \
+                .select("id").eq("tx_hash", payment_id).eq("status", "confirmed").execute()
+            if existing.data:
+                processed_payments.add(payment_id)
+                return "already processed"
 
         user_id = order_id
 
-        # Credit balance
-        wallet_row = supabase.table("crypto_wallets").select("usdt_balance").eq("user_id", user_id).execute()
-        if wallet_row.data:
-            new_bal = float(wallet_row.data[0].get("usdt_balance") or 0) + actually_paid
-            supabase.table("crypto_wallets").update({
-                "usdt_balance": new_bal,
-                "last_deposit_at": datetime.now(timezone.utc).isoformat()
-            }).eq("user_id", user_id).execute()
-        else:
-            supabase.table("crypto_wallets").insert({
-                "user_id": user_id,
-                "usdt_balance": actually_paid,
-                "last_deposit_at": datetime.now(timezone.utc).isoformat()
-            }).execute()
-
-        # Update transaction status
+        # Credit balance (creates the wallet row if needed; ref makes retries a no-op)
+        credit = ledger.credit(user_id, actually_paid, "deposit", ref=f"deposit:{payment_id}",
+                               create=True, touch_deposit=True)
+        if not credit["ok"] and credit["error"] != "duplicate":
+            raise Exception(f"Credit failed: {credit['error']}")
+
+        # Update transaction status (also on duplicate, in case a previous attempt stopped here)
         supabase.table("crypto_transactions").update({
             "status": "confirmed",
             "amount": actually_paid
         }).eq("tx_hash", payment_id).execute()
+        history.invalidate(user_id)
+        processed_payments.add(payment_id)
 
         print(f"Deposit confirmed: {actually_paid} USDT for user {user_id}")
+        return "credited"
 
     # Handle payout/withdrawal webhook
     elif payment_status in ["payout_completed"]:
         withdrawal_id = data.get("unique_external_id", "")
         if withdrawal_id:
-            supabase.table("crypto_withdrawal_requests").update({
+            # Only a payout still in flight may be approved; a declined (and
+            # refunded) request must never flip to approved
+            in_flight = ["processing", "batching", "pending"]
+            approved = supabase.table("crypto_withdrawal_requests").update({
                 "status": "approved"
-            }).eq("nowpay_withdrawal_id", withdrawal_id).execute()
-            supabase.table("crypto_transactions").update({
+            }).eq("nowpay_withdrawal_id", withdrawal_id).in_("status", in_flight).execute()
+            if not approved.data:
+                current = supabase.table("crypto_withdrawal_requests").select("status") \
+                    .eq("nowpay_withdrawal_id", withdrawal_id).execute()
+                status = current.data[0]["status"] if current.data else None
+                if status != "approved":
+                    # Retry of an already approved payout falls through; anything else needs a human
+                    print(f"ALERT: payout_completed for withdrawal {withdrawal_id} in status {status}; "
+                          f"not applied — check whether the user was both paid and refunded")
+                    return "payout conflict"
+            updated = supabase.table("crypto_transactions").update({
                 "status": "completed"
-            }).eq("withdraw_type", "crypto").eq("status", "processing").execute()
+            }).eq("tx_hash", withdrawal_id).eq("type", "withdrawal").in_("status", in_flight).execute()
+            history.invalidate(*{r["user_id"] for r in (updated.data or [])})
+        return "payout updated"
+
+    return "ignored"
+
+nowpay_events.start(process_nowpay_event)
+
+@jobs.queue.handler("log_webhook")
+def store_webhook_log(provider, event):
+    supabase.table("webhook_log").insert({
+        "provider": provider,
+        "payment_id": str(event.get("payment_id") or event.get("unique_external_id") or ""),
+        "status": event.get("payment_status"),
+        "payload": event
+    }).execute()
+
+@wallet.before_app_request
+def _start_webhook_consumer():
+    # Background threads do not survive a fork; start them in each worker
+    nowpay_events.ensure_consumer()
+    payouts.ensure_started()
+
+
+@wallet.route("/api/wallet/webhook/nowpayments", methods=["POST"])
+def nowpay_webhook():
+    started = time.perf_counter()
+
+    # Verify signature
+    sig = request.headers.get("x-nowpayments-sig", "")
+    if NOWPAY_IPN_SECRET and sig:
+        if not verify_ipn_signature(request.data, sig):
+            print("Invalid NOWPayments webhook signature")
+            return jsonify({"error": "Invalid signature"}), 401
 
-    return jsonify({"status": "ok"}), 200
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not data.get("payment_status"):
+        return jsonify({"status": "ignored"}), 200
+
+    # Retries of an already-credited payment are acked without touching the queue or DB
+    if data.get("payment_status") in ["finished", "confirmed", "partially_paid"] \
+            and processed_payments.check(str(data.get("payment_id", ""))):
+        nowpay_events.record_ack(started)
+        return jsonify({"status": "already processed"}), 200
+
+    # Persist and ack; crediting happens on the queue consumer
+    payment_key = data.get("payment_id") or data.get("unique_external_id") or data.get("id") or ""
+    try:
+        nowpay_events.enqueue(payment_key, data)
+    except Exception as e:
+        print(f"Webhook enqueue failed: {e}")
+        # Non-2xx so NOWPayments retries later
+        return jsonify({"error": "Temporarily unavailable"}), 503
+
+    # Logged once per delivery here, not in process_nowpay_event, which
+    # runs again on every queue retry
+    try:
+        jobs.queue.enqueue("log_webhook", provider="nowpayments", event=data)
+    except Exception as e:
+        print(f"NOWPayments webhook (log enqueue failed: {e}): {data}")
+
+    nowpay_events.record_ack(started)
+    return jsonify({"status": "queued"}), 200
 
 # ════════════════════════════════════════════════════════
 #  ADMIN ROUTE
@@ -442,20 +580,71 @@ def admin_withdrawal(req_id):
         return jsonify({"error": "Not found"}), 404
 
     wr = req.data[0]
+    expected = wr["status"]
+
+    if expected in ["batching", "processing"]:
+        return jsonify({"error": "Payout already sent to NOWPayments"}), 400
+    if expected not in ["queued", "pending"]:
+        return jsonify({"error": f"Withdrawal already {expected}"}), 400
+
+    # Conditional on the status we read, so a payout batch claiming the row
+    # at the same moment makes exactly one of the two updates win
+    def transition(status):
+        moved = supabase.table("crypto_withdrawal_requests").update({"status": status}) \
+            .eq("id", req_id).eq("status", expected).execute()
+        return bool(moved.data)
+
+    # Match this request's own transaction row; older rows have no external id
+    def match_tx(query):
+        if wr.get("nowpay_withdrawal_id"):
+            return query.eq("tx_hash", wr["nowpay_withdrawal_id"])
+        return query.eq("user_id", wr["user_id"]).eq("type", "withdrawal").eq("status", "pending")
 
     if action == "approve":
-        supabase.table("crypto_withdrawal_requests").update({"status": "approved"}).eq("id", req_id).execute()
-        supabase.table("crypto_transactions").update({"status": "completed"}) \
-            .eq("user_id", wr["user_id"]).eq("type", "withdrawal").eq("status", "pending").execute()
+        if not transition("approved"):
+            return jsonify({"error": "Withdrawal status changed; reload and try again"}), 409
+        match_tx(supabase.table("crypto_transactions").update({"status": "completed"})).execute()
+        history.invalidate(wr["user_id"])
         return jsonify({"success": True, "message": "Approved"})
 
     elif action == "decline":
-        # Refund
-        w = supabase.table("crypto_wallets").select("usdt_balance").eq("user_id", wr["user_id"]).execute()
-        if w.data:
-            refunded = float(w.data[0].get("usdt_balance") or 0) + float(wr["amount"])
-            supabase.table("crypto_wallets").update({"usdt_balance": refunded}).eq("user_id", wr["user_id"]).execute()
-        supabase.table("crypto_withdrawal_requests").update({"status": "declined"}).eq("id", req_id).execute()
-        supabase.table("crypto_transactions").update({"status": "refunded"}) \
-            .eq("user_id", wr["user_id"]).eq("type", "withdrawal").eq("status", "pending").execute()
+        if not transition("declined"):
+            return jsonify({"error": "Withdrawal status changed; reload and try again"}), 409
+        # Refund (ref guards against refunding the same request twice)
+        refund = ledger.credit(wr["user_id"], wr["amount"], "withdrawal_refund", ref=f"refund:{req_id}")
+        if not refund["ok"] and refund["error"] != "duplicate":
+            # Put the request back so the decline can be retried
+            supabase.table("crypto_withdrawal_requests").update({"status": expected}) \
+                .eq("id", req_id).eq("status", "declined").execute()
+            return jsonify({"error": "Refund failed"}), 500
+        match_tx(supabase.table("crypto_transactions").update({"status": "refunded"})).execute()
+        history.invalidate(wr["user_id"])
         return jsonify({"success": True, "message": "Declined and refunded"})
+
+
+@wallet.route("/api/wallet/admin/webhook-queue", methods=["GET"])
+def admin_webhook_queue():
+    """Queue depth, consumer lag and this worker's ack latency"""
+    if request.headers.get("x-admin-key") != ADMIN_SECRET:
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify({"success": True, "queue": nowpay_events.stats()})
+
+
+@wallet.route("/api/wallet/admin/nowpay-stats", methods=["GET"])
+def admin_nowpay_stats():
+    """Circuit breaker state and per-endpoint NOWPayments latency histograms"""
+    if request.headers.get("x-admin-key") != ADMIN_SECRET:
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify({"success": True, "nowpayments": nowpay.stats()})
+
+
+@wallet.route("/api/wallet/admin/payouts/flush", methods=["POST"])
+def admin_flush_payouts():
+    """Send queued crypto withdrawals now instead of waiting for the batch interval"""
+    if request.headers.get("x-admin-key") != ADMIN_SECRET:
+        return jsonify({"error": "Unauthorized"}), 401
+    try:
+        sent = payouts.flush()
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+    return jsonify({"success": True, "batched": sent})
@@ -0,0 +1,161 @@
+import os, hashlib, secrets, threading, time
+from local_store import connect, store_path
+from cache import TTLCache
+
+WALLET_SESSION_BACKEND = os.environ.get("WALLET_SESSION_BACKEND", "shared")  # shared | memory
+WALLET_SESSION_DB      = os.environ.get("WALLET_SESSION_DB") or store_path("wallet_sessions.db")
+WALLET_SESSION_TTL     = int(os.environ.get("WALLET_SESSION_TTL", 1800))
+# Until every client sends X-Wallet-Session, withdrawals without the header
+# are still accepted; set to true once old app versions are retired
+WALLET_SESSION_ENFORCE = os.environ.get("WALLET_SESSION_ENFORCE", "false").lower() == "true"
+PIN_MAX_ATTEMPTS       = int(os.environ.get("PIN_MAX_ATTEMPTS", 5))
+PIN_LOCKOUT_SECONDS    = int(os.environ.get("PIN_LOCKOUT_SECONDS", 1800))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS wallet_sessions (
+    token_hash TEXT PRIMARY KEY,
+    user_id    TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS wallet_sessions_user_idx ON wallet_sessions (user_id);
+CREATE TABLE IF NOT EXISTS pin_attempts (
+    user_id      TEXT PRIMARY KEY,
+    failed       INTEGER NOT NULL,
+    locked_until REAL
+);
+"""
+
+def _hash(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+# ── Wallet session + PIN lockout store ───────────────────
+class WalletSessionStore:
+    """
+    Wallet sessions (issued after PIN verification) and PIN failure counters.
+    Validation needs no network round trip. With the shared backend every
+    validate reads the SQLite file shared by the workers on the host, so a
+    revoke in one worker takes effect in all of them immediately; only
+    token hashes are stored on disk. WALLET_SESSION_BACKEND=memory keeps
+    sessions in this worker's memory only.
+    """
+
+    def __init__(self, backend=WALLET_SESSION_BACKEND, path=WALLET_SESSION_DB):
+        self.shared = backend == "shared"
+        self.path = path
+        self.sessions = TTLCache(maxsize=100000, ttl=WALLET_SESSION_TTL)  # memory backend
+        self.revoked_at = {}  # user_id -> time of last revoke_user (memory backend)
+        self.attempts = {}    # user_id -> [failed, locked_until] (memory backend)
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+
+    def _conn(self):
+        return connect(self.path, SCHEMA)
+
+    # ── Sessions ─────────────────────────────────────────
+    def issue(self, user_id, ttl=WALLET_SESSION_TTL):
+        token = secrets.token_urlsafe(32)
+        now = time.time()
+        expires_at = now + ttl
+        if self.shared:
+            conn = self._conn()
+            conn.execute("INSERT INTO wallet_sessions VALUES (?, ?, ?)", (_hash(token), str(user_id), expires_at))
+            self._purge(conn)
+        else:
+            self.sessions.set(_hash(token), (str(user_id), expires_at, now), ttl=ttl)
+        return token, int(expires_at)
+
+    def validate(self, token, user_id):
+        if not token:
+            return False
+        key = _hash(token)
+        if self.shared:
+            # Not cached in memory: a positive cached here would outlive a
+            # revoke made by another worker
+            row = self._conn().execute(
+                "SELECT user_id, expires_at FROM wallet_sessions WHERE token_hash = ?", (key,)
+            ).fetchone()
+            return bool(row) and row[0] == str(user_id) and row[1] > time.time()
+        entry = self.sessions.get(key)
+        return bool(entry) and entry[0] == str(user_id) and entry[1] > time.time() \
+            and entry[2] > self.revoked_at.get(str(user_id), 0)
+
+    def revoke(self, token):
+        key = _hash(token)
+        if self.shared:
+            self._conn().execute("DELETE FROM wallet_sessions WHERE token_hash = ?", (key,))
+        else:
+            self.sessions.delete(key)
+
+    def revoke_user(self, user_id):
+        """Drop every session of a user (PIN change, ban)"""
+        if self.shared:
+            self._conn().execute("DELETE FROM wallet_sessions WHERE user_id = ?", (str(user_id),))
+        else:
+            self.revoked_at[str(user_id)] = time.time()
+
+    def _purge(self, conn):
+        now = time.time()
+        if now - self._last_purge > 300:
+            self._last_purge = now
+            conn.execute("DELETE FROM wallet_sessions WHERE expires_at < ?", (now,))
+
+    # ── PIN lockout ──────────────────────────────────────
+    def _get_attempts(self, user_id):
+        if self.shared:
+            row = self._conn().execute(
+                "SELECT failed, locked_until FROM pin_attempts WHERE user_id = ?", (str(user_id),)
+            ).fetchone()
+            return list(row) if row else [0, None]
+        return list(self.attempts.get(str(user_id), [0, None]))
+
+    def locked_until(self, user_id):
+        """Epoch seconds the wallet is locked until, or None"""
+        locked = self._get_attempts(user_id)[1]
+        return locked if locked and locked > time.time() else None
+
+    def record_failure(self, user_id):
+        """Count a wrong PIN. Returns (failed_attempts, locked_until or None)."""
+        uid = str(user_id)
+        if self.shared:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT failed, locked_until FROM pin_attempts WHERE user_id = ?", (uid,)).fetchone()
+                failed = (row[0] if row and not (row[1] and row[1] <= time.time()) else 0) + 1
+                locked = time.time() + PIN_LOCKOUT_SECONDS if failed >= PIN_MAX_ATTEMPTS else None
+                conn.execute(
+                    "INSERT INTO pin_attempts VALUES (?, ?, ?) ON CONFLICT (user_id) "
+                    "DO UPDATE SET failed = excluded.failed, locked_until = excluded.locked_until",
+                    (uid, failed, locked)
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            return failed, locked
+        with self._lock:
+            failed, locked = self.attempts.get(uid, [0, None])
+            if locked and locked <= time.time():
+                failed = 0
+            failed += 1
+            locked = time.time() + PIN_LOCKOUT_SECONDS if failed >= PIN_MAX_ATTEMPTS else None
+            self.attempts[uid] = [failed, locked]
+            return failed, locked
+
+    def lock(self, user_id, locked_until, failed=PIN_MAX_ATTEMPTS):
+        """Restore a lockout persisted in the DB (e.g. after a restart)"""
+        if self.shared:
+            self._conn().execute(
+                "INSERT OR REPLACE INTO pin_attempts VALUES (?, ?, ?)", (str(user_id), failed, locked_until))
+        else:
+            with self._lock:
+                self.attempts[str(user_id)] = [failed, locked_until]
+
+    def reset(self, user_id):
+        if self.shared:
+            self._conn().execute("DELETE FROM pin_attempts WHERE user_id = ?", (str(user_id),))
+        else:
+            with self._lock:
+                self.attempts.pop(str(user_id), None)
+
+wallet_sessions = WalletSessionStore()
@@ -0,0 +1,199 @@
+import os, json, threading, time, uuid
+from collections import deque
+from local_store import connect, durable_path
+
+WEBHOOK_QUEUE_DB       = os.environ.get("WEBHOOK_QUEUE_DB") or durable_path("webhooks.db")
+WEBHOOK_MAX_ATTEMPTS   = int(os.environ.get("WEBHOOK_MAX_ATTEMPTS", 8))
+WEBHOOK_POLL_INTERVAL  = float(os.environ.get("WEBHOOK_POLL_INTERVAL", 0.5))
+WEBHOOK_CLAIM_TIMEOUT  = float(os.environ.get("WEBHOOK_CLAIM_TIMEOUT", 120))
+WEBHOOK_RETAIN_SECONDS = float(os.environ.get("WEBHOOK_RETAIN_SECONDS", 7 * 86400))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS webhook_events (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    payment_key  TEXT    NOT NULL,
+    payload      TEXT    NOT NULL,
+    status       TEXT    NOT NULL DEFAULT 'queued',   -- queued | processing | done | failed
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    received_at  REAL    NOT NULL,
+    available_at REAL    NOT NULL,
+    claimed_by   TEXT,
+    claimed_at   REAL,
+    finished_at  REAL,
+    last_error   TEXT
+);
+CREATE INDEX IF NOT EXISTS webhook_events_status_idx ON webhook_events (status, id);
+CREATE INDEX IF NOT EXISTS webhook_events_key_idx ON webhook_events (payment_key, status, id);
+"""
+
+# Oldest runnable event whose payment has nothing earlier still pending,
+# so events for one payment are always applied in arrival order.
+CLAIM_SQL = """
+SELECT id, payload, attempts, received_at FROM webhook_events e
+WHERE status = 'queued' AND available_at <= ?
+  AND NOT EXISTS (
+      SELECT 1 FROM webhook_events p
+      WHERE p.payment_key = e.payment_key AND p.id < e.id
+        AND p.status IN ('queued', 'processing')
+  )
+ORDER BY id LIMIT 1
+"""
+
+# ── Durable webhook queue ────────────────────────────────
+class WebhookQueue:
+    """
+    Append-only SQLite queue for provider callbacks. The webhook route only
+    validates and enqueues before acking: one local insert, fsync'd
+    (synchronous=FULL) into a file under DURABLE_STORE_DIR. A background
+    consumer thread in each worker claims events and runs the handler,
+    retrying with backoff and parking events as 'failed' after
+    WEBHOOK_MAX_ATTEMPTS.
+    """
+
+    def __init__(self, path=WEBHOOK_QUEUE_DB):
+        self.path = path
+        self.handler = None
+        self._consumer_pid = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._ack_ms = deque(maxlen=1000)
+        self._lag_s = deque(maxlen=1000)
+        self._processed = 0
+        self._errors = 0
+
+    def _conn(self):
+        return connect(self.path, SCHEMA, durable=True)
+
+    def enqueue(self, payment_key, payload):
+        now = time.time()
+        self._conn().execute(
+            "INSERT INTO webhook_events (payment_key, payload, received_at, available_at) VALUES (?, ?, ?, ?)",
+            (str(payment_key), json.dumps(payload), now, now)
+        )
+        self.ensure_consumer()
+        self._wake.set()
+
+    def record_ack(self, started):
+        self._ack_ms.append((time.perf_counter() - started) * 1000)
+
+    # ── Consumer ─────────────────────────────────────────
+    def ensure_consumer(self):
+        """Start the consumer thread once per process (safe after fork)"""
+        if self.handler is None or self._consumer_pid == os.getpid():
+            return
+        with self._lock:
+            if self._consumer_pid == os.getpid():
+                return
+            self._consumer_pid = os.getpid()
+            self._worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+            threading.Thread(target=self._run, name="webhook-consumer", daemon=True).start()
+
+    def start(self, handler):
+        self.handler = handler
+        self.ensure_consumer()
+
+    def _claim(self):
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Release events held by a consumer that died mid-processing
+            conn.execute(
+                "UPDATE webhook_events SET status = 'queued', claimed_by = NULL "
+                "WHERE status = 'processing' AND claimed_at < ?",
+                (now - WEBHOOK_CLAIM_TIMEOUT,)
+            )
+            row = conn.execute(CLAIM_SQL, (now,)).fetchone()
+            if row:
+                conn.execute(
+                    "UPDATE webhook_events SET status = 'processing', claimed_by = ?, claimed_at = ? WHERE id = ?",
+                    (self._worker_id, now, row[0])
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return row
+
+    def _run(self):
+        last_purge = 0.0
+        while True:
+            try:
+                row = self._claim()
+            except Exception as e:
+                print(f"Webhook queue claim error: {e}")
+                row = None
+            if not row:
+                if time.time() - last_purge > 3600:
+                    self._purge()
+                    last_purge = time.time()
+                self._wake.wait(WEBHOOK_POLL_INTERVAL)
+                self._wake.clear()
+                continue
+            self._process(*row)
+
+    def _process(self, event_id, payload, attempts, received_at):
+        conn = self._conn()
+        try:
+            self.handler(json.loads(payload))
+        except Exception as e:
+            attempts += 1
+            self._errors += 1
+            status = "failed" if attempts >= WEBHOOK_MAX_ATTEMPTS else "queued"
+            backoff = min(2 ** attempts, 300)
+            print(f"Webhook event {event_id} failed (attempt {attempts}, {status}): {e}")
+            conn.execute(
+                "UPDATE webhook_events SET status = ?, attempts = ?, available_at = ?, last_error = ?, claimed_by = NULL "
+                "WHERE id = ?",
+                (status, attempts, time.time() + backoff, str(e)[:500], event_id)
+            )
+            return
+        finished = time.time()
+        conn.execute(
+            "UPDATE webhook_events SET status = 'done', attempts = ?, finished_at = ? WHERE id = ?",
+            (attempts + 1, finished, event_id)
+        )
+        self._processed += 1
+        self._lag_s.append(finished - received_at)
+
+    def _purge(self):
+        try:
+            self._conn().execute(
+                "DELETE FROM webhook_events WHERE status = 'done' AND finished_at < ?",
+                (time.time() - WEBHOOK_RETAIN_SECONDS,)
+            )
+        except Exception as e:
+            print(f"Webhook queue purge error: {e}")
+
+    # ── Metrics ──────────────────────────────────────────
+    def stats(self):
+        conn = self._conn()
+        counts = dict(conn.execute("SELECT status, COUNT(*) FROM webhook_events GROUP BY status").fetchall())
+        oldest = conn.execute("SELECT MIN(received_at) FROM webhook_events WHERE status IN ('queued', 'processing')").fetchone()[0]
+        return {
+            "queued": counts.get("queued", 0),
+            "processing": counts.get("processing", 0),
+            "failed": counts.get("failed", 0),
+            "done": counts.get("done", 0),
+            "consumer_lag_seconds": round(time.time() - oldest, 3) if oldest else 0,
+            "worker": {
+                "processed": self._processed,
+                "errors": self._errors,
+                "ack_ms": _summary(self._ack_ms),
+                "lag_seconds": _summary(self._lag_s)
+            }
+        }
+
+def _summary(samples):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return {
+        "avg": round(sum(ordered) / len(ordered), 3),
+        "p50": round(ordered[len(ordered) // 2], 3),
+        "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+        "max": round(ordered[-1], 3)
+    }
+
+nowpay_events = WebhookQueue()